@@ -0,0 +1,453 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import logging
+import zlib
+from typing import (
+    Any,
+    AsyncIterator,
+    Collection,
+    DefaultDict,
+    Dict,
+    List,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import h3  # type: ignore
+from types_aiobotocore_dynamodb.client import DynamoDBClient
+
+from app.dynamodb import merge_pages, paginate
+from app.models import PingRecord
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Pre-aggregated congestion, one item per hex per minute holding the distinct
+# devices seen there. `/congestion` reads a window's worth of these instead of
+# every raw ping, so its cost no longer grows with how often devices ping.
+#
+# Each ping is also counted in its parent cell at every resolution in
+# `aggregate_index_resolutions`. Those area items hold the active child hexes
+# as well, and an `h3_res` attribute that plain hex items don't have, so a
+# coarse area is one key lookup however many children it has. An area item
+# stops taking devices once it holds `aggregate_area_max_devices`, and the
+# minute spills into `<minute>#1`, `<minute>#2` and so on. The spill keys still sort
+# after the minute, so the same `ts_minute >= :cutoff` range reads them.
+#
+# With `aggregate_minute_index_enabled`, hex items also carry a `minute_shard`
+# key, their minute plus a shard picked from the hex, and a GSI on it lets the
+# global read query each minute of the window rather than scan the table. Area
+# items don't get the key, so the sparse index only ever holds hex items.
+
+# Doc Ref: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Expressions.UpdateExpressions.html#Expressions.UpdateExpressions.ADD
+# Doc Ref: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/TTL.html
+
+
+# Helper to check the aggregate table exists
+async def create_aggregate_table_if_not_exists(
+    dynamodb_client: DynamoDBClient, dynamodb_table_name: str
+) -> None:
+    try:
+        table = await dynamodb_client.describe_table(TableName=dynamodb_table_name)
+        logger.info(f"Table {dynamodb_table_name} already exists")
+        index_names = {
+            index["IndexName"]
+            for index in table["Table"].get("GlobalSecondaryIndexes", [])
+        }
+        if (
+            settings.aggregate_minute_index_enabled
+            and settings.aggregate_minute_index_name not in index_names
+        ):
+            logger.warning(
+                f"Table {dynamodb_table_name} is missing the "
+                f"{settings.aggregate_minute_index_name} index, global congestion "
+                f"queries will fail until it is added"
+            )
+    except dynamodb_client.exceptions.ResourceNotFoundException:
+        logger.info(f"Table {dynamodb_table_name} does not exist, creating it")
+        attribute_definitions: List[Dict[str, Any]] = [
+            {"AttributeName": "h3_hex", "AttributeType": "S"},
+            {"AttributeName": "ts_minute", "AttributeType": "S"},
+        ]
+        indexes: Dict[str, Any] = {}
+        if settings.aggregate_minute_index_enabled:
+            attribute_definitions.append(
+                {"AttributeName": "minute_shard", "AttributeType": "S"}
+            )
+            indexes["GlobalSecondaryIndexes"] = [
+                {
+                    "IndexName": settings.aggregate_minute_index_name,
+                    "KeySchema": [
+                        {"AttributeName": "minute_shard", "KeyType": "HASH"},
+                    ],
+                    "Projection": {
+                        "ProjectionType": "INCLUDE",
+                        "NonKeyAttributes": ["device_ids"],
+                    },
+                }
+            ]
+        await dynamodb_client.create_table(
+            TableName=dynamodb_table_name,
+            KeySchema=[
+                {"AttributeName": "h3_hex", "KeyType": "HASH"},
+                {"AttributeName": "ts_minute", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=attribute_definitions,  # type: ignore[arg-type]
+            BillingMode="PAY_PER_REQUEST",
+            **indexes,
+        )
+
+        await dynamodb_client.get_waiter("table_exists").wait(
+            TableName=dynamodb_table_name
+        )
+
+        # Old minutes are never read again, let DynamoDB expire them.
+        await dynamodb_client.update_time_to_live(
+            TableName=dynamodb_table_name,
+            TimeToLiveSpecification={"Enabled": True, "AttributeName": "expires_at"},
+        )
+        logger.info(f"Table {dynamodb_table_name} created")
+
+
+# Truncate a timestamp to the minute bucket it is counted in
+def minute_bucket(ts: datetime) -> str:
+    return ts.astimezone(timezone.utc).replace(second=0, microsecond=0).isoformat()
+
+
+# Minute index partition for a hex item, the shard suffix spreads a busy minute's writes
+def minute_shard_key(minute: str, h3_hex: str) -> str:
+    shard = zlib.crc32(h3_hex.encode()) % settings.aggregate_minute_shards
+    return f"{minute}#{shard}"
+
+
+# Every minute index partition that can hold hex items newer than the cutoff
+def minute_shard_keys(cutoff: datetime) -> List[str]:
+    # Pings can be stamped slightly in the future, so look past now by the allowed skew.
+    end = datetime.now(timezone.utc) + timedelta(
+        seconds=settings.max_clock_skew_seconds
+    )
+    minute = datetime.fromisoformat(minute_bucket(cutoff))
+    keys: List[str] = []
+    while minute <= end:
+        keys.extend(
+            f"{minute.isoformat()}#{shard}"
+            for shard in range(settings.aggregate_minute_shards)
+        )
+        minute += timedelta(minutes=1)
+    return keys
+
+
+class AggregateWriter:
+    """
+    Folds ping records into per-hex, per-minute device sets and flushes them.
+
+    Updates are buffered in memory and flushed every `flush_seconds` with one
+    UpdateItem per hex and minute. `ADD` on a string set is idempotent, so
+    redelivered pings and concurrent workers can't inflate the counts.
+
+    The buffer holds at most `max_pending` keys, and a key that fails
+    `max_attempts` flushes is dropped, so a failing table can't grow it without
+    bound. Records are added once their pings are stored and acknowledged, so a
+    crash loses up to `flush_seconds` of aggregates. The raw pings are kept.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        flush_seconds: float = settings.aggregate_flush_seconds,
+        max_concurrency: int = settings.dynamodb_query_concurrency,
+        index_resolutions: Sequence[int] = settings.aggregate_index_resolutions,
+        max_pending: int = settings.aggregate_max_pending,
+        max_attempts: int = settings.aggregate_max_attempts,
+        max_area_devices: int = settings.aggregate_area_max_devices,
+    ):
+        self._dynamodb_client = dynamodb_client
+        self._dynamodb_table_name = dynamodb_table_name
+        self._flush_seconds = flush_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._index_resolutions = sorted(set(index_resolutions))
+        self._pending: DefaultDict[Tuple[str, str], Set[str]] = defaultdict(set)
+        # Active child hexes of the area items, by the same key
+        self._children: DefaultDict[Tuple[str, str], Set[str]] = defaultdict(set)
+        self._max_pending = max_pending
+        self._max_attempts = max_attempts
+        # Failed flushes so far, for the keys that have failed
+        self._attempts: Dict[Tuple[str, str], int] = {}
+        # Device counts lost to a full buffer or too many failures
+        self.dropped = 0
+        self._max_area_devices = max_area_devices
+        # The spill item each area and minute is being filled from
+        self._area_parts: Dict[Tuple[str, str], int] = {}
+        self._flusher: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        # Don't lose what's still buffered.
+        await self.flush()
+
+    def add(self, ping_record: PingRecord) -> None:
+        """Count the record's device in its hex and minute."""
+        minute = minute_bucket(ping_record.ts)
+        if not self._has_room((ping_record.h3_hex, minute)):
+            self.dropped += 1
+            return
+        self._pending[(ping_record.h3_hex, minute)].add(ping_record.device_id)
+
+        # Fan the ping out to its parents, so coarse areas are read from one item.
+        source_resolution = h3.get_resolution(ping_record.h3_hex)
+        for resolution in self._index_resolutions:
+            if resolution >= source_resolution:
+                break
+            key = (h3.cell_to_parent(ping_record.h3_hex, resolution), minute)
+            if not self._has_room(key):
+                self.dropped += 1
+                continue
+            self._pending[key].add(ping_record.device_id)
+            self._children[key].add(ping_record.h3_hex)
+
+    async def flush(self) -> None:
+        """Write everything buffered so far."""
+        if not self._pending:
+            return
+
+        # Swap the buffer out so new records keep accumulating during the flush.
+        pending, self._pending = self._pending, defaultdict(set)
+        children, self._children = self._children, defaultdict(set)
+        results = await asyncio.gather(
+            *(
+                (
+                    self._update_area(*key, devices, children[key])
+                    if key in children
+                    else self._update(*key, devices)
+                )
+                for key, devices in pending.items()
+            ),
+            return_exceptions=True,
+        )
+
+        failed = 0
+        dropped = 0
+        for (key, devices), result in zip(pending.items(), results):
+            if not isinstance(result, BaseException):
+                self._attempts.pop(key, None)
+                continue
+            failed += 1
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= self._max_attempts or not self._has_room(key):
+                self._attempts.pop(key, None)
+                self.dropped += len(devices)
+                dropped += 1
+                continue
+            # Put it back, the next flush will try again.
+            self._attempts[key] = attempts
+            self._pending[key].update(devices)
+            if key in children:
+                self._children[key].update(children[key])
+        if failed:
+            logger.error(
+                f"Failed to flush {failed} aggregates, dropped {dropped} of them"
+            )
+
+        # Forget the spill items of minutes that have expired.
+        oldest = minute_bucket(
+            datetime.now(timezone.utc)
+            - timedelta(seconds=settings.aggregate_ttl_seconds)
+        )
+        for key in [key for key in self._area_parts if key[1] < oldest]:
+            del self._area_parts[key]
+
+    # Helper to check a key can be buffered without going over `max_pending`
+    def _has_room(self, key: Tuple[str, str]) -> bool:
+        return key in self._pending or len(self._pending) < self._max_pending
+
+    async def _update_area(
+        self, h3_hex: str, minute: str, devices: Set[str], children: Set[str]
+    ) -> None:
+        """Add to an area's items, spilling into the next one as each fills up."""
+        remaining = sorted(devices)
+        part = self._area_parts.get((h3_hex, minute), 0)
+        while remaining:
+            batch = remaining[: self._max_area_devices]
+            try:
+                await self._update(h3_hex, minute, batch, children, part)
+            except self._dynamodb_client.exceptions.ConditionalCheckFailedException:
+                part += 1
+                self._area_parts[(h3_hex, minute)] = part
+                continue
+            remaining = remaining[len(batch) :]
+
+    async def _update(
+        self,
+        h3_hex: str,
+        minute: str,
+        devices: Collection[str],
+        children: Set[str] | None = None,
+        part: int = 0,
+    ) -> None:
+        expires_at = datetime.fromisoformat(minute) + timedelta(
+            seconds=settings.aggregate_ttl_seconds
+        )
+        update = "ADD device_ids :devices SET expires_at = :expires_at"
+        values: Dict[str, Dict[str, Any]] = {
+            ":devices": {"SS": sorted(devices)},
+            ":expires_at": {"N": str(int(expires_at.timestamp()))},
+        }
+        condition: Dict[str, Any] = {}
+        if not children and settings.aggregate_minute_index_enabled:
+            update += ", minute_shard = :minute_shard"
+            values[":minute_shard"] = {"S": minute_shard_key(minute, h3_hex)}
+        if children:
+            update = (
+                "ADD device_ids :devices, child_hexes :children "
+                "SET expires_at = :expires_at, h3_res = :h3_res"
+            )
+            values[":children"] = {"SS": sorted(children)}
+            values[":h3_res"] = {"N": str(h3.get_resolution(h3_hex))}
+            # Only add to an area item with room left, items are capped at 400 KB.
+            values[":max_devices"] = {"N": str(self._max_area_devices)}
+            condition["ConditionExpression"] = (
+                "attribute_not_exists(device_ids) OR size(device_ids) < :max_devices"
+            )
+
+        async with self._semaphore:
+            await self._dynamodb_client.update_item(
+                TableName=self._dynamodb_table_name,
+                Key={
+                    "h3_hex": {"S": h3_hex},
+                    "ts_minute": {"S": f"{minute}#{part}" if part else minute},
+                },
+                UpdateExpression=update,
+                ExpressionAttributeValues=values,
+                **condition,
+            )
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing aggregates: {e}", exc_info=True)
+
+
+# Helper to stream the per-minute device sets in the window, a page at a time
+async def iter_recent_aggregates(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    h3_hex: str | None = None,
+    segments: int = settings.dynamodb_scan_segments,
+) -> AsyncIterator[List[Tuple[str, Set[str]]]]:
+    # The window starts at the cutoff's minute, which can include up to a minute extra.
+    values: Dict[str, Dict[str, str]] = {":cutoff": {"S": minute_bucket(cutoff)}}
+
+    if h3_hex:
+        values[":h3_hex"] = {"S": h3_hex}
+        pages = paginate(
+            dynamodb_client.query,
+            TableName=dynamodb_table_name,
+            KeyConditionExpression="h3_hex = :h3_hex AND ts_minute >= :cutoff",
+            ProjectionExpression="h3_hex, device_ids",
+            ExpressionAttributeValues=values,
+        )
+    elif settings.aggregate_minute_index_enabled:
+        # Only hex items are in the index, so there are no area items to skip.
+        pages = merge_pages(
+            [
+                paginate(
+                    dynamodb_client.query,
+                    TableName=dynamodb_table_name,
+                    IndexName=settings.aggregate_minute_index_name,
+                    KeyConditionExpression="minute_shard = :minute_shard",
+                    ProjectionExpression="h3_hex, device_ids",
+                    ExpressionAttributeValues={":minute_shard": {"S": key}},
+                )
+                for key in minute_shard_keys(cutoff)
+            ],
+            max_concurrency=settings.dynamodb_query_concurrency,
+        )
+    else:
+        pages = merge_pages(
+            [
+                paginate(
+                    dynamodb_client.scan,
+                    TableName=dynamodb_table_name,
+                    # Skip the area items, they'd count every ping again.
+                    FilterExpression=(
+                        "ts_minute >= :cutoff AND attribute_not_exists(h3_res)"
+                    ),
+                    ProjectionExpression="h3_hex, device_ids",
+                    ExpressionAttributeValues=values,
+                    Segment=segment,
+                    TotalSegments=segments,
+                )
+                for segment in range(segments)
+            ]
+        )
+
+    async for items in pages:
+        yield [(item["h3_hex"]["S"], set(item["device_ids"]["SS"])) for item in items]
+
+
+# Helper to stream the window's area items at `resolution`, a page at a time
+async def iter_recent_areas(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    resolution: int,
+    h3_hex: str | None = None,
+    segments: int = settings.dynamodb_scan_segments,
+) -> AsyncIterator[List[Tuple[str, Set[str], Set[str]]]]:
+    """Yields each area's hex, its devices and its active child hexes"""
+    values: Dict[str, Dict[str, str]] = {":cutoff": {"S": minute_bucket(cutoff)}}
+    projection = "h3_hex, device_ids, child_hexes"
+
+    if h3_hex:
+        # One area, one key, whatever its resolution.
+        values[":h3_hex"] = {"S": h3_hex}
+        pages = paginate(
+            dynamodb_client.query,
+            TableName=dynamodb_table_name,
+            KeyConditionExpression="h3_hex = :h3_hex AND ts_minute >= :cutoff",
+            ProjectionExpression=projection,
+            ExpressionAttributeValues=values,
+        )
+    else:
+        values[":h3_res"] = {"N": str(resolution)}
+        pages = merge_pages(
+            [
+                paginate(
+                    dynamodb_client.scan,
+                    TableName=dynamodb_table_name,
+                    FilterExpression="ts_minute >= :cutoff AND h3_res = :h3_res",
+                    ProjectionExpression=projection,
+                    ExpressionAttributeValues=values,
+                    Segment=segment,
+                    TotalSegments=segments,
+                )
+                for segment in range(segments)
+            ]
+        )
+
+    async for items in pages:
+        yield [
+            (
+                item["h3_hex"]["S"],
+                set(item["device_ids"]["SS"]),
+                set(item["child_hexes"]["SS"]),
+            )
+            for item in items
+        ]
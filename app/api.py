@@ -1,20 +1,48 @@
+import asyncio
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 import logging
-from typing import Annotated, Any, AsyncGenerator, Dict, cast
-
-from fastapi import Depends, FastAPI, HTTPException, Query, status
+from typing import (
+    Annotated,
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Dict,
+    List,
+    Tuple,
+    cast,
+)
+
+import h3  # type: ignore
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 from pydantic_extra_types.coordinate import Latitude, Longitude
 from types_aiobotocore_dynamodb.client import DynamoDBClient
 from types_aiobotocore_sqs.client import SQSClient
 
 from app.aws_clients import AWSClientManager, retry_aws
-from app.congestion import calculate_device_congestion, calculate_group_congestion
-from app.dynamodb import query_recent_pings
-from app.models import PingPayload
+from app import area
+from app.aggregates import iter_recent_aggregates, iter_recent_areas
+from app.cache import TTLCache
+from app.columnar import ColumnarGroupCongestion
+from app.congestion import DeviceCongestion, GroupCongestion, make_group_congestion
+from app.dynamodb import iter_recent_devices, merge_pages
+from app.ingest import (
+    BodyTooLarge,
+    TooManyPings,
+    parse_ping,
+    read_pings,
+    rejection,
+)
+from app.models import DevicePing, PingPayload
+from app.positions import iter_recent_positions
 from app.settings import settings
-from app.sqs import send_ping_to_queue
+from app.snapshot import Snapshot, SnapshotProducer, SnapshotReader
+from app.sqs import PingProducer, SQSBatchProducer, SQSEnvelopeProducer
 from app.utils import coords_to_hex
+from app.window import CongestionWindow
+from app import wire
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +50,17 @@ logger = logging.getLogger(__name__)
 sqs_client: SQSClient | None = None
 sqs_queue_url: str | None = None
 dynamodb_client: DynamoDBClient | None = None
+sqs_producer: PingProducer | None = None
+congestion_window: CongestionWindow | None = None
+snapshot_producer: SnapshotProducer | None = None
+snapshot_reader: SnapshotReader | None = None
+
+# Congestion responses, keyed by table, filter hex, resolution, approx, cutoff and k
+CongestionKey = Tuple[str, str | None, int | None, bool, datetime, int]
+congestion_cache: TTLCache[CongestionKey, Dict[str, Any]] = TTLCache(
+    ttl_seconds=settings.congestion_cache_ttl_seconds,
+    max_entries=settings.congestion_cache_max_entries,
+)
 
 
 # Dependency Injection Helpers
@@ -37,6 +76,12 @@ async def get_sqs_queue_url() -> str:
     return sqs_queue_url
 
 
+async def get_sqs_producer() -> PingProducer:
+    if sqs_producer is None:
+        raise RuntimeError("SQS producer not initialized")
+    return sqs_producer
+
+
 async def get_dynamodb_client() -> DynamoDBClient:
     if dynamodb_client is None:
         raise RuntimeError("DynamoDB client not initialized")
@@ -47,13 +92,18 @@ async def get_dynamodb_table_name() -> str:
     return settings.dynamodb_table_name
 
 
+async def get_congestion_cache() -> TTLCache[CongestionKey, Dict[str, Any]]:
+    return congestion_cache
+
+
 # Doc Ref: https://fastapi.tiangolo.com/advanced/events/#lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     """
     Lifespan for the FastAPI application.
     """
-    global sqs_client, sqs_queue_url, dynamodb_client
+    global sqs_client, sqs_queue_url, dynamodb_client, sqs_producer
+    global congestion_window, snapshot_producer, snapshot_reader
 
     async with AWSClientManager(
         service_names=["sqs", "dynamodb"]
@@ -90,12 +140,102 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
 
         logger.info("DynamoDB table found.")
 
-        yield
+        if settings.aggregates_enabled:
+
+            async def wait_for_aggregate_table() -> None:
+                # The worker creates it, same as the main table.
+                await local_dynamodb_client.describe_table(
+                    TableName=settings.dynamodb_aggregate_table_name
+                )
+
+            await retry_aws(wait_for_aggregate_table)
+
+            logger.info("DynamoDB aggregate table found.")
+
+        if settings.positions_enabled:
+
+            async def wait_for_position_table() -> None:
+                # The worker creates it, same as the main table.
+                await local_dynamodb_client.describe_table(
+                    TableName=settings.dynamodb_position_table_name
+                )
+
+            await retry_aws(wait_for_position_table)
+
+            logger.info("DynamoDB position table found.")
+
+        # Start batching pings into SendMessageBatch calls, packed into envelopes
+        # when enabled.
+        local_sqs_producer: PingProducer = (
+            SQSEnvelopeProducer(local_sqs_client, sqs_queue_url)
+            if settings.sqs_envelopes_enabled
+            else SQSBatchProducer(local_sqs_client, sqs_queue_url)
+        )
+        await local_sqs_producer.start()
+        sqs_producer = local_sqs_producer
+
+        # Hydrate the in-memory window in the background, DynamoDB answers until then.
+        if settings.window_enabled and not (
+            settings.dynamodb_time_index_enabled
+            and settings.dynamodb_write_index_enabled
+        ):
+            # Without the indexes hydrating and every poll would scan the whole table.
+            logger.warning(
+                "WINDOW_ENABLED needs DYNAMODB_TIME_INDEX_ENABLED and "
+                "DYNAMODB_WRITE_INDEX_ENABLED, not starting the window"
+            )
+        elif settings.window_enabled:
+            congestion_window = CongestionWindow(
+                local_dynamodb_client, settings.dynamodb_table_name
+            )
+            await congestion_window.start()
+
+        # One worker at a time writes the shared snapshot, every worker maps it.
+        if settings.snapshot_enabled and not _whole_window_is_indexed():
+            # Without the aggregates' minute index or the time index every
+            # snapshot would scan the whole table.
+            logger.warning(
+                "SNAPSHOT_ENABLED needs AGGREGATE_MINUTE_INDEX_ENABLED with "
+                "aggregates, or DYNAMODB_TIME_INDEX_ENABLED without positions, "
+                "not producing snapshots"
+            )
+        elif settings.snapshot_enabled:
+
+            async def load_snapshot_counts() -> Dict[str, int]:
+                congestion = DeviceCongestion()
+                await _collect(
+                    congestion,
+                    local_dynamodb_client,
+                    settings.dynamodb_table_name,
+                    # Whole seconds like the stored keys, so the boundary second counts.
+                    _congestion_cutoff(),
+                    None,
+                    None,
+                )
+                return congestion.results()
+
+            snapshot_producer = SnapshotProducer(load_snapshot_counts)
+            await snapshot_producer.start()
+            snapshot_reader = SnapshotReader()
+
+        try:
+            yield
+        finally:
+            if snapshot_producer is not None:
+                await snapshot_producer.stop()
+            if congestion_window is not None:
+                await congestion_window.stop()
+            # Flush any pings still waiting on a batch before the clients close.
+            await local_sqs_producer.stop()
 
     # Cleanup
     sqs_client = None
     sqs_queue_url = None
     dynamodb_client = None
+    sqs_producer = None
+    congestion_window = None
+    snapshot_producer = None
+    snapshot_reader = None
 
 
 app = FastAPI(lifespan=lifespan)
@@ -107,19 +247,75 @@ async def root() -> Dict[str, Any]:
     return {"status": "ok"}
 
 
+# Stats Endpoint
+@app.get("/stats")
+async def stats(
+    congestion_cache: Annotated[
+        TTLCache[CongestionKey, Dict[str, Any]], Depends(get_congestion_cache)
+    ],
+) -> Dict[str, Any]:
+    response = {"congestion_cache": congestion_cache.stats()}
+    if congestion_window is not None:
+        response["congestion_window"] = congestion_window.stats()
+    if snapshot_reader is not None:
+        response["congestion_snapshot"] = {
+            **snapshot_reader.stats(),
+            "producing": snapshot_producer is not None and snapshot_producer.producing,
+        }
+    return response
+
+
+# The ping endpoints read their own bodies, so describe them for the docs.
+# Doc Ref: https://fastapi.tiangolo.com/advanced/path-operation-advanced-configuration/#custom-openapi-path-operation-schema
+_ping_schema = PingPayload.model_json_schema()
+_ping_body = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": _ping_schema},
+            wire.CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+        },
+    }
+}
+_pings_body = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": _ping_schema}},
+            "application/x-ndjson": {"schema": {"type": "string"}},
+            wire.CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+        },
+    }
+}
+
+
 # Ping Endpoint
-@app.post("/ping", status_code=status.HTTP_202_ACCEPTED)
+@app.post("/ping", status_code=status.HTTP_202_ACCEPTED, openapi_extra=_ping_body)
 async def ping(
-    ping_payload: PingPayload,
-    sqs_client: Annotated[SQSClient, Depends(get_sqs_client)],
-    sqs_queue_url: Annotated[str, Depends(get_sqs_queue_url)],
+    request: Request,
+    sqs_producer: Annotated[PingProducer, Depends(get_sqs_producer)],
 ) -> Dict[str, Any]:
+    # JSON by default, or the binary format when the client asks for it.
+    content_type = request.headers.get("content-type", "application/json")
+    try:
+        ping_payload = parse_ping(content_type, await request.body())
+    except ValidationError as e:
+        # Same 422 response FastAPI gives for a body it validated itself.
+        raise RequestValidationError(
+            [
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False)
+            ]
+        )
+    except (ValueError, OverflowError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     # Set when we accepted the ping.
     ping_payload.accepted_at = datetime.now(timezone.utc)
 
     try:
-        # Send the ping to the queue and immediately return.
-        message_id = await send_ping_to_queue(sqs_client, sqs_queue_url, ping_payload)
+        # Hand the ping to the batch producer, returns once its batch is sent.
+        message_id = await sqs_producer.send(ping_payload)
         return {"status": "accepted", "message_id": message_id}
     except Exception as e:
         logger.error(f"Failed to send ping to queue: {e}")
@@ -129,24 +325,361 @@ async def ping(
         )
 
 
+# Bulk Ping Endpoint
+@app.post("/pings", status_code=status.HTTP_202_ACCEPTED, openapi_extra=_pings_body)
+async def pings(
+    request: Request,
+    sqs_producer: Annotated[PingProducer, Depends(get_sqs_producer)],
+) -> Dict[str, Any]:
+    """Accept a JSON array, NDJSON stream or binary batch of pings"""
+    # One accepted time for the whole upload.
+    accepted_at = datetime.now(timezone.utc)
+    content_type = request.headers.get("content-type", "application/json")
+
+    results: List[Dict[str, Any]] = []
+    # Valid pings are packed several to a message, keyed by their indexes.
+    sends: Dict[Tuple[int, ...], asyncio.Task[List[str]]] = {}
+    pending: Dict[int, PingPayload] = {}
+
+    def _send_pending() -> None:
+        # Start sending right away, the producer batches concurrent sends.
+        pings = list(pending.values())
+        sends[tuple(pending)] = asyncio.create_task(sqs_producer.send_many(pings))
+        pending.clear()
+
+    # Read the whole upload before sending any of it, so a body that's refused
+    # part way through hasn't already put pings on the queue.
+    try:
+        items = [
+            item
+            async for item in read_pings(content_type, request.stream(), accepted_at)
+        ]
+    except ValueError as e:
+        raise HTTPException(
+            status_code=(
+                status.HTTP_413_CONTENT_TOO_LARGE
+                if isinstance(e, (TooManyPings, BodyTooLarge))
+                else status.HTTP_400_BAD_REQUEST
+            ),
+            detail=str(e),
+        )
+
+    for item in items:
+        if isinstance(item, PingPayload):
+            pending[len(results)] = item
+            results.append({"status": "accepted"})
+            if len(pending) >= settings.sqs_pings_per_message:
+                _send_pending()
+        else:
+            results.append(item)
+    if pending:
+        _send_pending()
+
+    sent = await asyncio.gather(*sends.values(), return_exceptions=True)
+    for indexes, message_ids in zip(sends, sent):
+        if isinstance(message_ids, BaseException):
+            logger.error(f"Failed to send pings to queue: {message_ids}")
+        for position, index in enumerate(indexes):
+            if isinstance(message_ids, BaseException):
+                results[index] = rejection(
+                    [
+                        {
+                            "type": "queue_unavailable",
+                            "msg": "Service temporarily unavailable",
+                        }
+                    ]
+                )
+            else:
+                results[index]["message_id"] = message_ids[position]
+
+    accepted = sum(result["status"] == "accepted" for result in results)
+    # Nothing valid got through because of the queue, same as /ping.
+    if sends and not accepted:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service temporarily unavailable",
+        )
+
+    return {
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "results": [{"index": i, **result} for i, result in enumerate(results)],
+    }
+
+
+# Helper to round a cutoff down to a multiple of `seconds`
+def _truncate(ts: datetime, seconds: float) -> datetime:
+    if seconds <= 1:
+        return ts.replace(microsecond=0)
+    return datetime.fromtimestamp(ts.timestamp() // seconds * seconds, timezone.utc)
+
+
+# Helper to pick the aggregate index resolution that can answer a group query, if any
+def _area_resolution(filter_hex: str | None, resolution: int) -> int | None:
+    if not settings.aggregates_enabled:
+        return None
+    indexed = [
+        index_resolution
+        for index_resolution in settings.aggregate_index_resolutions
+        if resolution <= index_resolution < settings.default_h3_resolution
+    ]
+    if filter_hex is None:
+        # The coarsest areas that can still be grouped at `resolution` are the fewest items.
+        return min(indexed, default=None)
+    filter_resolution = h3.get_resolution(filter_hex)
+    return filter_resolution if filter_resolution in indexed else None
+
+
+# Helper to feed the window's pings (or their aggregates) into a congestion aggregator
+async def _collect_congestion(
+    congestion: DeviceCongestion | GroupCongestion | ColumnarGroupCongestion,
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    h3_hex: str | None,
+) -> None:
+    if settings.aggregates_enabled:
+        # Read the worker's per-minute device sets instead of every raw ping.
+        async for aggregates in iter_recent_aggregates(
+            dynamodb_client,
+            settings.dynamodb_aggregate_table_name,
+            cutoff=cutoff,
+            h3_hex=h3_hex,
+        ):
+            for aggregate_hex, device_ids in aggregates:
+                congestion.add_devices(aggregate_hex, device_ids)
+        return
+
+    # Stream the recent pings a page at a time rather than loading them all.
+    async for page in _iter_devices(
+        dynamodb_client, dynamodb_table_name, cutoff=cutoff, h3_hex=h3_hex
+    ):
+        congestion.add(page)
+
+
+# Helper to stream the window's devices, from their latest positions when kept
+def _iter_devices(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    h3_hex: str | None = None,
+) -> AsyncIterator[List[DevicePing]]:
+    if settings.positions_enabled:
+        # One row per active device, however often it pings.
+        return iter_recent_positions(
+            dynamodb_client,
+            settings.dynamodb_position_table_name,
+            cutoff=cutoff,
+            h3_hex=h3_hex,
+        )
+    return iter_recent_devices(
+        dynamodb_client, dynamodb_table_name, cutoff=cutoff, h3_hex=h3_hex
+    )
+
+
+# Helper to check the whole window can be read without scanning a table
+def _whole_window_is_indexed() -> bool:
+    if settings.aggregates_enabled:
+        # Global reads go to the aggregates, which only skip the scan with their index.
+        return settings.aggregate_minute_index_enabled
+    return settings.dynamodb_time_index_enabled and not settings.positions_enabled
+
+
+# Helper to feed an area's pings into a congestion aggregator, a partition at a time
+async def _collect_area(
+    congestion: DeviceCongestion | GroupCongestion | ColumnarGroupCongestion,
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    cells: List[str],
+) -> None:
+    aggregate_table = settings.dynamodb_aggregate_table_name
+    children = area.child_partitions(cells)
+
+    if (
+        settings.aggregates_enabled
+        and h3.get_resolution(cells[0]) in settings.aggregate_index_resolutions
+    ):
+        # The area items list which children saw pings, only those are queried.
+        active: set[str] = set()
+        async for areas in merge_pages(
+            [
+                iter_recent_areas(
+                    dynamodb_client,
+                    aggregate_table,
+                    cutoff=cutoff,
+                    resolution=h3.get_resolution(cells[0]),
+                    h3_hex=cell,
+                )
+                for cell in cells
+            ],
+            max_concurrency=settings.dynamodb_query_concurrency,
+        ):
+            for _, _, child_hexes in areas:
+                active.update(child_hexes)
+        children = sorted(active)
+
+    if children is None:
+        # Too many partitions to query one by one, read the window and keep the area.
+        if not _whole_window_is_indexed():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=(
+                    f"Area covers more than {settings.area_max_partitions} "
+                    "partitions, narrow it or index its resolution"
+                ),
+            )
+        in_area = area.contains(cells)
+        if settings.aggregates_enabled:
+            async for aggregates in iter_recent_aggregates(
+                dynamodb_client, aggregate_table, cutoff=cutoff
+            ):
+                for aggregate_hex, device_ids in aggregates:
+                    if in_area(aggregate_hex):
+                        congestion.add_devices(aggregate_hex, device_ids)
+            return
+
+        async for page in _iter_devices(
+            dynamodb_client, dynamodb_table_name, cutoff=cutoff
+        ):
+            congestion.add([ping for ping in page if in_area(ping.h3_hex)])
+        return
+
+    # Query every partition concurrently, at most `dynamodb_query_concurrency` at once.
+    if settings.aggregates_enabled:
+        async for aggregates in merge_pages(
+            [
+                iter_recent_aggregates(
+                    dynamodb_client, aggregate_table, cutoff=cutoff, h3_hex=child
+                )
+                for child in children
+            ],
+            max_concurrency=settings.dynamodb_query_concurrency,
+        ):
+            for aggregate_hex, device_ids in aggregates:
+                congestion.add_devices(aggregate_hex, device_ids)
+        return
+
+    async for page in merge_pages(
+        [
+            _iter_devices(
+                dynamodb_client, dynamodb_table_name, cutoff=cutoff, h3_hex=child
+            )
+            for child in children
+        ],
+        max_concurrency=settings.dynamodb_query_concurrency,
+    ):
+        congestion.add(page)
+
+
 # Congestion Endpoint
 @app.get("/congestion", status_code=status.HTTP_200_OK)
 async def congestion(
     dynamodb_client: Annotated[DynamoDBClient, Depends(get_dynamodb_client)],
     dynamodb_table_name: Annotated[str, Depends(get_dynamodb_table_name)],
+    congestion_cache: Annotated[
+        TTLCache[CongestionKey, Dict[str, Any]], Depends(get_congestion_cache)
+    ],
     h3_hex: Annotated[str | None, Query()] = None,
     lat: Annotated[Latitude | None, Query()] = None,
     lon: Annotated[Longitude | None, Query()] = None,
     resolution: Annotated[int | None, Query(ge=0, le=15)] = None,
+    approx: Annotated[bool | None, Query()] = None,
+    k: Annotated[int, Query(ge=0, le=settings.congestion_max_k)] = 0,
 ) -> Dict[str, Any]:
-    # Set our cutoff time now
-    cutoff = (datetime.now(timezone.utc) - timedelta(
-        minutes=settings.default_congestion_window
-    )).replace(microsecond=0)
+    cutoff = _congestion_cutoff()
+    filter_hex = _filter_hex(h3_hex, lat, lon, resolution)
+
+    # A radius needs a cell to be around.
+    if k and filter_hex is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="k needs an h3_hex or lat/lon",
+        )
 
-    # Set our filter hex
-    filter_hex = h3_hex
+    # Approximate counts only apply to groups, single hexes are small enough.
+    if approx is None:
+        approx = settings.congestion_approx_default
+    approx = approx and resolution is not None
+
+    # Single hexes and global counts are served from the shared snapshot when fresh.
+    if resolution is None and k == 0:
+        snapshot_response = _snapshot_response(filter_hex)
+        if snapshot_response is not None:
+            return snapshot_response
+
+    # Identical requests within a TTL share one response, and one DynamoDB read.
+    key = (dynamodb_table_name, filter_hex, resolution, approx, cutoff, k)
+    return await congestion_cache.get_or_load(
+        key,
+        lambda: _congestion_response(
+            dynamodb_client,
+            dynamodb_table_name,
+            cutoff,
+            filter_hex,
+            resolution,
+            approx,
+            k,
+        ),
+    )
 
+
+# Helper to set our cutoff time now, truncated to the cache TTL so nearby requests share it
+def _congestion_cutoff() -> datetime:
+    return _truncate(
+        datetime.now(timezone.utc)
+        - timedelta(minutes=settings.default_congestion_window),
+        settings.congestion_cache_ttl_seconds,
+    )
+
+
+# Helper to get the shared snapshot, if there's one recent enough to serve
+def _fresh_snapshot() -> Snapshot | None:
+    if snapshot_reader is None:
+        return None
+    snapshot = snapshot_reader.current()
+    if snapshot is None or snapshot.age_seconds > settings.snapshot_max_age_seconds:
+        return None
+    return snapshot
+
+
+# Helper to answer a single hex, or everything, from the shared snapshot
+def _snapshot_response(filter_hex: str | None) -> Dict[str, Any] | None:
+    snapshot = _fresh_snapshot()
+    if snapshot is None:
+        return None
+    if filter_hex is None:
+        counts = list(snapshot.items())
+    elif h3.is_valid_cell(filter_hex) and not area.is_area(filter_hex):
+        device_count = snapshot.get(filter_hex)
+        counts = [(filter_hex, device_count)] if device_count else []
+    else:
+        # Areas are grouped from the pings, the snapshot only has the hex counts.
+        return None
+    return {
+        "congestion": [
+            {"h3_hex": h3_hex, "device_count": device_count}
+            for h3_hex, device_count in counts
+        ],
+        **_staleness(snapshot),
+    }
+
+
+# Helper to say how old a snapshot answer is
+def _staleness(snapshot: Snapshot) -> Dict[str, Any]:
+    return {
+        "as_of": snapshot.built_at.isoformat(),
+        "stale_seconds": round(snapshot.age_seconds, 3),
+    }
+
+
+# Helper to pick the cell a request filters on, from either a hex or lat/lon
+def _filter_hex(
+    h3_hex: str | None,
+    lat: float | None,
+    lon: float | None,
+    resolution: int | None,
+) -> str | None:
     # If we have lat and lon, we need to convert them to a hex.
     if lat and lon:
         if h3_hex:
@@ -154,28 +687,144 @@ async def congestion(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Cannot specify both h3_hex and lat/lon",
             )
-        else:
-            # Set our end resolution to the resolution we were given or the default.
-            end_resolution = (
-                resolution if resolution is not None else settings.default_h3_resolution
-            )
-            filter_hex = coords_to_hex(lat, lon, end_resolution)
+        # Set our end resolution to the resolution we were given or the default.
+        end_resolution = (
+            resolution if resolution is not None else settings.default_h3_resolution
+        )
+        filter_hex: str = coords_to_hex(lat, lon, end_resolution)
+        return filter_hex
     # If we only have one of lat or lon, we need to raise an error.
     elif lat is not None or lon is not None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Must specify both lat and lon",
         )
+    if h3_hex is not None and not h3.is_valid_cell(h3_hex):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Not a valid h3_hex",
+        )
+    return h3_hex
+
+
+# Congestion Around Endpoint
+@app.get("/congestion/around", status_code=status.HTTP_200_OK)
+async def congestion_around(
+    dynamodb_client: Annotated[DynamoDBClient, Depends(get_dynamodb_client)],
+    dynamodb_table_name: Annotated[str, Depends(get_dynamodb_table_name)],
+    congestion_cache: Annotated[
+        TTLCache[CongestionKey, Dict[str, Any]], Depends(get_congestion_cache)
+    ],
+    h3_hex: Annotated[str | None, Query()] = None,
+    lat: Annotated[Latitude | None, Query()] = None,
+    lon: Annotated[Longitude | None, Query()] = None,
+    resolution: Annotated[int | None, Query(ge=0, le=15)] = None,
+    k: Annotated[int, Query(ge=0, le=settings.congestion_max_k)] = 1,
+) -> Dict[str, Any]:
+    cutoff = _congestion_cutoff()
+    center = _filter_hex(h3_hex, lat, lon, resolution)
+    if center is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Must specify h3_hex or lat/lon",
+        )
 
-    # Query the recent pings.
-    recent_pings = await query_recent_pings(
-        dynamodb_client, dynamodb_table_name, cutoff=cutoff, h3_hex=filter_hex
+    cells = area.area_cells(center, k)
+    # Hex counts come straight from the shared snapshot when it's fresh.
+    cell_resolution = h3.get_resolution(center)
+    snapshot = (
+        _fresh_snapshot() if cell_resolution >= settings.default_h3_resolution else None
+    )
+    if snapshot is not None:
+        counts = {cell: snapshot.get(cell) for cell in cells}
+    else:
+        # The disk is read once, as an area, and grouped back into its cells. It
+        # is cached under the same key as the matching /congestion request.
+        group_resolution = min(cell_resolution, settings.default_h3_resolution)
+        key = (dynamodb_table_name, center, group_resolution, False, cutoff, k)
+        grouped = await congestion_cache.get_or_load(
+            key,
+            lambda: _congestion_response(
+                dynamodb_client,
+                dynamodb_table_name,
+                cutoff,
+                center,
+                group_resolution,
+                False,
+                k,
+            ),
+        )
+        device_counts = {
+            item["h3_hex"]: item["device_count"] for item in grouped["congestion"]
+        }
+        counts = {cell: device_counts.get(cell, 0) for cell in cells}
+
+    response = {
+        "h3_hex": center,
+        "k": k,
+        "congestion": counts,
+    }
+    if snapshot is not None:
+        response.update(_staleness(snapshot))
+    return response
+
+
+# Helper to read the window and build the /congestion response
+async def _congestion_response(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    filter_hex: str | None,
+    resolution: int | None,
+    approx: bool,
+    k: int = 0,
+) -> Dict[str, Any]:
+    # Coarse cells and radiuses cover many partitions, read them as an area.
+    cells = (
+        area.area_cells(filter_hex, k)
+        if filter_hex is not None and area.is_area(filter_hex, k)
+        else None
     )
 
     # If we have a resolution, we need to calculate the congestion for the group.
     if resolution is not None:
         # Calculate the congestion for the group.
-        congestion_counts = calculate_group_congestion(recent_pings, resolution)
+        group_congestion: GroupCongestion | ColumnarGroupCongestion
+        # The in-memory window answers groups itself, area items aren't needed.
+        area_resolution = (
+            None if _window_ready() else _area_resolution(filter_hex, resolution)
+        )
+        if area_resolution is not None:
+            # Coarse areas are indexed at write time, one item per area and minute.
+            group_congestion = GroupCongestion(resolution, approx=approx)
+            # No filter scans every area at that resolution.
+            area_hexes: List[str | None] = list(cells) if cells else [filter_hex]
+            async for areas in merge_pages(
+                [
+                    iter_recent_areas(
+                        dynamodb_client,
+                        settings.dynamodb_aggregate_table_name,
+                        cutoff=cutoff,
+                        resolution=area_resolution,
+                        h3_hex=cell,
+                    )
+                    for cell in area_hexes
+                ],
+                max_concurrency=settings.dynamodb_query_concurrency,
+            ):
+                for area_hex, device_ids, child_hexes in areas:
+                    group_congestion.add_area(area_hex, device_ids, child_hexes)
+        else:
+            group_congestion = make_group_congestion(resolution, approx=approx)
+            await _collect(
+                group_congestion,
+                dynamodb_client,
+                dynamodb_table_name,
+                cutoff,
+                filter_hex,
+                cells,
+            )
+        congestion_counts = group_congestion.results()
         # Format the data for the response.
         congestion_data = [
             {
@@ -186,10 +835,21 @@ async def congestion(
             }
             for h, data in congestion_counts.items()
         ]
+        if approx:
+            return {"congestion": congestion_data, "approximate": True}
 
     else:
         # Calculate the congestion for the device.
-        device_counts = calculate_device_congestion(recent_pings)
+        device_congestion = DeviceCongestion()
+        await _collect(
+            device_congestion,
+            dynamodb_client,
+            dynamodb_table_name,
+            cutoff,
+            filter_hex,
+            cells,
+        )
+        device_counts = device_congestion.results()
         # Format the data for the response.
         congestion_data = [
             {"h3_hex": h3_hex, "device_count": device_count}
@@ -197,3 +857,36 @@ async def congestion(
         ]
 
     return {"congestion": congestion_data}
+
+
+# Helper to check whether congestion can be answered from the in-memory window
+def _window_ready() -> bool:
+    return congestion_window is not None and congestion_window.fresh
+
+
+# Helper to read either an area or a single hex (or everything) into an aggregator
+async def _collect(
+    congestion: DeviceCongestion | GroupCongestion | ColumnarGroupCongestion,
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    filter_hex: str | None,
+    cells: List[str] | None,
+) -> None:
+    if congestion_window is not None and congestion_window.fresh:
+        # Answer from memory, the window is kept current by polling the table.
+        congestion_window.window.collect(
+            congestion,
+            cutoff,
+            contains=area.contains(cells) if cells is not None else None,
+            h3_hex=filter_hex if cells is None else None,
+        )
+        return
+    if cells is not None:
+        await _collect_area(
+            congestion, dynamodb_client, dynamodb_table_name, cutoff, cells
+        )
+    else:
+        await _collect_congestion(
+            congestion, dynamodb_client, dynamodb_table_name, cutoff, filter_hex
+        )
@@ -0,0 +1,77 @@
+from typing import Callable, Iterable, List
+
+import h3  # type: ignore
+
+from app.settings import settings
+
+# Area congestion. An area is a cell coarser than the pings' resolution, or a
+# `grid_disk` of cells around one. Pings are stored under their resolution 12
+# cell, so an area is read by querying each of its child partitions, unless
+# there are too many of them to be worth it.
+
+# Doc Ref: https://h3geo.org/docs/api/traversal#griddisk
+# Doc Ref: https://h3geo.org/docs/api/hierarchy#celltochildren
+
+
+def area_cells(h3_hex: str, k: int = 0) -> List[str]:
+    """The cell and every cell within `k` steps of it"""
+    if k <= 0:
+        return [h3_hex]
+    return sorted(h3.grid_disk(h3_hex, k))
+
+
+def is_area(h3_hex: str, k: int = 0) -> bool:
+    """Whether a filter covers more than one of the pings' cells"""
+    return k > 0 or h3.get_resolution(h3_hex) < settings.default_h3_resolution
+
+
+def partition_count(
+    cells: Iterable[str], source_resolution: int = settings.default_h3_resolution
+) -> int:
+    return sum(
+        (
+            h3.cell_to_children_size(cell, source_resolution)
+            if h3.get_resolution(cell) <= source_resolution
+            else 1
+        )
+        for cell in cells
+    )
+
+
+def child_partitions(
+    cells: Iterable[str],
+    source_resolution: int = settings.default_h3_resolution,
+    max_partitions: int = settings.area_max_partitions,
+) -> List[str] | None:
+    """
+    Every partition under the cells, to query one by one.
+
+    None when there are more than `max_partitions`, reading the whole window
+    and keeping the area's pings is cheaper then.
+    """
+    cells = list(cells)
+    if partition_count(cells, source_resolution) > max_partitions:
+        return None
+    return [
+        child
+        for cell in cells
+        # A cell at or finer than the pings' resolution is its own partition.
+        for child in (
+            h3.cell_to_children(cell, source_resolution)
+            if h3.get_resolution(cell) < source_resolution
+            else [cell]
+        )
+    ]
+
+
+def contains(cells: Iterable[str]) -> Callable[[str], bool]:
+    """A test for whether a hex falls inside the area"""
+    cells = set(cells)
+    resolution = h3.get_resolution(next(iter(cells)))
+
+    def _contains(h3_hex: str) -> bool:
+        if h3.get_resolution(h3_hex) < resolution:
+            return False
+        return h3.cell_to_parent(h3_hex, resolution) in cells
+
+    return _contains
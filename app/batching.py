@@ -0,0 +1,132 @@
+from abc import ABC, abstractmethod
+import asyncio
+import logging
+from typing import Generic, List, Set, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Doc Ref: https://docs.python.org/3/library/asyncio-queue.html
+# Doc Ref: https://docs.python.org/3/library/asyncio-future.html
+
+ItemT = TypeVar("ItemT")
+ResultT = TypeVar("ResultT")
+
+
+class MicroBatcher(ABC, Generic[ItemT, ResultT]):
+    """
+    Collects concurrently submitted items into batches and sends them together.
+
+    A batch is sent once it reaches `max_batch_size` or once its first item has
+    waited `max_linger_seconds`, whichever comes first. Subclasses implement
+    `_send_batch`, returning one result (or exception) per item, in order.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int,
+        max_linger_seconds: float,
+        max_in_flight: int = 8,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self._max_batch_size = max_batch_size
+        self._max_linger_seconds = max_linger_seconds
+        self._queue: asyncio.Queue[Tuple[ItemT, asyncio.Future[ResultT]]] = (
+            asyncio.Queue()
+        )
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._batch_tasks: Set[asyncio.Task[None]] = set()
+        self._collector: asyncio.Task[None] | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._collector is not None and not self._collector.done()
+
+    async def start(self) -> None:
+        """Start the background collector."""
+        if self.running:
+            return
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self) -> None:
+        """Flush everything already submitted, then stop the collector."""
+        if self._collector is None:
+            return
+
+        # Wait for queued items to be picked up and resolved before stopping.
+        if not self._collector.done():
+            await self._queue.join()
+        self._collector.cancel()
+        try:
+            await self._collector
+        except asyncio.CancelledError:
+            pass
+        self._collector = None
+
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+
+    async def submit(self, item: ItemT) -> ResultT:
+        """Queue an item and wait for the result of the batch it was sent in."""
+        if not self.running:
+            raise RuntimeError(f"{type(self).__name__} is not running")
+
+        future: asyncio.Future[ResultT] = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    @abstractmethod
+    async def _send_batch(
+        self, items: List[ItemT]
+    ) -> List[ResultT | BaseException]: ...
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # Block until there is at least one item to send.
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_linger_seconds
+
+            # Keep collecting until the batch is full or the linger time is up.
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Cap the number of concurrent batches, then send this one in the background.
+            await self._in_flight.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(
+        self, batch: List[Tuple[ItemT, asyncio.Future[ResultT]]]
+    ) -> None:
+        try:
+            try:
+                results = await self._send_batch([item for item, _ in batch])
+            except Exception as e:
+                # The whole call failed, so every item in it failed.
+                logger.error(f"{type(self).__name__} batch failed: {e}")
+                results = [e] * len(batch)
+
+            if len(results) != len(batch):
+                error = RuntimeError("Batch returned the wrong number of results")
+                results = [error] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._in_flight.release()
+            for _ in batch:
+                self._queue.task_done()
@@ -0,0 +1,87 @@
+import asyncio
+from collections import OrderedDict
+import time
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Tuple, TypeVar
+
+KeyT = TypeVar("KeyT", bound=Hashable)
+ValueT = TypeVar("ValueT")
+
+# A small in-process response cache. Entries live for `ttl_seconds`, the least
+# recently used entry is evicted once `max_entries` is reached, and concurrent
+# misses for the same key share one load (single-flight).
+
+# Doc Ref: https://docs.python.org/3/library/collections.html#ordereddict-objects
+# Doc Ref: https://docs.python.org/3/library/asyncio-task.html#shielding-from-cancellation
+
+
+class TTLCache(Generic[KeyT, ValueT]):
+    """
+    A bounded TTL and LRU cache for async loaders.
+
+    `get_or_load` returns a fresh cached value, or runs the loader once no
+    matter how many callers miss on the same key at the same time.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._entries: OrderedDict[KeyT, Tuple[float, ValueT]] = OrderedDict()
+        self._inflight: Dict[KeyT, asyncio.Task[ValueT]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl_seconds > 0 and self._max_entries > 0
+
+    async def get_or_load(
+        self, key: KeyT, loader: Callable[[], Awaitable[ValueT]]
+    ) -> ValueT:
+        if not self.enabled:
+            return await loader()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._load(key, loader))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+
+        # Shield the load so a caller that disconnects doesn't cancel it for the rest.
+        return await asyncio.shield(task)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+    async def _load(self, key: KeyT, loader: Callable[[], Awaitable[ValueT]]) -> ValueT:
+        try:
+            value = await loader()
+        finally:
+            del self._inflight[key]
+
+        # Failures aren't cached, the next request tries again.
+        self._entries[key] = (time.monotonic() + self._ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+        return value
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Tuple
+
+from app.models import PingRecord
+from app.settings import settings
+
+# Write coalescing. Congestion only needs one ping per device and hex in the
+# window, so a device that keeps pinging from the same cell only needs writing
+# once every `refresh_seconds`. The rest of its pings are dropped before they
+# reach DynamoDB.
+#
+# A device is still written at least once per refresh interval while it pings,
+# so it stays in the window. Only the trailing edge moves: a device that stops
+# pinging can leave the window up to `refresh_seconds` early.
+
+# Doc Ref: https://docs.python.org/3/library/collections.html#ordereddict-examples-and-recipes
+
+
+@dataclass
+class CoalescerStats:
+    """Running totals for a write coalescer."""
+
+    pings: int = 0
+    suppressed: int = 0
+    evicted: int = 0
+
+    @property
+    def suppressed_ratio(self) -> float:
+        return self.suppressed / self.pings if self.pings else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "pings": self.pings,
+            "suppressed": self.suppressed,
+            "evicted": self.evicted,
+            "suppressed_ratio": round(self.suppressed_ratio, 3),
+        }
+
+
+class WriteCoalescer:
+    """
+    Remembers the last written hex and timestamp of up to `max_devices` devices.
+
+    `should_write` says whether a ping adds anything: a device in a new hex, or
+    one whose last write is `refresh_seconds` old, is written. The least
+    recently seen devices are forgotten first, their next ping is just written.
+    """
+
+    def __init__(
+        self,
+        refresh_seconds: float = settings.worker_coalesce_refresh_seconds,
+        max_devices: int = settings.worker_coalesce_max_devices,
+    ):
+        self._refresh = timedelta(seconds=refresh_seconds)
+        self._max_devices = max_devices
+        self._devices: OrderedDict[str, Tuple[str, datetime]] = OrderedDict()
+        self.stats = CoalescerStats()
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def should_write(self, ping_record: PingRecord) -> bool:
+        """Whether the record needs writing, counts it as written if so."""
+        self.stats.pings += 1
+        device_id = ping_record.device_id
+
+        last = self._devices.get(device_id)
+        if last is not None:
+            self._devices.move_to_end(device_id)
+            last_hex, last_ts = last
+            # Older pings in the same hex are covered by the newer write too.
+            if (
+                last_hex == ping_record.h3_hex
+                and ping_record.ts - last_ts < self._refresh
+            ):
+                self.stats.suppressed += 1
+                return False
+
+        self._devices[device_id] = (ping_record.h3_hex, ping_record.ts)
+        if len(self._devices) > self._max_devices:
+            self._devices.popitem(last=False)
+            self.stats.evicted += 1
+        return True
+
+    def forget(self, ping_record: PingRecord) -> None:
+        """The record's write failed, so the device's next ping is written."""
+        if self._devices.get(ping_record.device_id) == (
+            ping_record.h3_hex,
+            ping_record.ts,
+        ):
+            del self._devices[ping_record.device_id]
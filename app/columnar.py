@@ -0,0 +1,202 @@
+from array import array
+from typing import Any, Dict, Iterable
+
+import h3  # type: ignore
+
+from app.models import DevicePing, PingRecord
+
+# Numpy is an optional extra (`pip install .[columnar]`), without it the
+# congestion aggregators in app.congestion are used instead.
+try:
+    import numpy as np
+    import numpy.typing as npt
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore[assignment]
+
+# Columnar group congestion. Pings are held as two arrays, H3 cells as uint64
+# and device ids as interned integer codes, and parents are found for every
+# cell at once with bit operations instead of one `h3.cell_to_parent` per ping.
+
+# Doc Ref: https://h3geo.org/docs/library/index/cell
+# Doc Ref: https://numpy.org/doc/stable/reference/generated/numpy.lexsort.html
+
+# An H3 cell index stores its resolution in bits 52-55, then fifteen 3 bit
+# digits, one per resolution. Digits finer than the cell's resolution are 7.
+_RESOLUTION_OFFSET = 52
+_RESOLUTION_MASK = 0xF << _RESOLUTION_OFFSET
+_DIGIT_BITS = 3
+MAX_RESOLUTION = 15
+
+
+def available() -> bool:
+    return np is not None
+
+
+# Vectorized `h3.cell_to_parent`, for cells at or finer than `resolution`
+def cells_to_parents(cells: "npt.NDArray[np.uint64]", resolution: int) -> Any:
+    unused_digits = np.uint64((1 << ((MAX_RESOLUTION - resolution) * _DIGIT_BITS)) - 1)
+    resolution_bits = np.uint64(resolution << _RESOLUTION_OFFSET)
+    keep = ~(np.uint64(_RESOLUTION_MASK) | unused_digits)
+    return (cells & keep) | resolution_bits | unused_digits
+
+
+# Read the resolution field of each cell
+def cells_resolution(cells: "npt.NDArray[np.uint64]") -> Any:
+    return (cells & np.uint64(_RESOLUTION_MASK)) >> np.uint64(_RESOLUTION_OFFSET)
+
+
+# Strip a cell down to its base cell and used digits, which sort in the same order
+def _cell_keys(cells: "npt.NDArray[np.uint64]", resolution: int) -> Any:
+    unused = np.uint64((MAX_RESOLUTION - resolution) * _DIGIT_BITS)
+    return (cells & np.uint64((1 << _RESOLUTION_OFFSET) - 1)) >> unused
+
+
+# Collapse sorted keys into each distinct key and how many times it appears
+def _run_lengths(keys: "npt.NDArray[Any]") -> tuple[Any, Any]:
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.diff(np.append(starts, len(keys)))
+
+
+# Sort and drop repeats, cheaper than `np.unique` which hashes in numpy 2
+def _sorted_distinct(keys: "npt.NDArray[Any]") -> Any:
+    keys = np.sort(keys)
+    return keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+
+
+# Count the distinct `values` for each key, returning the sorted keys and counts
+def _distinct_counts(
+    keys: "npt.NDArray[np.uint64]", values: "npt.NDArray[Any]"
+) -> tuple[Any, Any]:
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+
+    # After sorting, a pair is new wherever it differs from the one before it.
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] != keys[:-1]) | (values[1:] != values[:-1])
+    return _run_lengths(keys[first])
+
+
+def distinct_positions(
+    lats: "npt.ArrayLike", lons: "npt.ArrayLike", quantum: float
+) -> tuple[list[int], list[int], list[int]] | None:
+    """
+    Round coordinates to steps of `quantum` degrees and find the distinct ones.
+
+    Returns the lat and lon steps of each distinct position, and for every
+    coordinate the index of its position. None if any are out of range.
+    """
+    lat_steps = np.rint(np.asarray(lats, dtype=np.float64) / quantum).astype(np.int64)
+    lon_steps = np.rint(np.asarray(lons, dtype=np.float64) / quantum).astype(np.int64)
+    lat_limit, lon_limit = round(90 / quantum), round(180 / quantum)
+    if (np.abs(lat_steps) > lat_limit).any() or (np.abs(lon_steps) > lon_limit).any():
+        return None
+
+    # One integer per position, so a single sort finds the repeats.
+    keys = (lat_steps + lat_limit) * (2 * lon_limit + 1) + (lon_steps + lon_limit)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    first = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+    representatives = order[first]
+
+    inverse = np.empty(len(keys), dtype=np.int64)
+    inverse[order] = np.cumsum(first) - 1
+    return (
+        lat_steps[representatives].tolist(),
+        lon_steps[representatives].tolist(),
+        inverse.tolist(),
+    )
+
+
+def group_congestion(
+    cells: "npt.NDArray[np.uint64]",
+    devices: "npt.NDArray[np.int64]",
+    resolution: int,
+) -> Dict[str, Dict[str, Any]]:
+    """Same output as `calculate_group_congestion`, from columns of pings"""
+    if len(cells) == 0:
+        return {}
+
+    # Like the row path, the first ping's resolution is taken as everyone's.
+    source_resolution = int(cells_resolution(cells[:1])[0])
+    if resolution > source_resolution:
+        raise ValueError(
+            f"Resolution {resolution} is finer than the pings' {source_resolution}"
+        )
+
+    parents = cells_to_parents(cells, resolution)
+    parent_keys = _cell_keys(parents, resolution)
+    parent_bits = 7 + resolution * _DIGIT_BITS
+    device_bits = max(1, int(devices.max()).bit_length())
+
+    if parent_bits + device_bits <= 64:
+        # Pack each (parent, device) pair into one uint64, a plain sort is far
+        # cheaper than a lexsort over two columns.
+        pairs = _sorted_distinct(
+            (parent_keys << np.uint64(device_bits)) | devices.astype(np.uint64)
+        )
+        device_parents, device_counts = _run_lengths(pairs >> np.uint64(device_bits))
+    else:
+        device_parents, device_counts = _distinct_counts(parent_keys, devices)
+
+    # Distinct children first, then count them under their parents.
+    child_keys = _sorted_distinct(_cell_keys(cells, source_resolution))
+    child_shift = np.uint64((source_resolution - resolution) * _DIGIT_BITS)
+    _, hex_counts = _run_lengths(child_keys >> child_shift)
+
+    # Rebuild full parent indexes from the keys and the shared high bits.
+    high_bits = int(parents[0]) & ~((1 << _RESOLUTION_OFFSET) - 1)
+    unused_digits = (1 << ((MAX_RESOLUTION - resolution) * _DIGIT_BITS)) - 1
+    parent_shift = (MAX_RESOLUTION - resolution) * _DIGIT_BITS
+
+    results = {}
+    for parent_key, device_count, hex_count in zip(
+        device_parents.tolist(), device_counts.tolist(), hex_counts.tolist()
+    ):
+        parent_hex = h3.int_to_str(
+            high_bits | (parent_key << parent_shift) | unused_digits
+        )
+        results[parent_hex] = {
+            "device_count": device_count,
+            "active_hex_count": hex_count,
+            # Per parent rather than 7^n, pentagons have fewer children.
+            "total_hex_count": h3.cell_to_children_size(parent_hex, source_resolution),
+        }
+    return results
+
+
+class ColumnarGroupCongestion:
+    """
+    Drop-in for `GroupCongestion` that buffers pings as columns.
+
+    Pages are appended as they arrive and aggregated in one pass in `results`.
+    """
+
+    def __init__(self, resolution: int) -> None:
+        if np is None:
+            raise RuntimeError("numpy is required for columnar congestion")
+        self._resolution = resolution
+        self._cells = array("Q")
+        self._devices = array("q")
+        # Intern device ids so they can be sorted and compared as integers.
+        self._device_codes: Dict[str, int] = {}
+
+    def _code(self, device_id: str) -> int:
+        return self._device_codes.setdefault(device_id, len(self._device_codes))
+
+    def add(self, pings: Iterable[PingRecord | DevicePing]) -> None:
+        for ping in pings:
+            self._cells.append(int(ping.h3_hex, 16))
+            self._devices.append(self._code(ping.device_id))
+
+    def add_devices(self, h3_hex: str, device_ids: Iterable[str]) -> None:
+        cell = int(h3_hex, 16)
+        for device_id in device_ids:
+            self._cells.append(cell)
+            self._devices.append(self._code(device_id))
+
+    def results(self) -> Dict[str, Dict[str, Any]]:
+        return group_congestion(
+            np.frombuffer(self._cells, dtype=np.uint64),
+            np.frombuffer(self._devices, dtype=np.int64),
+            self._resolution,
+        )
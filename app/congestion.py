@@ -1,61 +1,140 @@
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, List, Set
+from typing import Any, DefaultDict, Dict, Iterable, List, Protocol, Set
 
 import h3  # type: ignore
 
-from app.models import PingRecord
+from app import columnar
+from app.hll import HyperLogLog
+from app.models import DevicePing, PingRecord
+from app.settings import settings
 
 
-def calculate_device_congestion(pings: List[PingRecord]) -> Dict[str, int]:
-    """Get device counts from pings in a given h3_hex"""
-    # Make the dict a set for device uniqueness
-    hex_to_device_count: DefaultDict[str, Set[str]] = defaultdict(set)
+# Anything that can collect device ids and count the distinct ones, a set or a sketch
+class DeviceSet(Protocol):
+    def add(self, value: str) -> None: ...
 
-    # Add the device id to the set for each ping.
-    for ping in pings:
-        hex_to_device_count[ping.h3_hex].add(ping.device_id)
+    def update(self, values: Iterable[str]) -> None: ...
 
-    # Return the number of devices for each hex.
-    device_counts = {
-        h3_hex: len(devices) for h3_hex, devices in hex_to_device_count.items()
-    }
+    def __len__(self) -> int: ...
 
-    return device_counts
 
+class DeviceCongestion:
+    """Incrementally counts the distinct devices in each h3_hex"""
 
-def calculate_group_congestion(
-    pings: List[PingRecord], resolution: int
-) -> Dict[str, Dict[str, Any]]:
-    """Aggregate congestion data for a given resolution"""
+    def __init__(self) -> None:
+        # Make the dict a set for device uniqueness
+        self._hex_to_devices: DefaultDict[str, Set[str]] = defaultdict(set)
 
-    # Make our dict two sets of devices and child hexes for deuplication
-    parent_data: DefaultDict[str, Dict[str, Any]] = defaultdict(
-        lambda: {"devices": set(), "child_hexes": set()}
-    )
+    def add(self, pings: Iterable[PingRecord | DevicePing]) -> None:
+        # Add the device id to the set for each ping.
+        for ping in pings:
+            self._hex_to_devices[ping.h3_hex].add(ping.device_id)
 
-    if not pings:
-        return {}
+    def add_devices(self, h3_hex: str, device_ids: Iterable[str]) -> None:
+        # Pre-aggregated device sets merge straight in.
+        self._hex_to_devices[h3_hex].update(device_ids)
 
-    # Get the resolution of the first ping, all should be the same.
-    source_resolution = h3.get_resolution(pings[0].h3_hex)
+    def results(self) -> Dict[str, int]:
+        # Return the number of devices for each hex.
+        return {
+            h3_hex: len(devices) for h3_hex, devices in self._hex_to_devices.items()
+        }
 
-    # Iterate over the pings and add it to the dict of the parent hex.
-    for ping in pings:
-        parent_hex = h3.cell_to_parent(ping.h3_hex, resolution)
-        parent_data[parent_hex]["devices"].add(ping.device_id)
-        parent_data[parent_hex]["child_hexes"].add(ping.h3_hex)
 
-    results = {}
+class GroupCongestion:
+    """Incrementally aggregates congestion into parent hexes at a given resolution
+
+    With `approx` the devices in each parent are counted with a HyperLogLog,
+    which keeps memory per parent fixed however busy the area is.
+    """
+
+    def __init__(self, resolution: int, approx: bool = False) -> None:
+        self._resolution = resolution
+        self._source_resolution: int | None = None
+        # Make our dicts of devices and child hexes for deuplication
+        self._devices: DefaultDict[str, DeviceSet] = defaultdict(
+            HyperLogLog if approx else set
+        )
+        self._child_hexes: DefaultDict[str, Set[str]] = defaultdict(set)
+
+    def add_sketch(self, parent_hex: str, sketch: HyperLogLog) -> None:
+        # Serialized sketches (e.g. from other hexes or time buckets) merge in too.
+        devices = self._devices[parent_hex]
+        if not isinstance(devices, HyperLogLog):
+            raise ValueError("Sketches can only be merged in approximate mode")
+        devices.merge(sketch)
+
+    def add(self, pings: Iterable[PingRecord | DevicePing]) -> None:
+        # Iterate over the pings and add it to the dict of the parent hex.
+        for ping in pings:
+            if self._source_resolution is None:
+                # Get the resolution of the first ping, all should be the same.
+                self._source_resolution = h3.get_resolution(ping.h3_hex)
+
+            parent_hex = h3.cell_to_parent(ping.h3_hex, self._resolution)
+            self._devices[parent_hex].add(ping.device_id)
+            self._child_hexes[parent_hex].add(ping.h3_hex)
+
+    def add_devices(self, h3_hex: str, device_ids: Iterable[str]) -> None:
+        # Pre-aggregated device sets merge straight in.
+        if self._source_resolution is None:
+            self._source_resolution = h3.get_resolution(h3_hex)
+
+        parent_hex = h3.cell_to_parent(h3_hex, self._resolution)
+        self._devices[parent_hex].update(device_ids)
+        self._child_hexes[parent_hex].add(h3_hex)
+
+    def add_area(
+        self, h3_hex: str, device_ids: Iterable[str], child_hexes: Iterable[str]
+    ) -> None:
+        # Area items from the aggregate index merge in whole, at their own cell or coarser.
+        child_hexes = list(child_hexes)
+        if self._source_resolution is None and child_hexes:
+            self._source_resolution = h3.get_resolution(child_hexes[0])
+
+        parent_hex = h3.cell_to_parent(h3_hex, self._resolution)
+        self._devices[parent_hex].update(device_ids)
+        self._child_hexes[parent_hex].update(child_hexes)
+
+    def results(self) -> Dict[str, Dict[str, Any]]:
+        results = {}
+
+        # Loop over the parents
+        for parent_hex, devices in self._devices.items():
+            total_hex_count = h3.cell_to_children_size(
+                parent_hex, self._source_resolution
+            )
+
+            # Add the parent hex to the results.
+            results[parent_hex] = {
+                "device_count": len(devices),
+                "active_hex_count": len(self._child_hexes[parent_hex]),
+                "total_hex_count": total_hex_count,
+            }
+
+        return results
+
+
+# Helper to pick the group aggregator, columnar when numpy is installed
+def make_group_congestion(
+    resolution: int, approx: bool = False
+) -> GroupCongestion | columnar.ColumnarGroupCongestion:
+    if settings.congestion_columnar and columnar.available() and not approx:
+        return columnar.ColumnarGroupCongestion(resolution)
+    return GroupCongestion(resolution, approx=approx)
 
-    # Loop over the parents
-    for parent_hex, parent_info in parent_data.items():
-        total_hex_count = h3.cell_to_children_size(parent_hex, source_resolution)
 
-        # Add the parent hex to the results.
-        results[parent_hex] = {
-            "device_count": len(parent_info["devices"]),
-            "active_hex_count": len(parent_info["child_hexes"]),
-            "total_hex_count": total_hex_count,
-        }
+def calculate_device_congestion(pings: List[PingRecord]) -> Dict[str, int]:
+    """Get device counts from pings in a given h3_hex"""
+    congestion = DeviceCongestion()
+    congestion.add(pings)
+    return congestion.results()
+
 
-    return results
+def calculate_group_congestion(
+    pings: List[PingRecord], resolution: int, approx: bool = False
+) -> Dict[str, Dict[str, Any]]:
+    """Aggregate congestion data for a given resolution"""
+    congestion = GroupCongestion(resolution, approx=approx)
+    congestion.add(pings)
+    return congestion.results()
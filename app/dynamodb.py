@@ -1,14 +1,51 @@
-from datetime import datetime, timezone
+import asyncio
+from datetime import datetime, timedelta, timezone
 import logging
-from typing import Any, Dict, List
+import random
+import zlib
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Tuple,
+    TypeVar,
+)
 
+from botocore.exceptions import ClientError
 from pydantic_extra_types.coordinate import Latitude, Longitude
 from types_aiobotocore_dynamodb.client import DynamoDBClient
+from types_aiobotocore_dynamodb.type_defs import WriteRequestTypeDef
 
-from app.models import PingRecord
+from app.batching import MicroBatcher
+from app.models import DevicePing, DeviceSighting, PingRecord
+from app.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# BatchWriteItem takes at most 25 items per call
+# Doc Ref: https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_BatchWriteItem.html
+DYNAMODB_MAX_BATCH_SIZE = 25
+
+# Errors that fail a whole BatchWriteItem call but may pass on a retry. Any other
+# error means the request was rejected, usually because of one bad item.
+# Doc Ref: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Programming.Errors.html
+RETRYABLE_ERRORS = {
+    "InternalServerError",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ServiceUnavailable",
+    "ThrottlingException",
+}
+
+# A page from any paginated read, raw items or decoded
+PageT = TypeVar("PageT")
+
+# Separates the parts of a version 2 key, "h3_hex#shard" and "ts#device_id"
+KEY_SEPARATOR = "#"
+
 
 # Helper to check table exists
 async def create_table_if_not_exists(
@@ -16,21 +53,86 @@ async def create_table_if_not_exists(
 ) -> None:
     try:
         # If describe fails, it doesn't exist (or we don't have permission)
-        await dynamodb_client.describe_table(TableName=dynamodb_table_name)
+        response = await dynamodb_client.describe_table(TableName=dynamodb_table_name)
         logger.info(f"Table {dynamodb_table_name} already exists")
+
+        index_names = {
+            index["IndexName"]
+            for index in response["Table"].get("GlobalSecondaryIndexes", [])
+        }
+        if (
+            settings.dynamodb_time_index_enabled
+            and settings.dynamodb_time_index_name not in index_names
+        ):
+            logger.warning(
+                f"Table {dynamodb_table_name} is missing the "
+                f"{settings.dynamodb_time_index_name} index, global congestion "
+                f"queries will fail until it is added"
+            )
+        if (
+            settings.dynamodb_write_index_enabled
+            and settings.dynamodb_write_index_name not in index_names
+        ):
+            logger.warning(
+                f"Table {dynamodb_table_name} is missing the "
+                f"{settings.dynamodb_write_index_name} index, the congestion "
+                f"window's polls will fail until it is added"
+            )
     except dynamodb_client.exceptions.ResourceNotFoundException:
         logger.info(f"Table {dynamodb_table_name} does not exist, creating it")
+
+        attribute_definitions: List[Dict[str, Any]] = [
+            {"AttributeName": "h3_hex", "AttributeType": "S"},
+            {"AttributeName": "ts", "AttributeType": "S"},
+        ]
+        global_indexes: List[Dict[str, Any]] = []
+        if settings.dynamodb_time_index_enabled:
+            # Index the pings by time bucket, so recent pings can be queried without a scan.
+            attribute_definitions.append(
+                {"AttributeName": "ts_bucket", "AttributeType": "S"}
+            )
+            global_indexes.append(
+                {
+                    "IndexName": settings.dynamodb_time_index_name,
+                    "KeySchema": [
+                        {"AttributeName": "ts_bucket", "KeyType": "HASH"},
+                        {"AttributeName": "ts", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            )
+        if settings.dynamodb_write_index_enabled:
+            # And by when they were written, however late that was after their ts.
+            attribute_definitions += [
+                {"AttributeName": "written_bucket", "AttributeType": "S"},
+                {"AttributeName": "written_at", "AttributeType": "S"},
+            ]
+            global_indexes.append(
+                {
+                    "IndexName": settings.dynamodb_write_index_name,
+                    "KeySchema": [
+                        {"AttributeName": "written_bucket", "KeyType": "HASH"},
+                        {"AttributeName": "written_at", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {
+                        "ProjectionType": "INCLUDE",
+                        "NonKeyAttributes": ["device_id"],
+                    },
+                }
+            )
+        indexes: Dict[str, Any] = (
+            {"GlobalSecondaryIndexes": global_indexes} if global_indexes else {}
+        )
+
         await dynamodb_client.create_table(
             TableName=dynamodb_table_name,
             KeySchema=[
                 {"AttributeName": "h3_hex", "KeyType": "HASH"},
                 {"AttributeName": "ts", "KeyType": "RANGE"},
             ],
-            AttributeDefinitions=[
-                {"AttributeName": "h3_hex", "AttributeType": "S"},
-                {"AttributeName": "ts", "AttributeType": "S"},
-            ],
+            AttributeDefinitions=attribute_definitions,  # type: ignore[arg-type]
             BillingMode="PAY_PER_REQUEST",
+            **indexes,
         )
 
         await dynamodb_client.get_waiter("table_exists").wait(
@@ -44,59 +146,194 @@ async def store_ping_in_dynamodb(
     dynamodb_client: DynamoDBClient, dynamodb_table_name: str, ping_record: PingRecord
 ) -> None:
     # Convert to DDB item
-    item = {
-        "h3_hex": {"S": ping_record.h3_hex},
-        "device_id": {"S": ping_record.device_id},
-        "ts": {"S": ping_record.ts.astimezone(timezone.utc).replace(microsecond=0).isoformat()},
-        "lat": {"N": str(ping_record.lat)},
-        "lon": {"N": str(ping_record.lon)},
-        "accepted_at": {"S": ping_record.accepted_at.isoformat()},
-        "processed_at": {"S": ping_record.processed_at.isoformat()},
-    }
+    item = _ping_record_to_ddb_item(ping_record)
     await dynamodb_client.put_item(
         TableName=dynamodb_table_name,
         Item=item,
     )
 
 
+class DynamoDBBatchWriter(MicroBatcher[PingRecord, None]):
+    """
+    Buffers ping records and writes them with BatchWriteItem, 25 at a time.
+
+    `write` only returns once DynamoDB has acknowledged the item, so callers can
+    safely delete the source message afterwards. Unprocessed items are retried
+    with jittered exponential backoff, anything still unprocessed raises.
+
+    Writes are blind puts. Keys include the device, so a redelivered ping just
+    rewrites its own item, and no two pings share one. If DynamoDB rejects the
+    whole call as invalid, the items are put one by one, so only the bad item
+    fails and not every message that shared its batch.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        max_batch_size: int = settings.dynamodb_batch_size,
+        max_linger_ms: float = settings.dynamodb_batch_linger_ms,
+        max_in_flight: int = settings.dynamodb_batch_max_in_flight,
+        max_retries: int = settings.dynamodb_batch_max_retries,
+    ):
+        super().__init__(
+            max_batch_size=min(max_batch_size, DYNAMODB_MAX_BATCH_SIZE),
+            max_linger_seconds=max_linger_ms / 1000,
+            max_in_flight=max_in_flight,
+        )
+        self._dynamodb_client = dynamodb_client
+        self._dynamodb_table_name = dynamodb_table_name
+        self._max_retries = max_retries
+
+    async def write(self, ping_record: PingRecord) -> None:
+        """Queue a record for the next batch and wait until it is stored."""
+        await self.submit(ping_record)
+
+    async def _send_batch(
+        self, ping_records: List[PingRecord]
+    ) -> List[None | BaseException]:
+        # BatchWriteItem rejects duplicate keys, those are redeliveries of the same
+        # ping, so the last record for a key wins like back to back put_item calls.
+        pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for ping_record in ping_records:
+            item = _ping_record_to_ddb_item(ping_record)
+            pending[_item_key(item)] = item
+
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                await asyncio.sleep(_backoff_seconds(attempt))
+
+            requests: List[WriteRequestTypeDef] = [
+                {"PutRequest": {"Item": item}} for item in pending.values()
+            ]
+            try:
+                response = await self._dynamodb_client.batch_write_item(
+                    RequestItems={self._dynamodb_table_name: requests}
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] in RETRYABLE_ERRORS or len(pending) == 1:
+                    raise
+                logger.warning(f"Batch write rejected, putting items one by one: {e}")
+                return await self._put_each(ping_records, pending)
+
+            # Only the unprocessed items go around again.
+            unprocessed = response.get("UnprocessedItems", {}).get(
+                self._dynamodb_table_name, []
+            )
+            pending = {
+                _item_key(request["PutRequest"]["Item"]): request["PutRequest"]["Item"]
+                for request in unprocessed
+                if "PutRequest" in request
+            }
+            if not pending:
+                break
+
+            logger.warning(
+                f"{len(pending)} items unprocessed, retrying (attempt {attempt + 1})"
+            )
+
+        error = RuntimeError(
+            f"Items still unprocessed after {self._max_retries} retries"
+        )
+        return [
+            error if _item_key(_ping_record_to_ddb_item(record)) in pending else None
+            for record in ping_records
+        ]
+
+    async def _put_each(
+        self,
+        ping_records: List[PingRecord],
+        pending: Dict[Tuple[str, str], Dict[str, Any]],
+    ) -> List[None | BaseException]:
+        keys = list(pending)
+        results = await asyncio.gather(
+            *(
+                self._dynamodb_client.put_item(
+                    TableName=self._dynamodb_table_name, Item=pending[key]
+                )
+                for key in keys
+            ),
+            return_exceptions=True,
+        )
+        errors = {
+            key: result
+            for key, result in zip(keys, results)
+            if isinstance(result, BaseException)
+        }
+        return [
+            errors.get(_item_key(_ping_record_to_ddb_item(record)))
+            for record in ping_records
+        ]
+
+
+# Full jitter backoff, the sleep is random between 0 and the exponential cap
+# Doc Ref: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+def _backoff_seconds(attempt: int) -> float:
+    cap = min(
+        settings.dynamodb_batch_backoff_max_ms,
+        settings.dynamodb_batch_backoff_base_ms * 2**attempt,
+    )
+    return random.uniform(0, cap) / 1000
+
+
 # Helper to get a single ping from the table
 async def get_ping_from_dynamodb(
     dynamodb_client: DynamoDBClient,
     dynamodb_table_name: str,
     h3_hex: str,
     timestamp: datetime,
+    device_id: str | None = None,
 ) -> PingRecord | None:
-    response = await dynamodb_client.get_item(
-        TableName=dynamodb_table_name,
-        Key={"h3_hex": {"S": h3_hex}, "ts": {"S": timestamp.isoformat()}},
-    )
-    item = response.get("Item")
-    if not item:
-        return None
+    # With the device, the version 2 key is known exactly.
+    if device_id is not None and settings.dynamodb_key_version >= 2:
+        response = await dynamodb_client.get_item(
+            TableName=dynamodb_table_name,
+            Key={
+                "h3_hex": {"S": ping_partition_key(h3_hex, device_id)},
+                "ts": {"S": ping_sort_key(timestamp, device_id)},
+            },
+        )
+        found = response.get("Item")
+        if found:
+            return _ddb_item_to_ping_record(found)
+        if not settings.dynamodb_legacy_reads:
+            return None
 
-    return PingRecord(
-        h3_hex=item["h3_hex"]["S"],
-        device_id=item["device_id"]["S"],
-        ts=datetime.fromisoformat(item["ts"]["S"]),
-        lat=Latitude(item["lat"]["N"]),
-        lon=Longitude(item["lon"]["N"]),
-        accepted_at=datetime.fromisoformat(item["accepted_at"]["S"]),
-        processed_at=datetime.fromisoformat(item["processed_at"]["S"]),
-    )
+    # Otherwise look for a ping in that second, both key versions start with it.
+    for partition in ping_partition_keys(h3_hex):
+        pings = await dynamodb_client.query(
+            TableName=dynamodb_table_name,
+            KeyConditionExpression="h3_hex = :h3_hex AND begins_with(ts, :ts)",
+            ExpressionAttributeValues={
+                ":h3_hex": {"S": partition},
+                ":ts": {"S": ts_key(timestamp)},
+            },
+        )
+        for item in pings.get("Items", []):
+            if device_id is None or item["device_id"]["S"] == device_id:
+                return _ddb_item_to_ping_record(item)
 
+    return None
 
-# Helper to get all pings for a given hex
+
+# Helper to get all pings for a given hex, from every shard
 async def query_pings_by_hex(
     dynamodb_client: DynamoDBClient, dynamodb_table_name: str, h3_hex: str
 ) -> List[PingRecord]:
-    response = await dynamodb_client.query(
-        TableName=dynamodb_table_name,
-        KeyConditionExpression="h3_hex = :h3_hex",
-        ExpressionAttributeValues={":h3_hex": {"S": h3_hex}},
-    )
-    items = response.get("Items", [])
-
-    pings: List[PingRecord] = [_ddb_item_to_ping_record(item) for item in items]
+    pings: List[PingRecord] = []
+    async for items in merge_pages(
+        [
+            paginate(
+                dynamodb_client.query,
+                TableName=dynamodb_table_name,
+                KeyConditionExpression="h3_hex = :h3_hex",
+                ExpressionAttributeValues={":h3_hex": {"S": partition}},
+            )
+            for partition in ping_partition_keys(h3_hex)
+        ],
+        max_concurrency=settings.dynamodb_query_concurrency,
+    ):
+        pings.extend(_ddb_item_to_ping_record(item) for item in items)
 
     return pings
 
@@ -108,35 +345,346 @@ async def query_recent_pings(
     cutoff: datetime,
     h3_hex: str | None = None,
 ) -> List[PingRecord]:
+    pings: List[PingRecord] = []
+    async for page in iter_recent_pings(
+        dynamodb_client, dynamodb_table_name, cutoff=cutoff, h3_hex=h3_hex
+    ):
+        pings.extend(page)
+
+    return pings
+
+
+# Helper to stream recent pings a page at a time, following pagination
+async def iter_recent_pings(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    h3_hex: str | None = None,
+    segments: int = settings.dynamodb_scan_segments,
+    page_size: int | None = None,
+) -> AsyncIterator[List[PingRecord]]:
+    async for items in _iter_recent_items(
+        dynamodb_client, dynamodb_table_name, cutoff, h3_hex, segments, page_size
+    ):
+        yield [_ddb_item_to_ping_record(item) for item in items]
+
+
+# Helper to stream just the hex and device of recent pings, all congestion needs
+async def iter_recent_devices(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    h3_hex: str | None = None,
+    segments: int = settings.dynamodb_scan_segments,
+    page_size: int | None = None,
+) -> AsyncIterator[List[DevicePing]]:
+    # Smaller items mean fewer pages, and skipping Pydantic makes decoding cheap.
+    async for items in _iter_recent_items(
+        dynamodb_client,
+        dynamodb_table_name,
+        cutoff,
+        h3_hex,
+        segments,
+        page_size,
+        projection="h3_hex, device_id",
+    ):
+        yield [DevicePing(_item_hex(item), item["device_id"]["S"]) for item in items]
+
+
+# Helper to stream the hex, device and timestamp of recent pings
+async def iter_recent_sightings(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    segments: int = settings.dynamodb_scan_segments,
+    page_size: int | None = None,
+) -> AsyncIterator[List[DeviceSighting]]:
+    async for items in _iter_recent_items(
+        dynamodb_client,
+        dynamodb_table_name,
+        cutoff,
+        None,
+        segments,
+        page_size,
+        projection="h3_hex, device_id, ts",
+    ):
+        yield [
+            DeviceSighting(_item_hex(item), item["device_id"]["S"], _item_ts(item))
+            for item in items
+        ]
+
+
+# Helper to stream the hex, device and timestamp of pings written since `since`
+async def iter_written_sightings(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    since: datetime,
+    page_size: int | None = None,
+) -> AsyncIterator[List[DeviceSighting]]:
+    """Unlike `iter_recent_sightings`, this includes pings stored long after their ts."""
+    options: Dict[str, Any] = {"Limit": page_size} if page_size else {}
+    # Write times come from our own clocks, so there's no skew to look past.
+    pages = merge_pages(
+        [
+            paginate(
+                dynamodb_client.query,
+                TableName=dynamodb_table_name,
+                IndexName=settings.dynamodb_write_index_name,
+                KeyConditionExpression=(
+                    "written_bucket = :written_bucket AND written_at >= :since"
+                ),
+                ProjectionExpression="h3_hex, device_id, ts",
+                ExpressionAttributeValues={
+                    ":written_bucket": {"S": written_bucket},
+                    ":since": {"S": since.isoformat()},
+                },
+                **options,
+            )
+            for written_bucket in time_bucket_keys(since, skew_seconds=0)
+        ],
+        max_concurrency=settings.dynamodb_query_concurrency,
+    )
+    async for items in pages:
+        yield [
+            DeviceSighting(_item_hex(item), item["device_id"]["S"], _item_ts(item))
+            for item in items
+        ]
+
+
+# Helper to pick the query or scan for the window and stream its raw items
+def _iter_recent_items(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    h3_hex: str | None,
+    segments: int,
+    page_size: int | None,
+    projection: str | None = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    # Limit is only used to force smaller pages, DynamoDB caps pages at 1 MB anyway.
+    options: Dict[str, Any] = {"Limit": page_size} if page_size else {}
+    # Doc Ref: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Expressions.ProjectionExpressions.html
+    if projection:
+        options["ProjectionExpression"] = projection
+
     if h3_hex:
-        response = await dynamodb_client.query(
-            TableName=dynamodb_table_name,
-            KeyConditionExpression="h3_hex = :h3_hex AND ts >= :cutoff",
-            ExpressionAttributeValues={
-                ":h3_hex": {"S": h3_hex},
-                ":cutoff": {"S": cutoff.isoformat()},
-            },
+        # Both key versions sort by timestamp first, so one range covers them.
+        pages: AsyncIterator[List[Dict[str, Any]]] = merge_pages(
+            [
+                paginate(
+                    dynamodb_client.query,
+                    TableName=dynamodb_table_name,
+                    KeyConditionExpression="h3_hex = :h3_hex AND ts >= :cutoff",
+                    ExpressionAttributeValues={
+                        ":h3_hex": {"S": partition},
+                        ":cutoff": {"S": cutoff.isoformat()},
+                    },
+                    **options,
+                )
+                for partition in ping_partition_keys(h3_hex)
+            ],
+            max_concurrency=settings.dynamodb_query_concurrency,
+        )
+    elif settings.dynamodb_time_index_enabled:
+        # Only query the time buckets that overlap the window, one per shard.
+        pages = merge_pages(
+            [
+                paginate(
+                    dynamodb_client.query,
+                    TableName=dynamodb_table_name,
+                    IndexName=settings.dynamodb_time_index_name,
+                    KeyConditionExpression="ts_bucket = :ts_bucket AND ts >= :cutoff",
+                    ExpressionAttributeValues={
+                        ":ts_bucket": {"S": ts_bucket},
+                        ":cutoff": {"S": cutoff.isoformat()},
+                    },
+                    **options,
+                )
+                for ts_bucket in time_bucket_keys(cutoff)
+            ],
+            max_concurrency=settings.dynamodb_query_concurrency,
         )
     else:
-        response = await dynamodb_client.scan(
-            TableName=dynamodb_table_name,
-            FilterExpression="ts >= :cutoff",
-            ExpressionAttributeValues={":cutoff": {"S": cutoff.isoformat()}},
+        # Split the scan into segments that DynamoDB reads in parallel.
+        # Doc Ref: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Scan.html#Scan.ParallelScan
+        pages = merge_pages(
+            [
+                paginate(
+                    dynamodb_client.scan,
+                    TableName=dynamodb_table_name,
+                    FilterExpression="ts >= :cutoff",
+                    ExpressionAttributeValues={":cutoff": {"S": cutoff.isoformat()}},
+                    Segment=segment,
+                    TotalSegments=segments,
+                    **options,
+                )
+                for segment in range(segments)
+            ]
         )
 
-    items = response.get("Items", [])
+    return pages
 
-    pings: List[PingRecord] = [_ddb_item_to_ping_record(item) for item in items]
 
-    return pings
+# Follow LastEvaluatedKey until a query or scan is exhausted
+async def paginate(
+    operation: Callable[..., Awaitable[Any]], **kwargs: Any
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    while True:
+        response = await operation(**kwargs)
+        yield response.get("Items", [])
+
+        last_evaluated_key = response.get("LastEvaluatedKey")
+        if not last_evaluated_key:
+            return
+        kwargs["ExclusiveStartKey"] = last_evaluated_key
+
+
+# Run several paginated reads concurrently and yield their pages as they arrive
+async def merge_pages(
+    sources: List[AsyncIterator[PageT]],
+    max_concurrency: int | None = None,
+) -> AsyncIterator[PageT]:
+    # Bounded, so a slow consumer pauses the readers instead of buffering everything.
+    queue: asyncio.Queue[PageT | Exception | None] = asyncio.Queue(
+        maxsize=max(len(sources), 1) * 2
+    )
+    semaphore = asyncio.Semaphore(max_concurrency or max(len(sources), 1))
+
+    async def _pump(source: AsyncIterator[PageT]) -> None:
+        try:
+            async with semaphore:
+                async for page in source:
+                    await queue.put(page)
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    tasks = [asyncio.create_task(_pump(source)) for source in sources]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            page = await queue.get()
+            if page is None:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        # Stop any readers still going if we finished early or failed.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Time bucket partition for a ping, the shard suffix spreads a busy bucket's writes
+def time_bucket_key(ts: datetime, device_id: str) -> str:
+    bucket_seconds = settings.time_bucket_seconds
+    epoch = int(ts.timestamp())
+    bucket_start = datetime.fromtimestamp(
+        epoch - epoch % bucket_seconds, tz=timezone.utc
+    )
+    shard = zlib.crc32(device_id.encode()) % settings.time_bucket_shards
+    return f"{bucket_start.isoformat()}#{shard}"
+
+
+# Every time bucket partition that can hold pings newer than the cutoff
+def time_bucket_keys(
+    cutoff: datetime, skew_seconds: float = settings.max_clock_skew_seconds
+) -> List[str]:
+    bucket_seconds = settings.time_bucket_seconds
+    # Pings can be stamped slightly in the future, so look past now by the allowed skew.
+    end = int(
+        (datetime.now(timezone.utc) + timedelta(seconds=skew_seconds)).timestamp()
+    )
+    start = int(cutoff.timestamp())
+    start -= start % bucket_seconds
+
+    return [
+        f"{datetime.fromtimestamp(bucket_start, tz=timezone.utc).isoformat()}#{shard}"
+        for bucket_start in range(start, end + 1, bucket_seconds)
+        for shard in range(settings.time_bucket_shards)
+    ]
+
+
+# Partition for a ping, a device always lands in the same shard of its hex
+def ping_partition_key(h3_hex: str, device_id: str) -> str:
+    if settings.dynamodb_key_version < 2 or settings.dynamodb_hex_shards <= 1:
+        return h3_hex
+    shard = zlib.crc32(device_id.encode()) % settings.dynamodb_hex_shards
+    return f"{h3_hex}{KEY_SEPARATOR}{shard}"
+
+
+# Every partition a hex's pings can be in, legacy items sit under the bare hex
+def ping_partition_keys(h3_hex: str) -> List[str]:
+    if settings.dynamodb_key_version < 2 or settings.dynamodb_hex_shards <= 1:
+        return [h3_hex]
+    partitions = [
+        f"{h3_hex}{KEY_SEPARATOR}{shard}"
+        for shard in range(settings.dynamodb_hex_shards)
+    ]
+    if settings.dynamodb_legacy_reads:
+        partitions.append(h3_hex)
+    return partitions
+
+
+# Sort key for a ping, the device keeps pings in the same hex and second apart
+def ping_sort_key(ts: datetime, device_id: str) -> str:
+    if settings.dynamodb_key_version < 2:
+        return ts_key(ts)
+    return f"{ts_key(ts)}{KEY_SEPARATOR}{device_id}"
+
+
+# Helper to key a timestamp to the second, like the pings are
+def ts_key(ts: datetime) -> str:
+    return ts.astimezone(timezone.utc).replace(microsecond=0).isoformat()
+
+
+# The hex and timestamp of an item, whichever key version wrote it
+def _item_hex(item: Dict[str, Any]) -> str:
+    partition: str = item["h3_hex"]["S"]
+    return partition.partition(KEY_SEPARATOR)[0]
+
+
+def _item_ts(item: Dict[str, Any]) -> datetime:
+    return datetime.fromisoformat(item["ts"]["S"].partition(KEY_SEPARATOR)[0])
+
+
+# Convert a PingRecord into a DDB item
+def _ping_record_to_ddb_item(ping_record: PingRecord) -> Dict[str, Any]:
+    ts = ping_record.ts.astimezone(timezone.utc).replace(microsecond=0)
+    item = {
+        "h3_hex": {"S": ping_partition_key(ping_record.h3_hex, ping_record.device_id)},
+        "device_id": {"S": ping_record.device_id},
+        "ts": {"S": ping_sort_key(ts, ping_record.device_id)},
+        "lat": {"N": str(ping_record.lat)},
+        "lon": {"N": str(ping_record.lon)},
+        "accepted_at": {"S": ping_record.accepted_at.isoformat()},
+        "processed_at": {"S": ping_record.processed_at.isoformat()},
+    }
+    if settings.dynamodb_time_index_enabled:
+        item["ts_bucket"] = {"S": time_bucket_key(ts, ping_record.device_id)}
+    if settings.dynamodb_write_index_enabled:
+        # Stamped when the item is built, just before the write, however late that is.
+        written_at = datetime.now(timezone.utc)
+        item["written_at"] = {"S": written_at.isoformat()}
+        item["written_bucket"] = {
+            "S": time_bucket_key(written_at, ping_record.device_id)
+        }
+    return item
+
+
+# The table's primary key for an item
+def _item_key(item: Dict[str, Any]) -> Tuple[str, str]:
+    return item["h3_hex"]["S"], item["ts"]["S"]
 
 
 # Reduce code duplication for this conversion
 def _ddb_item_to_ping_record(item: Dict[str, Any]) -> PingRecord:
     return PingRecord(
-        h3_hex=item["h3_hex"]["S"],
+        h3_hex=_item_hex(item),
         device_id=item["device_id"]["S"],
-        ts=datetime.fromisoformat(item["ts"]["S"]),
+        ts=_item_ts(item),
         lat=Latitude(item["lat"]["N"]),
         lon=Longitude(item["lon"]["N"]),
         accepted_at=datetime.fromisoformat(item["accepted_at"]["S"]),
@@ -0,0 +1,233 @@
+import asyncio
+from dataclasses import dataclass, field
+import logging
+import time
+from typing import List
+
+from types_aiobotocore_dynamodb.client import DynamoDBClient
+from types_aiobotocore_sqs.client import SQSClient
+from types_aiobotocore_sqs.type_defs import MessageTypeDef
+
+from app.aggregates import AggregateWriter
+from app.coalescing import WriteCoalescer
+from app.dynamodb import DynamoDBBatchWriter
+from app.positions import PositionWriter
+from app.settings import settings
+from app.sqs import SQSAcknowledger
+from app.worker import REQUEUE_ATTEMPTS_ATTRIBUTE, EnrichmentPool, handle_message
+
+logger = logging.getLogger(__name__)
+
+# Doc Ref: https://docs.python.org/3/library/asyncio-queue.html#examples
+
+
+@dataclass
+class WorkerStats:
+    """Running totals for a worker engine."""
+
+    received: int = 0
+    stored: int = 0
+    # Stored pings that were coalesced rather than written
+    suppressed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def stored_per_second(self) -> float:
+        elapsed = self.elapsed_seconds
+        return self.stored / elapsed if elapsed > 0 else 0.0
+
+
+class WorkerEngine:
+    """
+    Moves pings from SQS to DynamoDB with concurrent receivers and processors.
+
+    Receivers long-poll SQS and push messages onto a bounded queue, processors
+    drain it. When the queue is full the receivers block, so memory stays
+    bounded no matter how far behind the processors are.
+    """
+
+    def __init__(
+        self,
+        sqs_client: SQSClient,
+        sqs_queue_url: str,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        receivers: int = settings.worker_receivers,
+        processors: int = settings.worker_processors,
+        queue_size: int = settings.worker_queue_size,
+        enrichment_processes: int = settings.worker_enrichment_processes,
+        coalesce_refresh_seconds: float = settings.worker_coalesce_refresh_seconds,
+    ):
+        self._sqs_client = sqs_client
+        self._sqs_queue_url = sqs_queue_url
+        self._dynamodb_client = dynamodb_client
+        self._dynamodb_table_name = dynamodb_table_name
+        self._receiver_count = receivers
+        self._processor_count = processors
+        self._messages: asyncio.Queue[MessageTypeDef] = asyncio.Queue(
+            maxsize=queue_size
+        )
+        self._dynamodb_writer = DynamoDBBatchWriter(
+            dynamodb_client, dynamodb_table_name
+        )
+        self._sqs_acknowledger = SQSAcknowledger(sqs_client, sqs_queue_url)
+        self._aggregate_writer = (
+            AggregateWriter(dynamodb_client, settings.dynamodb_aggregate_table_name)
+            if settings.aggregates_enabled
+            else None
+        )
+        self._position_writer = (
+            PositionWriter(dynamodb_client, settings.dynamodb_position_table_name)
+            if settings.positions_enabled
+            else None
+        )
+        # Parsing and enrichment move off the event loop when given processes.
+        self._enrichment_pool = (
+            EnrichmentPool(enrichment_processes) if enrichment_processes > 0 else None
+        )
+        # Same-cell pings from chatty devices skip the write when given a refresh.
+        self._write_coalescer = (
+            WriteCoalescer(coalesce_refresh_seconds)
+            if coalesce_refresh_seconds > 0
+            else None
+        )
+        self._stopping = asyncio.Event()
+        self.stats = WorkerStats()
+
+    def stop(self) -> None:
+        """Ask the engine to shut down, safe to call from a signal handler."""
+        self._stopping.set()
+
+    async def run(self) -> None:
+        """Run until `stop` is called, then finish the messages already received."""
+        self.stats = WorkerStats()
+        await self._dynamodb_writer.start()
+        await self._sqs_acknowledger.start()
+        if self._aggregate_writer is not None:
+            await self._aggregate_writer.start()
+        if self._position_writer is not None:
+            await self._position_writer.start()
+        if self._enrichment_pool is not None:
+            await self._enrichment_pool.start()
+
+        receivers = [
+            asyncio.create_task(self._receive()) for _ in range(self._receiver_count)
+        ]
+        processors = [
+            asyncio.create_task(self._process()) for _ in range(self._processor_count)
+        ]
+        logger.info(
+            f"Worker engine started with {self._receiver_count} receivers "
+            f"and {self._processor_count} processors"
+        )
+
+        # Report throughput periodically until we're told to stop.
+        reported = 0
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), settings.worker_report_seconds
+                )
+            except asyncio.TimeoutError:
+                pass
+            if self.stats.stored != reported:
+                logger.info(
+                    f"Stored {self.stats.stored - reported} pings "
+                    f"({self.stats.stored_per_second:.1f}/s overall)"
+                )
+                reported = self.stats.stored
+                if self._write_coalescer is not None:
+                    coalescer = self._write_coalescer.stats
+                    logger.info(
+                        f"Coalesced {coalescer.suppressed} of {coalescer.pings} "
+                        f"writes ({coalescer.suppressed_ratio:.0%}), "
+                        f"tracking {len(self._write_coalescer)} devices"
+                    )
+
+        logger.info("Worker engine stopping, finishing in-flight messages")
+
+        # Stop polling. Anything received but not queued yet becomes visible
+        # again once its visibility timeout expires.
+        await self._cancel(receivers)
+
+        # Let the processors drain what's already queued, then stop them.
+        await self._messages.join()
+        await self._cancel(processors)
+        if self._enrichment_pool is not None:
+            await self._enrichment_pool.stop()
+        await self._dynamodb_writer.stop()
+        await self._sqs_acknowledger.stop()
+        if self._aggregate_writer is not None:
+            await self._aggregate_writer.stop()
+        if self._position_writer is not None:
+            await self._position_writer.stop()
+
+        logger.info(
+            f"Worker engine stopped after storing {self.stats.stored} "
+            f"of {self.stats.received} received pings"
+        )
+
+    async def _receive(self) -> None:
+        while True:
+            try:
+                response = await self._sqs_client.receive_message(
+                    QueueUrl=self._sqs_queue_url,
+                    MaxNumberOfMessages=settings.max_pings,
+                    WaitTimeSeconds=settings.wait_time_seconds,
+                    MessageSystemAttributeNames=["ApproximateReceiveCount"],
+                    MessageAttributeNames=[REQUEUE_ATTEMPTS_ATTRIBUTE],
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error receiving messages: {e}", exc_info=True)
+                await asyncio.sleep(1)
+                continue
+
+            for message in response.get("Messages", []):
+                self.stats.received += 1
+                # Heartbeat the message from now on, since it may sit in the queue a while.
+                self._sqs_acknowledger.track(message["ReceiptHandle"])
+                # Blocks while the queue is full, which is our backpressure.
+                await self._messages.put(message)
+
+    async def _process(self) -> None:
+        while True:
+            message = await self._messages.get()
+            try:
+                records = await handle_message(
+                    self._sqs_client,
+                    self._sqs_queue_url,
+                    self._dynamodb_client,
+                    self._dynamodb_table_name,
+                    message,
+                    dynamodb_writer=self._dynamodb_writer,
+                    sqs_acknowledger=self._sqs_acknowledger,
+                    enrichment_pool=self._enrichment_pool,
+                    write_coalescer=self._write_coalescer,
+                )
+                self.stats.stored += len(records)
+                if self._write_coalescer is not None:
+                    self.stats.suppressed = self._write_coalescer.stats.suppressed
+                if self._aggregate_writer is not None:
+                    for record in records:
+                        self._aggregate_writer.add(record)
+                if self._position_writer is not None:
+                    for record in records:
+                        self._position_writer.add(record)
+            except Exception as e:
+                logger.error(f"Error handling message: {e}", exc_info=True)
+            finally:
+                # Never keep heartbeating a message we're done with.
+                self._sqs_acknowledger.release(message["ReceiptHandle"])
+                self._messages.task_done()
+
+    @staticmethod
+    async def _cancel(tasks: List[asyncio.Task[None]]) -> None:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
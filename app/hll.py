@@ -0,0 +1,117 @@
+import hashlib
+import math
+import struct
+from typing import Iterable, Self
+
+from app.settings import settings
+
+# HyperLogLog distinct counting, used for approximate congestion over large areas.
+# Memory is fixed at 2^precision bytes however many devices are added, and two
+# sketches with the same precision merge by taking the max of each register.
+
+# Doc Ref: https://algo.inria.fr/flajolet/Publications/FlFuGaMe07.pdf
+# Doc Ref: https://research.google/pubs/hyperloglog-in-practice-algorithmic-engineering-of-a-state-of-the-art-cardinality-estimation-algorithm/
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+# Serialized layout, a format byte and the precision, then the registers
+_DENSE = 0
+_SPARSE = 1
+_HEADER = struct.Struct(">BB")
+_SPARSE_ENTRY = struct.Struct(">HB")
+
+
+# Smallest precision whose standard error (1.04 / sqrt(2^p)) is within the bound
+def precision_for_error(error_rate: float) -> int:
+    precision = math.ceil(math.log2((1.04 / error_rate) ** 2))
+    return max(MIN_PRECISION, min(MAX_PRECISION, precision))
+
+
+class HyperLogLog:
+    """
+    A mergeable, approximate set of strings.
+
+    Supports `add`, `update` and `len` like a `set`, so it can stand in for one
+    where only the number of distinct members is needed.
+    """
+
+    def __init__(self, precision: int | None = None):
+        if precision is None:
+            precision = precision_for_error(settings.hll_error_rate)
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(
+                f"Precision must be between {MIN_PRECISION} and {MAX_PRECISION}"
+            )
+        self.precision = precision
+        self._registers = bytearray(1 << precision)
+
+    def add(self, value: str) -> None:
+        # 64 bit hash, the top bits pick the register and the rest set its rank.
+        hashed = int.from_bytes(
+            hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+        )
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        remainder = hashed & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - remainder.bit_length() + 1
+
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def update(self, values: Iterable[str]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Fold another sketch in, the result estimates the union."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precisions")
+        self._registers = bytearray(map(max, self._registers, other._registers))
+
+    def count(self) -> int:
+        """Estimate how many distinct values have been added."""
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-register for register in self._registers)
+
+        # Small cardinalities are far more accurate with linear counting.
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return round(estimate)
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def to_bytes(self) -> bytes:
+        """Serialize the sketch, sparse sketches only store their set registers."""
+        entries = [
+            (index, register)
+            for index, register in enumerate(self._registers)
+            if register
+        ]
+        if len(entries) * _SPARSE_ENTRY.size < len(self._registers):
+            return _HEADER.pack(_SPARSE, self.precision) + b"".join(
+                _SPARSE_ENTRY.pack(index, register) for index, register in entries
+            )
+        return _HEADER.pack(_DENSE, self.precision) + bytes(self._registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Self:
+        encoding, precision = _HEADER.unpack_from(data)
+        sketch = cls(precision)
+        body = memoryview(data)[_HEADER.size :]
+
+        if encoding == _DENSE:
+            if len(body) != len(sketch._registers):
+                raise ValueError("Dense sketch has the wrong number of registers")
+            sketch._registers[:] = body
+        elif encoding == _SPARSE:
+            for index, register in _SPARSE_ENTRY.iter_unpack(body):
+                sketch._registers[index] = register
+        else:
+            raise ValueError(f"Unknown sketch encoding {encoding}")
+
+        return sketch
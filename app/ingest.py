@@ -0,0 +1,161 @@
+from datetime import datetime
+import json
+from typing import Any, AsyncIterator, Dict, List
+
+from pydantic import ValidationError
+
+from app.models import PingPayload
+from app.settings import settings
+from app import wire
+
+# Parsing for ping uploads. Single pings are JSON or binary, bulk bodies are a
+# JSON array of pings, newline delimited JSON which is validated line by line as
+# it streams in, or a binary batch (see app.wire).
+
+# Doc Ref: https://github.com/ndjson/ndjson-spec
+# Doc Ref: https://docs.pydantic.dev/latest/concepts/json/
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl")
+
+
+# Helper to compare content types without their parameters
+def _media_type(content_type: str) -> str:
+    return content_type.split(";")[0].strip().lower()
+
+
+class TooManyPings(ValueError):
+    """The upload has more pings than `max_pings_per_request`"""
+
+
+class BodyTooLarge(ValueError):
+    """The upload is bigger than `max_request_bytes`"""
+
+
+# One rejected item from a bulk upload, with why
+def rejection(errors: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"status": "rejected", "errors": errors}
+
+
+def _rejected(e: ValidationError) -> Dict[str, Any]:
+    # Context can hold exceptions that can't be serialized, leave it out.
+    errors = e.errors(include_url=False, include_context=False)
+    return rejection([dict(error) for error in errors])
+
+
+# Validate a single ping, returning it stamped or the reasons it was rejected
+def validate_ping(
+    data: Any, accepted_at: datetime, from_json: bool = False
+) -> PingPayload | Dict[str, Any]:
+    try:
+        if from_json:
+            ping = PingPayload.model_validate_json(data)
+        else:
+            ping = PingPayload.model_validate(data)
+    except ValidationError as e:
+        return _rejected(e)
+
+    ping.accepted_at = accepted_at
+    return ping
+
+
+def parse_ping(content_type: str, body: bytes) -> PingPayload:
+    """Parse a single ping, raises `ValidationError` or `WireFormatError`"""
+    if _media_type(content_type) == wire.CONTENT_TYPE:
+        raw_pings = list(wire.iter_raw_pings(body))
+        if len(raw_pings) != 1:
+            raise wire.WireFormatError("Expected exactly one ping")
+        return wire.raw_to_ping(raw_pings[0])
+    return PingPayload.model_validate_json(body)
+
+
+# Same as `validate_ping`, for a decoded binary record
+def _validate_raw(
+    raw: wire.RawPing, accepted_at: datetime
+) -> PingPayload | Dict[str, Any]:
+    try:
+        ping = wire.raw_to_ping(raw)
+    except ValidationError as e:
+        return _rejected(e)
+    except (ValueError, OverflowError) as e:
+        # Times too far out for a datetime fail before validation, reject just this ping.
+        return rejection(
+            [{"type": "value_error", "loc": ("timestamp",), "msg": str(e)}]
+        )
+
+    ping.accepted_at = accepted_at
+    return ping
+
+
+# Helper to pass a streamed body through, refusing it once it's over `max_bytes`
+async def cap_bytes(
+    chunks: AsyncIterator[bytes], max_bytes: int
+) -> AsyncIterator[bytes]:
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise BodyTooLarge(f"At most {max_bytes} bytes per request")
+        yield chunk
+
+
+# Helper to split a streamed body into its non-empty lines
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+async def read_pings(
+    content_type: str,
+    chunks: AsyncIterator[bytes],
+    accepted_at: datetime,
+    max_pings: int = settings.max_pings_per_request,
+    max_bytes: int = settings.max_request_bytes,
+) -> AsyncIterator[PingPayload | Dict[str, Any]]:
+    """
+    Yield each item of a bulk upload, validated or rejected, in order.
+
+    Raises `ValueError` if the body as a whole can't be read, and stops reading
+    as soon as it's over `max_bytes`.
+    """
+    count = 0
+    media_type = _media_type(content_type)
+    chunks = cap_bytes(chunks, max_bytes)
+
+    if media_type in NDJSON_CONTENT_TYPES:
+        # Validate lines as they arrive, without holding the whole body.
+        async for line in iter_lines(chunks):
+            count += 1
+            if count > max_pings:
+                raise TooManyPings(f"At most {max_pings} pings per request")
+            yield validate_ping(line, accepted_at, from_json=True)
+        return
+
+    body = b"".join([chunk async for chunk in chunks])
+
+    if media_type == wire.CONTENT_TYPE:
+        # Malformed records fail the whole body, out of range values just the ping.
+        raw_pings = list(wire.iter_raw_pings(body))
+        if len(raw_pings) > max_pings:
+            raise TooManyPings(f"At most {max_pings} pings per request")
+        for raw in raw_pings:
+            yield _validate_raw(raw, accepted_at)
+        return
+
+    try:
+        items = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON: {e}") from e
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array of pings")
+    if len(items) > max_pings:
+        raise TooManyPings(f"At most {max_pings} pings per request")
+
+    for item in items:
+        yield validate_ping(item, accepted_at)
@@ -1,16 +1,20 @@
 from datetime import datetime
-from typing import Annotated, Optional
+from typing import Annotated, NamedTuple, Optional
 
 from pydantic import BaseModel, Field, field_serializer
 from pydantic_extra_types.coordinate import Latitude, Longitude
 
+from app.settings import settings
+
 # Doc Ref: https://docs.pydantic.dev/latest/concepts/types/
 # Doc Ref: https://docs.pydantic.dev/latest/concepts/serialization/
 
 
 # Model for the JSON objects we receive
 class PingPayload(BaseModel):
-    device_id: Annotated[str, Field(min_length=1)]
+    device_id: Annotated[
+        str, Field(min_length=1, max_length=settings.max_device_id_length)
+    ]
     timestamp: datetime
     lat: Latitude
     lon: Longitude
@@ -40,3 +44,16 @@ class PingRecord(BaseModel):
         return v.isoformat()
 
     ...
+
+
+# Just the fields congestion needs from a stored ping, read without validation
+class DevicePing(NamedTuple):
+    h3_hex: str
+    device_id: str
+
+
+# A DevicePing and when it was seen, for keeping a window of pings in memory
+class DeviceSighting(NamedTuple):
+    h3_hex: str
+    device_id: str
+    ts: datetime
@@ -0,0 +1,295 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+import logging
+from typing import Any, AsyncIterator, DefaultDict, Dict, List, Set
+
+from types_aiobotocore_dynamodb.client import DynamoDBClient
+
+from app.dynamodb import merge_pages, paginate, ts_key
+from app.models import DevicePing, PingRecord
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Latest positions, one item per device holding the hex it was last seen in,
+# and one membership item per hex and device currently in it. `/congestion`
+# reads the memberships, so its cost follows the number of active devices
+# rather than how often they ping.
+#
+# Device items live in the same table under `device#<device_id>`. They carry a
+# `current_hex` attribute that memberships don't, so scans can skip them.
+
+# Doc Ref: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Expressions.ConditionExpressions.html
+# Doc Ref: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/TTL.html
+
+DEVICE_PREFIX = "device#"
+
+
+# Helper to check the position table exists
+async def create_position_table_if_not_exists(
+    dynamodb_client: DynamoDBClient, dynamodb_table_name: str
+) -> None:
+    try:
+        await dynamodb_client.describe_table(TableName=dynamodb_table_name)
+        logger.info(f"Table {dynamodb_table_name} already exists")
+    except dynamodb_client.exceptions.ResourceNotFoundException:
+        logger.info(f"Table {dynamodb_table_name} does not exist, creating it")
+        await dynamodb_client.create_table(
+            TableName=dynamodb_table_name,
+            KeySchema=[
+                {"AttributeName": "h3_hex", "KeyType": "HASH"},
+                {"AttributeName": "device_id", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "h3_hex", "AttributeType": "S"},
+                {"AttributeName": "device_id", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+        await dynamodb_client.get_waiter("table_exists").wait(
+            TableName=dynamodb_table_name
+        )
+
+        # Devices that stop pinging are never read again, let DynamoDB expire them.
+        await dynamodb_client.update_time_to_live(
+            TableName=dynamodb_table_name,
+            TimeToLiveSpecification={"Enabled": True, "AttributeName": "expires_at"},
+        )
+        logger.info(f"Table {dynamodb_table_name} created")
+
+
+class PositionWriter:
+    """
+    Keeps each device's latest hex, and the hexes' memberships, up to date.
+
+    Only the newest record per device is buffered, and flushed every
+    `flush_seconds`. The device item is only moved forward in time, so
+    redelivered or out of order pings can't move a device back. A device that
+    changed hex joins the new one before it leaves the old one, so a read in
+    between may count it twice but never misses it. The old hex is remembered
+    until it's been left, so a retried flush still leaves it once the device
+    item already points at the new one.
+
+    A device that fails `max_attempts` flushes is dropped, so a failing table
+    can't keep it buffered forever. The hexes it was leaving are still
+    remembered, and left by its next successful move.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        flush_seconds: float = settings.position_flush_seconds,
+        max_concurrency: int = settings.dynamodb_query_concurrency,
+        max_attempts: int = settings.position_max_attempts,
+    ):
+        self._dynamodb_client = dynamodb_client
+        self._dynamodb_table_name = dynamodb_table_name
+        self._flush_seconds = flush_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: Dict[str, PingRecord] = {}
+        self._max_attempts = max_attempts
+        # Failed flushes so far, for the devices that have failed
+        self._attempts: Dict[str, int] = {}
+        # Positions lost to too many failures
+        self.dropped = 0
+        # Hexes each device has moved out of but not yet left
+        self._leaving: DefaultDict[str, Set[str]] = defaultdict(set)
+        self._flusher: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        # Don't lose what's still buffered.
+        await self.flush()
+
+    def add(self, ping_record: PingRecord) -> None:
+        """Move the record's device to its hex, unless we've seen a newer ping."""
+        latest = self._pending.get(ping_record.device_id)
+        if latest is None or latest.ts <= ping_record.ts:
+            self._pending[ping_record.device_id] = ping_record
+
+    async def flush(self) -> None:
+        """Write everything buffered so far."""
+        if not self._pending:
+            return
+
+        # Swap the buffer out so new records keep accumulating during the flush.
+        pending, self._pending = self._pending, {}
+        results = await asyncio.gather(
+            *(self._move(record) for record in pending.values()),
+            return_exceptions=True,
+        )
+
+        failed = 0
+        dropped = 0
+        for device_id, record, result in zip(pending, pending.values(), results):
+            if not isinstance(result, BaseException):
+                self._attempts.pop(device_id, None)
+                continue
+            failed += 1
+            attempts = self._attempts.get(device_id, 0) + 1
+            if attempts >= self._max_attempts:
+                self._attempts.pop(device_id, None)
+                self.dropped += 1
+                dropped += 1
+                continue
+            # Put it back, the next flush will try again.
+            self._attempts[device_id] = attempts
+            self.add(record)
+        if failed:
+            logger.error(
+                f"Failed to flush {failed} positions, dropped {dropped} of them"
+            )
+
+    async def _move(self, ping_record: PingRecord) -> None:
+        client = self._dynamodb_client
+        condition_failed = client.exceptions.ConditionalCheckFailedException
+        ts = ts_key(ping_record.ts)
+        expires_at = ping_record.ts + timedelta(seconds=settings.position_ttl_seconds)
+        values: Dict[str, Dict[str, Any]] = {
+            ":ts": {"S": ts},
+            ":expires_at": {"N": str(int(expires_at.timestamp()))},
+        }
+
+        async with self._semaphore:
+            try:
+                response = await client.update_item(
+                    TableName=self._dynamodb_table_name,
+                    Key=_device_key(ping_record.device_id),
+                    UpdateExpression=(
+                        "SET current_hex = :h3_hex, ts = :ts, expires_at = :expires_at"
+                    ),
+                    ConditionExpression="attribute_not_exists(ts) OR ts <= :ts",
+                    ExpressionAttributeValues={
+                        **values,
+                        ":h3_hex": {"S": ping_record.h3_hex},
+                    },
+                    ReturnValues="UPDATED_OLD",
+                )
+            except condition_failed:
+                # Another worker already stored a newer position.
+                return
+
+            previous = response.get("Attributes", {}).get("current_hex", {}).get("S")
+            leaving = self._leaving[ping_record.device_id]
+            if previous:
+                leaving.add(previous)
+            # Back in a hex it hadn't left yet, it's a member again.
+            leaving.discard(ping_record.h3_hex)
+
+            try:
+                await client.update_item(
+                    TableName=self._dynamodb_table_name,
+                    Key=_membership_key(ping_record.h3_hex, ping_record.device_id),
+                    UpdateExpression="SET ts = :ts, expires_at = :expires_at",
+                    ConditionExpression="attribute_not_exists(ts) OR ts <= :ts",
+                    ExpressionAttributeValues=values,
+                )
+            except condition_failed:
+                pass
+
+            for old_hex in sorted(leaving):
+                # Leave the old hex, unless the device has been back there since.
+                try:
+                    await client.delete_item(
+                        TableName=self._dynamodb_table_name,
+                        Key=_membership_key(old_hex, ping_record.device_id),
+                        ConditionExpression="ts < :ts",
+                        ExpressionAttributeValues={":ts": {"S": ts}},
+                    )
+                except condition_failed:
+                    pass
+                leaving.discard(old_hex)
+            del self._leaving[ping_record.device_id]
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing positions: {e}", exc_info=True)
+
+
+# Helper to stream the devices last seen in the window, a page at a time
+async def iter_recent_positions(
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    cutoff: datetime,
+    h3_hex: str | None = None,
+    segments: int = settings.dynamodb_scan_segments,
+) -> AsyncIterator[List[DevicePing]]:
+    values: Dict[str, Dict[str, str]] = {":cutoff": {"S": cutoff.isoformat()}}
+    projection = "h3_hex, device_id"
+
+    if h3_hex:
+        values[":h3_hex"] = {"S": h3_hex}
+        pages = paginate(
+            dynamodb_client.query,
+            TableName=dynamodb_table_name,
+            KeyConditionExpression="h3_hex = :h3_hex",
+            # Devices that went quiet stay members until they expire.
+            FilterExpression="ts >= :cutoff",
+            ProjectionExpression=projection,
+            ExpressionAttributeValues=values,
+        )
+    else:
+        pages = merge_pages(
+            [
+                paginate(
+                    dynamodb_client.scan,
+                    TableName=dynamodb_table_name,
+                    # Skip the device items, they'd count every device again.
+                    FilterExpression=(
+                        "ts >= :cutoff AND attribute_not_exists(current_hex)"
+                    ),
+                    ProjectionExpression=projection,
+                    ExpressionAttributeValues=values,
+                    Segment=segment,
+                    TotalSegments=segments,
+                )
+                for segment in range(segments)
+            ]
+        )
+
+    async for items in pages:
+        yield [
+            DevicePing(item["h3_hex"]["S"], item["device_id"]["S"]) for item in items
+        ]
+
+
+# Helper to get the hex a device was last seen in, if it's still kept
+async def get_device_position(
+    dynamodb_client: DynamoDBClient, dynamodb_table_name: str, device_id: str
+) -> str | None:
+    response = await dynamodb_client.get_item(
+        TableName=dynamodb_table_name, Key=_device_key(device_id)
+    )
+    item = response.get("Item")
+    if not item:
+        return None
+    h3_hex: str = item["current_hex"]["S"]
+    return h3_hex
+
+
+def _device_key(device_id: str) -> Dict[str, Any]:
+    return {
+        "h3_hex": {"S": f"{DEVICE_PREFIX}{device_id}"},
+        "device_id": {"S": device_id},
+    }
+
+
+def _membership_key(h3_hex: str, device_id: str) -> Dict[str, Any]:
+    return {"h3_hex": {"S": h3_hex}, "device_id": {"S": device_id}}
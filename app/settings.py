@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -5,6 +7,16 @@ class Settings(BaseSettings):
     # Congestion Map Settings
     default_h3_resolution: int = 12
     default_congestion_window: int = 30
+    h3_cache_enabled: bool = False  # Cache H3 indexing of repeated positions
+    h3_cache_size: int = 65_536
+    h3_cache_quantum_degrees: float = 1e-6  # ~0.1 m, well under the cell size
+    congestion_approx_default: bool = False  # Use HyperLogLog for resolution queries
+    hll_error_rate: float = 0.02  # Standard error of approximate device counts
+    congestion_columnar: bool = True  # Aggregate groups with numpy when installed
+    congestion_cache_ttl_seconds: float = 2  # 0 disables the response cache
+    congestion_cache_max_entries: int = 10_000
+    area_max_partitions: int = 343  # Child partitions an area query fans out over
+    congestion_max_k: int = 10  # Largest grid_disk radius a query can ask for
 
     # Ping validation settings
     max_clock_skew_seconds: int = 15 * 60  # 15 m
@@ -20,11 +32,108 @@ class Settings(BaseSettings):
     sqs_endpoint_url: str | None = None
     sqs_queue_name: str = "pings-queue"
     max_pings: int = 10
+    max_pings_per_request: int = 1000  # Bulk uploads to POST /pings
+    max_request_bytes: int = 1024 * 1024  # 1 MB, bulk upload bodies
+    # Characters, at 4 bytes each "ts#device_id" sort keys stay under DynamoDB's 1 KB
+    max_device_id_length: int = 200
+    sqs_binary_messages: bool = False  # Enable once every worker can decode them
+    # Pack bulk uploads into shared messages, enable once every worker can decode them
+    sqs_multi_ping_messages: bool = False
+    sqs_pings_per_message: int = 100
+    sqs_envelopes_enabled: bool = False  # Pack pings from every request into envelopes
+    sqs_envelope_max_pings: int = 2000
+    sqs_envelope_linger_ms: float = 50
+    sqs_max_message_bytes: int = 256 * 1024  # SQS message and batch payload limit
     wait_time_seconds: int = 20
+    sqs_batch_size: int = 10  # SendMessageBatch max is 10
+    sqs_batch_linger_ms: float = 5
+    sqs_batch_max_in_flight: int = 8
+    sqs_visibility_timeout_seconds: int = 60  # Matches the queue in infra/main.tf
+    sqs_heartbeat_seconds: float = 20  # How often in-flight messages are extended
+
+    # Worker Settings
+    worker_receivers: int = 4  # Concurrent long-polls against SQS
+    worker_processors: int = 32  # Concurrent message handlers
+    worker_queue_size: int = 200  # Received messages waiting on a processor
+    worker_report_seconds: int = 10
+    worker_processes: int | None = None  # run_worker.py --processes, CPU count if unset
+    worker_restart_backoff_seconds: float = 1  # Doubles with each crash in a row
+    worker_restart_backoff_max_seconds: float = 60
+    worker_shutdown_timeout_seconds: float = 30  # Then children are killed
+    # Requeues and redeliveries, then pings that keep failing to store are dropped
+    worker_max_requeues: int = 5
+    worker_enrichment_processes: int = 0  # Parse and enrich in a process pool, 0 inline
+    worker_enrichment_chunk_size: int = 50  # Message bodies per pool task
+    worker_enrichment_linger_ms: float = 5
+    # Skip same-cell writes this fresh, 0 turns coalescing off
+    worker_coalesce_refresh_seconds: float = 0
+    worker_coalesce_max_devices: int = 100_000  # Devices remembered per process
 
     # DynamoDB Settings
     dynamodb_endpoint_url: str | None = None
     dynamodb_table_name: str = "congestion-table"
+    dynamodb_batch_size: int = 25  # BatchWriteItem max is 25
+    dynamodb_batch_linger_ms: float = 50
+    dynamodb_batch_max_in_flight: int = 8
+    dynamodb_batch_max_retries: int = 8
+    dynamodb_batch_backoff_base_ms: float = 25
+    dynamodb_batch_backoff_max_ms: float = 2000
+    dynamodb_scan_segments: int = 4  # Parallel segments for full table scans
+    dynamodb_query_concurrency: int = 16  # Parallel queries for fan-out reads
+
+    # Ping keys. Version 2 sorts on "ts#device_id" so pings never collide, and
+    # can split each hex into shards. Version 1 is the legacy bare "ts" key.
+    dynamodb_key_version: int = 2
+    dynamodb_hex_shards: int = 1  # Partitions per hex, spreads a hot hex's writes
+    dynamodb_legacy_reads: bool = True  # Also read version 1 items
+
+    # Time bucket index, lets global congestion query recent buckets instead of scanning
+    dynamodb_time_index_enabled: bool = False
+    dynamodb_time_index_name: str = "ts-bucket-index"
+    # Indexes pings by when they were written too, so the window can tail new writes
+    dynamodb_write_index_enabled: bool = False
+    dynamodb_write_index_name: str = "written-bucket-index"
+    time_bucket_seconds: int = 5 * 60  # 5 minutes
+    time_bucket_shards: int = 4
+
+    # Per-hex, per-minute device aggregates maintained by the worker
+    aggregates_enabled: bool = False
+    dynamodb_aggregate_table_name: str = "congestion-aggregates"
+    aggregate_flush_seconds: float = 5
+    aggregate_ttl_seconds: int = 2 * 60 * 60  # 2 hours
+    # Hex and minute keys buffered between flushes, more are dropped
+    aggregate_max_pending: int = 100_000
+    aggregate_max_attempts: int = 5  # Flushes a key is tried in before it's dropped
+    # Coarser cells every ping is also counted in, keep them at 8 or finer so
+    # an area's child hexes fit in one item
+    aggregate_index_resolutions: List[int] = [8]
+    # Devices per area item, busier areas spill into more items for the minute
+    aggregate_area_max_devices: int = 2000
+    # Minute index on hex items, lets the global read query the window instead of scanning
+    aggregate_minute_index_enabled: bool = False
+    aggregate_minute_index_name: str = "minute-index"
+    aggregate_minute_shards: int = 8
+
+    # Latest hex per device and per-hex membership, read instead of raw pings
+    positions_enabled: bool = False
+    dynamodb_position_table_name: str = "congestion-positions"
+    position_flush_seconds: float = 1
+    position_ttl_seconds: int = 2 * 60 * 60  # 2 hours
+    position_max_attempts: int = 5  # Flushes a device is tried in before it's dropped
+
+    # In-memory window of recent pings in the API, /congestion answers from it
+    window_enabled: bool = False
+    window_poll_seconds: float = 2
+    # Re-read writes this far back, for slow batch writes and index lag
+    window_lookback_seconds: float = 20
+    # Read DynamoDB again once the last successful poll is older than this
+    window_max_staleness_seconds: float = 30
+
+    # Per-hex counts shared by every API worker through a memory-mapped file
+    snapshot_enabled: bool = False
+    snapshot_path: str = "/dev/shm/congestion.snapshot"  # tmpfs, so shared memory
+    snapshot_interval_seconds: float = 2
+    snapshot_max_age_seconds: float = 10  # Older snapshots aren't served
 
     model_config = SettingsConfigDict(
         env_file=[
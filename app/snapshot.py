@@ -0,0 +1,205 @@
+from array import array
+import asyncio
+from bisect import bisect_left
+from contextlib import suppress
+from datetime import datetime, timezone
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, Iterator, Tuple
+
+import h3  # type: ignore
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Shared congestion snapshot. Each Uvicorn worker answering /congestion from its
+# own reads repeats the same work once per worker. Instead, one worker, elected
+# by holding an flock on `<path>.lock`, periodically writes the per-hex device
+# counts to a file: a header, the sorted H3 cells as uint64, then their counts
+# as uint32. Every worker maps the file read-only and binary searches the cells
+# in place, nothing is copied or parsed.
+#
+# A new snapshot is written to a temporary file and renamed over the old one, so
+# readers see either the old file or the new one, never a partial write. Readers
+# notice the swap by the path pointing at a new inode, and map that instead.
+
+# Doc Ref: https://docs.python.org/3/library/mmap.html
+# Doc Ref: https://docs.python.org/3/library/os.html#os.replace
+# Doc Ref: https://docs.python.org/3/library/fcntl.html#fcntl.flock
+
+MAGIC = b"CGS1"
+# Magic, padding, cell count and build time, 8 byte aligned so the cells are too.
+HEADER = struct.Struct("=4s4xQd")
+
+
+def write_snapshot(path: str, counts: Dict[str, int], built_at: datetime) -> None:
+    """Write per-hex device counts as a snapshot, replacing any previous one."""
+    cells = sorted((h3.str_to_int(h3_hex), count) for h3_hex, count in counts.items())
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(cells), built_at.timestamp()))
+            f.write(array("Q", (cell for cell, _ in cells)).tobytes())
+            f.write(array("I", (count for _, count in cells)).tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+
+class Snapshot:
+    """
+    One mapped snapshot file.
+
+    The cells and counts are memoryviews over the mapping, so lookups read the
+    page cache directly. The file stays mapped for as long as the object lives,
+    even after a newer snapshot has replaced it.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.file_id = (stat.st_dev, stat.st_ino)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, built_at = HEADER.unpack_from(self._map)
+        if magic != MAGIC or len(self._map) != HEADER.size + 12 * count:
+            raise ValueError(f"Not a congestion snapshot: {path}")
+        view = memoryview(self._map)
+        cells_end = HEADER.size + 8 * count
+        self._cells = view[HEADER.size : cells_end].cast("Q")
+        self._counts = view[cells_end:].cast("I")
+        self.built_at = datetime.fromtimestamp(built_at, timezone.utc)
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    @property
+    def age_seconds(self) -> float:
+        return (datetime.now(timezone.utc) - self.built_at).total_seconds()
+
+    def get(self, h3_hex: str) -> int:
+        """The device count for a hex, 0 if it wasn't in the snapshot."""
+        cell = h3.str_to_int(h3_hex)
+        i = bisect_left(self._cells, cell)
+        if i < len(self._cells) and self._cells[i] == cell:
+            count: int = self._counts[i]
+            return count
+        return 0
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        for cell, count in zip(self._cells, self._counts):
+            yield h3.int_to_str(cell), count
+
+
+class SnapshotReader:
+    """Maps the latest snapshot at `path`, and remaps it once it's been swapped."""
+
+    def __init__(self, path: str = settings.snapshot_path):
+        self._path = path
+        self._snapshot: Snapshot | None = None
+
+    def current(self) -> Snapshot | None:
+        """The newest snapshot, or None before the first one is written."""
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        if self._snapshot is None or self._snapshot.file_id != (
+            stat.st_dev,
+            stat.st_ino,
+        ):
+            try:
+                self._snapshot = Snapshot(self._path)
+            except (OSError, ValueError) as e:
+                # Keep answering from the last good snapshot.
+                logger.warning(f"Error mapping congestion snapshot: {e}")
+        return self._snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.current()
+        return {
+            "cells": len(snapshot) if snapshot is not None else 0,
+            "age_seconds": (
+                round(snapshot.age_seconds, 1) if snapshot is not None else None
+            ),
+        }
+
+
+class SnapshotProducer:
+    """
+    Writes a snapshot every `interval_seconds`, if this process holds the lock.
+
+    Every worker runs one, and the ones that don't hold the lock keep trying, so
+    another worker takes over if the producing one exits.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[], Awaitable[Dict[str, int]]],
+        path: str = settings.snapshot_path,
+        interval_seconds: float = settings.snapshot_interval_seconds,
+    ):
+        self._load = load
+        self._path = path
+        self._interval_seconds = interval_seconds
+        self._lock_fd: int | None = None
+        self._task: asyncio.Task[None] | None = None
+        self.snapshots = 0
+
+    @property
+    def producing(self) -> bool:
+        return self._lock_fd is not None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock_fd is not None:
+            # Closing the file releases the lock for the other workers.
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def _run(self) -> None:
+        while True:
+            if self._lock_fd is None:
+                self._lock_fd = self._try_lock()
+            if self._lock_fd is not None:
+                try:
+                    # Stamp the snapshot with when its read started.
+                    built_at = datetime.now(timezone.utc)
+                    counts = await self._load()
+                    await asyncio.to_thread(
+                        write_snapshot, self._path, counts, built_at
+                    )
+                    self.snapshots += 1
+                except Exception as e:
+                    logger.error(
+                        f"Error writing congestion snapshot: {e}", exc_info=True
+                    )
+            await asyncio.sleep(self._interval_seconds)
+
+    def _try_lock(self) -> int | None:
+        fd = os.open(f"{self._path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        logger.info(f"Producing congestion snapshots at {self._path}")
+        return fd
@@ -1,15 +1,26 @@
-import json
+import asyncio
 import logging
-from typing import List
+from typing import Dict, List, Sequence, Tuple
 
 from botocore.exceptions import ClientError
 from types_aiobotocore_sqs.client import SQSClient
+from types_aiobotocore_sqs.type_defs import (
+    ChangeMessageVisibilityBatchRequestEntryTypeDef,
+    DeleteMessageBatchRequestEntryTypeDef,
+    SendMessageBatchRequestEntryTypeDef,
+)
 
+from app.batching import MicroBatcher
 from app.models import PingPayload
 from app.settings import settings
+from app.wire import encode_message
 
 logger = logging.getLogger(__name__)
 
+# SQS caps SendMessageBatch at 10 entries
+# Doc Ref: https://docs.aws.amazon.com/AWSSimpleQueueService/latest/APIReference/API_SendMessageBatch.html
+SQS_MAX_BATCH_SIZE = 10
+
 
 # Helper that takes in a ping and sends it to the queue
 async def send_ping_to_queue(
@@ -46,6 +57,338 @@ async def send_ping_to_queue(
         raise RuntimeError(f"Unknown error: {e}") from e
 
 
+class SQSBatchProducer(MicroBatcher[Sequence[PingPayload], str]):
+    """
+    Sends pings to the queue with SendMessageBatch instead of one call per ping.
+
+    Concurrent `send` calls are grouped into batches of up to 10 entries, each
+    caller gets back the MessageId of its own entry. A batch is split into
+    several calls when its entries add up to more than `max_message_bytes`,
+    and an entry over that on its own goes alone. With `multi_ping` or
+    `binary` set, `send_many` puts several pings in a single message, encoded
+    as binary when `binary` is set. Otherwise each ping gets its own message,
+    which workers from before multi-ping messages can still read.
+    """
+
+    def __init__(
+        self,
+        sqs_client: SQSClient,
+        sqs_queue_url: str,
+        max_batch_size: int = settings.sqs_batch_size,
+        max_linger_ms: float = settings.sqs_batch_linger_ms,
+        max_in_flight: int = settings.sqs_batch_max_in_flight,
+        max_message_bytes: int = settings.sqs_max_message_bytes,
+        binary: bool = settings.sqs_binary_messages,
+        multi_ping: bool = settings.sqs_multi_ping_messages,
+    ):
+        super().__init__(
+            max_batch_size=min(max_batch_size, SQS_MAX_BATCH_SIZE),
+            max_linger_seconds=max_linger_ms / 1000,
+            max_in_flight=max_in_flight,
+        )
+        self._sqs_client = sqs_client
+        self._sqs_queue_url = sqs_queue_url
+        self._max_message_bytes = max_message_bytes
+        self._binary = binary
+        self._multi_ping = multi_ping or binary
+
+    async def send(self, ping: PingPayload) -> str:
+        """Queue a ping for the next batch and return its MessageId."""
+        return await self.submit([ping])
+
+    async def send_many(self, pings: Sequence[PingPayload]) -> List[str]:
+        """Queue several pings, returns the MessageId each one went out in."""
+        if not self._multi_ping:
+            return list(await asyncio.gather(*(self.send(ping) for ping in pings)))
+        message_id = await self.submit(pings)
+        return [message_id] * len(pings)
+
+    async def _send_batch(
+        self, messages: List[Sequence[PingPayload]]
+    ) -> List[str | BaseException]:
+        return await _send_bodies(
+            self._sqs_client,
+            self._sqs_queue_url,
+            [encode_message(pings, self._binary) for pings in messages],
+            self._max_message_bytes,
+        )
+
+
+class SQSEnvelopeProducer(MicroBatcher[PingPayload, str]):
+    """
+    Packs many pings into each message instead of one message per ping.
+
+    Pings are collected until `max_pings` are waiting or the first has waited
+    `max_linger_ms`, then packed into envelopes of up to `max_message_bytes`,
+    up to 10 envelopes per SendMessageBatch. Each caller gets back the MessageId
+    of the envelope its ping went out in.
+    """
+
+    def __init__(
+        self,
+        sqs_client: SQSClient,
+        sqs_queue_url: str,
+        max_pings: int = settings.sqs_envelope_max_pings,
+        max_linger_ms: float = settings.sqs_envelope_linger_ms,
+        max_in_flight: int = settings.sqs_batch_max_in_flight,
+        max_message_bytes: int = settings.sqs_max_message_bytes,
+        binary: bool = settings.sqs_binary_messages,
+    ):
+        super().__init__(
+            max_batch_size=max_pings,
+            max_linger_seconds=max_linger_ms / 1000,
+            max_in_flight=max_in_flight,
+        )
+        self._sqs_client = sqs_client
+        self._sqs_queue_url = sqs_queue_url
+        self._max_message_bytes = max_message_bytes
+        self._binary = binary
+
+    async def send(self, ping: PingPayload) -> str:
+        """Queue a ping for the next envelope and return the envelope's MessageId."""
+        return await self.submit(ping)
+
+    async def send_many(self, pings: Sequence[PingPayload]) -> List[str]:
+        """Queue several pings, returns the MessageId each one went out in."""
+        return list(await asyncio.gather(*(self.submit(ping) for ping in pings)))
+
+    def _pack(self, pings: List[PingPayload]) -> List[Tuple[range, str]]:
+        # Halve any envelope that's over the limit until they all fit, a lone
+        # ping always fits.
+        envelopes = []
+        pending = [range(len(pings))]
+        while pending:
+            indexes = pending.pop()
+            body = encode_message(pings[indexes.start : indexes.stop], self._binary)
+            if len(indexes) == 1 or len(body.encode()) <= self._max_message_bytes:
+                envelopes.append((indexes, body))
+            else:
+                middle = indexes.start + len(indexes) // 2
+                pending.append(range(middle, indexes.stop))
+                pending.append(range(indexes.start, middle))
+        return envelopes
+
+    async def _send_batch(self, pings: List[PingPayload]) -> List[str | BaseException]:
+        envelopes = self._pack(pings)
+        sent = await _send_bodies(
+            self._sqs_client,
+            self._sqs_queue_url,
+            [body for _, body in envelopes],
+            self._max_message_bytes,
+        )
+
+        # Every ping gets the result of the envelope it was packed in.
+        results: List[str | BaseException] = [
+            RuntimeError("Ping missing from envelopes")
+        ] * len(pings)
+        for (indexes, _), result in zip(envelopes, sent):
+            for ping_index in indexes:
+                results[ping_index] = result
+
+        logger.debug(f"Sent {len(pings)} pings in {len(envelopes)} envelopes")
+        return results
+
+
+# Any producer the API can hand pings to
+PingProducer = SQSBatchProducer | SQSEnvelopeProducer
+
+
+# Helper to send message bodies in as few SendMessageBatch calls as they fit in
+async def _send_bodies(
+    sqs_client: SQSClient,
+    sqs_queue_url: str,
+    bodies: List[str],
+    max_batch_bytes: int,
+) -> List[str | BaseException]:
+    # SendMessageBatch caps the entries and their combined size, not just each one.
+    # A body over the size by itself goes alone, so it can only fail itself.
+    calls: List[List[int]] = [[]]
+    call_bytes = 0
+    for index, body in enumerate(bodies):
+        size = len(body.encode())
+        if calls[-1] and (
+            len(calls[-1]) == SQS_MAX_BATCH_SIZE or call_bytes + size > max_batch_bytes
+        ):
+            calls.append([])
+            call_bytes = 0
+        calls[-1].append(index)
+        call_bytes += size
+
+    responses = await asyncio.gather(
+        *(
+            _send_message_batch(
+                sqs_client, sqs_queue_url, [bodies[index] for index in call]
+            )
+            for call in calls
+        ),
+        return_exceptions=True,
+    )
+
+    results: List[str | BaseException] = [
+        RuntimeError("Message missing from batches")
+    ] * len(bodies)
+    for call, response in zip(calls, responses):
+        for position, index in enumerate(call):
+            results[index] = (
+                response if isinstance(response, BaseException) else response[position]
+            )
+    return results
+
+
+# Helper to send message bodies with SendMessageBatch, one result per body
+async def _send_message_batch(
+    sqs_client: SQSClient, sqs_queue_url: str, bodies: List[str]
+) -> List[str | BaseException]:
+    # Entry ids only need to be unique within the batch, so use the position.
+    entries: List[SendMessageBatchRequestEntryTypeDef] = [
+        {"Id": str(index), "MessageBody": body} for index, body in enumerate(bodies)
+    ]
+
+    try:
+        response = await sqs_client.send_message_batch(
+            QueueUrl=sqs_queue_url, Entries=entries
+        )
+    except ClientError as e:
+        error_code = e.response.get("Error", {}).get("Code", "Unknown")
+        error_message = e.response.get("Error", {}).get("Message", str(e))
+
+        logger.error(f"Error Sending Batch: {error_code} - {error_message}")
+        raise RuntimeError(
+            f"Error Sending Batch: {error_code} - {error_message}"
+        ) from e
+
+    results: List[str | BaseException] = [
+        RuntimeError("Message missing from batch response")
+    ] * len(bodies)
+
+    for success in response.get("Successful", []):
+        results[int(success["Id"])] = success["MessageId"]
+
+    # A batch can partially fail, only the failed entries get an error.
+    for failure in response.get("Failed", []):
+        error_message = (
+            f"Error Sending Message: {failure['Code']} - "
+            f"{failure.get('Message', 'Unknown')}"
+        )
+        logger.error(error_message)
+        results[int(failure["Id"])] = RuntimeError(error_message)
+
+    logger.debug(f"Sent batch of {len(bodies)} messages to queue")
+    return results
+
+
+class SQSAcknowledger(MicroBatcher[str, None]):
+    """
+    Deletes processed messages with DeleteMessageBatch and keeps slow ones hidden.
+
+    Receipt handles passed to `track` are heartbeated with
+    ChangeMessageVisibilityBatch until they are acked or released, so a slow
+    DynamoDB write doesn't let the message reappear and get processed twice.
+    """
+
+    def __init__(
+        self,
+        sqs_client: SQSClient,
+        sqs_queue_url: str,
+        max_linger_ms: float = settings.sqs_batch_linger_ms,
+        max_in_flight: int = settings.sqs_batch_max_in_flight,
+        visibility_timeout_seconds: int = settings.sqs_visibility_timeout_seconds,
+        heartbeat_seconds: float = settings.sqs_heartbeat_seconds,
+    ):
+        super().__init__(
+            max_batch_size=SQS_MAX_BATCH_SIZE,
+            max_linger_seconds=max_linger_ms / 1000,
+            max_in_flight=max_in_flight,
+        )
+        self._sqs_client = sqs_client
+        self._sqs_queue_url = sqs_queue_url
+        self._visibility_timeout_seconds = visibility_timeout_seconds
+        self._heartbeat_seconds = heartbeat_seconds
+        # Receipt handles still being processed, keyed by handle for O(1) removal.
+        self._tracked: Dict[str, None] = {}
+        self._heartbeat: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        await super().start()
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._extend_visibility())
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        await super().stop()
+
+    def track(self, receipt_handle: str) -> None:
+        """Keep the message hidden until it is acked or released."""
+        self._tracked[receipt_handle] = None
+
+    def release(self, receipt_handle: str) -> None:
+        """Stop heartbeating the message, it reappears after its visibility timeout."""
+        self._tracked.pop(receipt_handle, None)
+
+    async def ack(self, receipt_handle: str) -> None:
+        """Delete the message in the next batch."""
+        self.release(receipt_handle)
+        await self.submit(receipt_handle)
+
+    async def _send_batch(
+        self, receipt_handles: List[str]
+    ) -> List[None | BaseException]:
+        entries: List[DeleteMessageBatchRequestEntryTypeDef] = [
+            {"Id": str(index), "ReceiptHandle": receipt_handle}
+            for index, receipt_handle in enumerate(receipt_handles)
+        ]
+        response = await self._sqs_client.delete_message_batch(
+            QueueUrl=self._sqs_queue_url, Entries=entries
+        )
+
+        results: List[None | BaseException] = [None] * len(receipt_handles)
+        for failure in response.get("Failed", []):
+            error_message = (
+                f"Error Deleting Message: {failure['Code']} - "
+                f"{failure.get('Message', 'Unknown')}"
+            )
+            logger.error(error_message)
+            results[int(failure["Id"])] = RuntimeError(error_message)
+
+        return results
+
+    async def _extend_visibility(self) -> None:
+        while True:
+            await asyncio.sleep(self._heartbeat_seconds)
+
+            receipt_handles = list(self._tracked)
+            for start in range(0, len(receipt_handles), SQS_MAX_BATCH_SIZE):
+                chunk = receipt_handles[start : start + SQS_MAX_BATCH_SIZE]
+                entries: List[ChangeMessageVisibilityBatchRequestEntryTypeDef] = [
+                    {
+                        "Id": str(index),
+                        "ReceiptHandle": receipt_handle,
+                        "VisibilityTimeout": self._visibility_timeout_seconds,
+                    }
+                    for index, receipt_handle in enumerate(chunk)
+                ]
+                try:
+                    response = await self._sqs_client.change_message_visibility_batch(
+                        QueueUrl=self._sqs_queue_url, Entries=entries
+                    )
+                except Exception as e:
+                    logger.error(f"Error extending message visibility: {e}")
+                    continue
+
+                # Usually the message was deleted in the meantime, stop tracking it.
+                for failure in response.get("Failed", []):
+                    self.release(chunk[int(failure["Id"])])
+
+            if receipt_handles:
+                logger.debug(f"Extended visibility of {len(receipt_handles)} messages")
+
+
 async def get_or_create_queue(sqs_client: SQSClient, queue_name: str) -> str:
     try:
         response = await sqs_client.get_queue_url(QueueName=queue_name)
@@ -0,0 +1,236 @@
+from dataclasses import dataclass
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.engine import WorkerStats
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Runs several worker processes side by side so one container can use all of
+# its cores. Each child runs its own event loop and engine against the shared
+# queue, crashed children are restarted with exponential backoff, and a stop
+# is forwarded to every child as SIGTERM.
+
+# Doc Ref: https://docs.python.org/3/library/multiprocessing.html
+# Doc Ref: https://docs.python.org/3/library/multiprocessing.html#multiprocessing.connection.wait
+
+# A child's work, given its slot index, returning its engine's stats
+WorkerTarget = Callable[[int], WorkerStats | None]
+
+# How often the supervisor wakes up to notice a stop, at most
+_POLL_SECONDS = 0.5
+
+
+def restart_delay(failures: int, base_seconds: float, max_seconds: float) -> float:
+    """Backoff before restarting a slot that has crashed `failures` times in a row"""
+    return min(max_seconds, base_seconds * 2.0**failures)
+
+
+@dataclass
+class ProcessSummary:
+    """What one slot did over its lifetime, across restarts."""
+
+    index: int
+    pids: Tuple[int, ...] = ()
+    restarts: int = 0
+    received: int = 0
+    stored: int = 0
+    suppressed: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def stored_per_second(self) -> float:
+        elapsed = self.elapsed_seconds
+        return self.stored / elapsed if elapsed > 0 else 0.0
+
+    def merge(self, other: "ProcessSummary") -> None:
+        self.received += other.received
+        self.stored += other.stored
+        self.suppressed += other.suppressed
+        self.elapsed_seconds += other.elapsed_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "pids": list(self.pids),
+            "restarts": self.restarts,
+            "received": self.received,
+            "stored": self.stored,
+            "suppressed": self.suppressed,
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "stored_per_second": round(self.stored_per_second, 1),
+        }
+
+
+# Entry point of each child, reports its stats back to the supervisor on exit
+def _run_child(
+    target: WorkerTarget,
+    index: int,
+    results: "Queue[ProcessSummary]",
+) -> None:
+    # Forked children inherit the supervisor's handlers, the target sets its own.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    stats = target(index)
+    if stats is not None:
+        # Snapshot the stats here, their elapsed time is only meaningful in this process.
+        results.put(
+            ProcessSummary(
+                index,
+                pids=(os.getpid(),),
+                received=stats.received,
+                stored=stats.stored,
+                suppressed=stats.suppressed,
+                elapsed_seconds=stats.elapsed_seconds,
+            )
+        )
+
+
+class Supervisor:
+    """
+    Starts `processes` children running `target` and keeps them running.
+
+    A child that exits before `stop` is called is restarted after a backoff
+    that doubles with each consecutive crash, and resets once a child has
+    stayed up for `backoff_max_seconds`. `run` blocks until every child has
+    exited after a stop, then returns one summary per slot.
+    """
+
+    def __init__(
+        self,
+        target: WorkerTarget,
+        processes: int,
+        backoff_base_seconds: float = settings.worker_restart_backoff_seconds,
+        backoff_max_seconds: float = settings.worker_restart_backoff_max_seconds,
+        shutdown_timeout_seconds: float = settings.worker_shutdown_timeout_seconds,
+    ):
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        self._target = target
+        self._process_count = processes
+        self._backoff_base_seconds = backoff_base_seconds
+        self._backoff_max_seconds = backoff_max_seconds
+        self._shutdown_timeout_seconds = shutdown_timeout_seconds
+        self._context = multiprocessing.get_context()
+        self._results: "Queue[ProcessSummary]" = self._context.Queue()
+        self._stopping = threading.Event()
+
+        self._children: Dict[int, BaseProcess] = {}
+        self._started_at: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self.summaries = [ProcessSummary(index) for index in range(processes)]
+
+    def stop(self) -> None:
+        """Ask every child to shut down, safe to call from a signal handler."""
+        self._stopping.set()
+
+    def run(self) -> List[ProcessSummary]:
+        for index in range(self._process_count):
+            self._start(index)
+        logger.info(f"Supervisor started {self._process_count} worker processes")
+
+        while not self._stopping.is_set():
+            self._wait_for_exits()
+            self._reap()
+            self._restart_due()
+
+        self._shutdown()
+        return self.summaries
+
+    def _start(self, index: int) -> None:
+        process = self._context.Process(
+            target=_run_child,
+            args=(self._target, index, self._results),
+            name=f"worker-{index}",
+        )
+        process.start()
+        self._children[index] = process
+        self._started_at[index] = time.monotonic()
+        summary = self.summaries[index]
+        summary.pids = summary.pids + (process.pid or 0,)
+
+    # Block until a child exits, a restart is due, or it's time to check for a stop
+    def _wait_for_exits(self) -> None:
+        timeout = _POLL_SECONDS
+        if self._restart_at:
+            until_restart = min(self._restart_at.values()) - time.monotonic()
+            timeout = max(0.0, min(timeout, until_restart))
+        wait([process.sentinel for process in self._children.values()], timeout)
+
+    def _reap(self) -> None:
+        self._collect_results()
+        for index, process in list(self._children.items()):
+            if process.is_alive() or self._stopping.is_set():
+                continue
+
+            process.join()
+            del self._children[index]
+
+            # A child that stayed up a while has recovered, start its backoff over.
+            uptime = time.monotonic() - self._started_at[index]
+            if uptime >= self._backoff_max_seconds:
+                self._failures[index] = 0
+
+            failures = self._failures.get(index, 0)
+            delay = restart_delay(
+                failures, self._backoff_base_seconds, self._backoff_max_seconds
+            )
+            self._failures[index] = failures + 1
+            self._restart_at[index] = time.monotonic() + delay
+            logger.error(
+                f"Worker process {index} (pid {process.pid}) exited with code "
+                f"{process.exitcode}, restarting in {delay:.1f}s"
+            )
+
+    def _restart_due(self) -> None:
+        now = time.monotonic()
+        for index, restart_at in list(self._restart_at.items()):
+            if restart_at > now or self._stopping.is_set():
+                continue
+            del self._restart_at[index]
+            self.summaries[index].restarts += 1
+            self._start(index)
+
+    def _shutdown(self) -> None:
+        logger.info("Supervisor stopping, forwarding SIGTERM to worker processes")
+        self._restart_at.clear()
+        for process in self._children.values():
+            if process.is_alive() and process.pid is not None:
+                os.kill(process.pid, signal.SIGTERM)
+
+        # Give the children time to finish their in-flight messages, then force it.
+        deadline = time.monotonic() + self._shutdown_timeout_seconds
+        for process in self._children.values():
+            while process.is_alive() and time.monotonic() < deadline:
+                # Drain results as we go, a child blocks on exit until its put is read.
+                self._collect_results()
+                process.join(_POLL_SECONDS)
+            if process.is_alive():
+                logger.warning(
+                    f"Worker process {process.name} (pid {process.pid}) "
+                    "didn't stop in time, killing it"
+                )
+                process.kill()
+                process.join()
+        self._collect_results()
+        self._children.clear()
+
+    def _collect_results(self) -> None:
+        while True:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                return
+            self.summaries[result.index].merge(result)
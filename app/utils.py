@@ -1,8 +1,10 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence
 from datetime import datetime, timezone
+from functools import lru_cache
 
 from h3 import latlng_to_cell  # type: ignore
 
+from app import columnar
 from app.settings import settings
 
 
@@ -13,3 +15,76 @@ def coords_to_hex(
     lat: float, lon: float, resolution: int = settings.default_h3_resolution
 ) -> Any:
     return latlng_to_cell(lat, lon, resolution)
+
+
+# Doc Ref: https://docs.python.org/3/library/functools.html#functools.lru_cache
+# Doc Ref: https://h3geo.org/docs/core-library/restable/
+
+# Cached positions are rounded to `h3_cache_quantum_degrees` (1e-6, ~0.1 m),
+# well under the ~9 m edge of a resolution 12 cell. Finer resolutions than
+# that always index the exact coordinates.
+_CACHE_MAX_RESOLUTION = 12
+# Below this many coordinates numpy costs more than it saves
+_VECTORIZE_MIN = 64
+
+
+@lru_cache(maxsize=settings.h3_cache_size)
+def _quantized_cell(lat_steps: int, lon_steps: int, resolution: int) -> Any:
+    quantum = settings.h3_cache_quantum_degrees
+    return latlng_to_cell(lat_steps * quantum, lon_steps * quantum, resolution)
+
+
+def _cacheable(resolution: int) -> bool:
+    return settings.h3_cache_enabled and resolution <= _CACHE_MAX_RESOLUTION
+
+
+def cached_coords_to_hex(
+    lat: float, lon: float, resolution: int = settings.default_h3_resolution
+) -> Any:
+    """
+    `coords_to_hex` for stationary devices, repeated positions skip H3.
+
+    A point within a quantum of a cell edge can land in the neighbouring cell,
+    well inside GPS error.
+    """
+    if not _cacheable(resolution):
+        return coords_to_hex(lat, lon, resolution)
+    quantum = settings.h3_cache_quantum_degrees
+    return _quantized_cell(round(lat / quantum), round(lon / quantum), resolution)
+
+
+def coords_to_hexes(
+    lats: Sequence[float],
+    lons: Sequence[float],
+    resolution: int = settings.default_h3_resolution,
+) -> List[str]:
+    """Index many coordinates at once, each distinct position only once"""
+    if not _cacheable(resolution):
+        return [coords_to_hex(lat, lon, resolution) for lat, lon in zip(lats, lons)]
+
+    if len(lats) >= _VECTORIZE_MIN and columnar.available():
+        positions = columnar.distinct_positions(
+            lats, lons, settings.h3_cache_quantum_degrees
+        )
+        # Out of range coordinates wrap in H3, leave those to the scalar path.
+        if positions is not None:
+            lat_steps, lon_steps, inverse = positions
+            cells = [
+                _quantized_cell(lat, lon, resolution)
+                for lat, lon in zip(lat_steps, lon_steps)
+            ]
+            return [cells[i] for i in inverse]
+
+    return [cached_coords_to_hex(lat, lon, resolution) for lat, lon in zip(lats, lons)]
+
+
+def h3_cache_info() -> Dict[str, Any]:
+    info = _quantized_cell.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "entries": info.currsize,
+        "max_entries": info.maxsize,
+        "hit_rate": info.hits / lookups if lookups else 0.0,
+    }
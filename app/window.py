@@ -0,0 +1,220 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import logging
+import math
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Protocol, Set
+
+from types_aiobotocore_dynamodb.client import DynamoDBClient
+
+from app.dynamodb import iter_recent_sightings, iter_written_sightings
+from app.models import DeviceSighting
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# In-memory congestion window. The API keeps the last `default_congestion_window`
+# minutes of pings as one hex -> device set map per minute, in a ring with a
+# slot per minute. Writing to a slot that still holds an older minute clears it
+# first, so old minutes expire as the ring turns without a separate sweep.
+#
+# The window is filled with one time index read at startup, then kept current by
+# tailing the write index every `window_poll_seconds`. Polls go by when pings
+# were written, not their timestamps, so pings that sat in the queue still land
+# in their minute. Each poll reads what was written since the last one plus
+# `window_lookback_seconds`, for writes still in flight and index lag. Device
+# sets make re-reading the same pings harmless. If polls keep failing for
+# `window_max_staleness_seconds`, the window stops answering until one succeeds.
+
+
+class DeviceAggregator(Protocol):
+    def add_devices(self, h3_hex: str, device_ids: Iterable[str]) -> None: ...
+
+
+def _minute(ts: datetime) -> int:
+    return int(ts.timestamp()) // 60
+
+
+class SlidingWindow:
+    """
+    Per-minute device sets for the last `window_minutes`, in a ring buffer.
+
+    Counts are by whole minutes, so like the aggregates the window can include
+    up to one extra minute before the cutoff.
+    """
+
+    def __init__(
+        self,
+        window_minutes: int = settings.default_congestion_window,
+        skew_seconds: int = settings.max_clock_skew_seconds,
+    ):
+        # The cutoff's minute, every minute up to now, and pings stamped in the future.
+        self._size = window_minutes + 1 + math.ceil(skew_seconds / 60)
+        self._minutes: List[int] = [-1] * self._size
+        self._buckets: List[Dict[str, Set[str]]] = [{} for _ in range(self._size)]
+
+    def add(self, sightings: Iterable[DeviceSighting]) -> None:
+        for h3_hex, device_id, ts in sightings:
+            minute = _minute(ts)
+            slot = minute % self._size
+            if self._minutes[slot] != minute:
+                if self._minutes[slot] > minute:
+                    # The slot has moved on, this minute already expired.
+                    continue
+                self._minutes[slot] = minute
+                self._buckets[slot] = {}
+            self._buckets[slot].setdefault(h3_hex, set()).add(device_id)
+
+    def expire(self, cutoff: datetime) -> None:
+        """Free the minutes before the cutoff, the ring only reuses slots it writes."""
+        first = _minute(cutoff)
+        for slot, minute in enumerate(self._minutes):
+            if 0 <= minute < first:
+                self._minutes[slot] = -1
+                self._buckets[slot] = {}
+
+    def collect(
+        self,
+        congestion: DeviceAggregator,
+        cutoff: datetime,
+        contains: Callable[[str], bool] | None = None,
+        h3_hex: str | None = None,
+    ) -> None:
+        """Feed the devices since the cutoff into an aggregator, for one hex or an area."""
+        first = _minute(cutoff)
+        # The same hexes come up every minute, so only test each one once.
+        inside: Dict[str, bool] = {}
+        for minute, bucket in zip(self._minutes, self._buckets):
+            if minute < first:
+                continue
+            if h3_hex is not None:
+                # A single hex is a lookup per minute.
+                devices = bucket.get(h3_hex)
+                if devices:
+                    congestion.add_devices(h3_hex, devices)
+                continue
+            for bucket_hex, devices in bucket.items():
+                if contains is not None:
+                    if bucket_hex not in inside:
+                        inside[bucket_hex] = contains(bucket_hex)
+                    if not inside[bucket_hex]:
+                        continue
+                congestion.add_devices(bucket_hex, devices)
+
+    def entries(self) -> int:
+        return sum(
+            len(devices) for bucket in self._buckets for devices in bucket.values()
+        )
+
+
+class CongestionWindow:
+    """
+    A SlidingWindow filled from the ping table and kept current by polling it.
+
+    `ready` is only set once the startup read has finished, and `fresh` only
+    while the last successful read is recent. Otherwise the API keeps reading
+    DynamoDB.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        window_minutes: int = settings.default_congestion_window,
+        poll_seconds: float = settings.window_poll_seconds,
+        lookback_seconds: float = settings.window_lookback_seconds,
+        max_staleness_seconds: float = settings.window_max_staleness_seconds,
+    ):
+        self._dynamodb_client = dynamodb_client
+        self._dynamodb_table_name = dynamodb_table_name
+        self._window = timedelta(minutes=window_minutes)
+        self._poll_seconds = poll_seconds
+        self._lookback = timedelta(seconds=lookback_seconds)
+        self._max_staleness_seconds = max_staleness_seconds
+        self.window = SlidingWindow(window_minutes)
+        self.ready = asyncio.Event()
+        self._polls = 0
+        self._last_poll_at: float | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def fresh(self) -> bool:
+        """Whether the window is ready and has been read recently enough to answer."""
+        return (
+            self.ready.is_set()
+            and self._last_poll_at is not None
+            and time.monotonic() - self._last_poll_at <= self._max_staleness_seconds
+        )
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        # Fill the whole window once, then only ever read what was written since.
+        tail_from = datetime.now(timezone.utc)
+        while not self.ready.is_set():
+            try:
+                started = time.monotonic()
+                now = datetime.now(timezone.utc)
+                await self._read(
+                    iter_recent_sightings(
+                        self._dynamodb_client,
+                        self._dynamodb_table_name,
+                        now - self._window,
+                    )
+                )
+                tail_from = now
+                self.ready.set()
+                logger.info(
+                    f"Congestion window hydrated with {self.window.entries()} "
+                    f"entries in {time.monotonic() - started:.1f}s"
+                )
+            except Exception as e:
+                logger.error(f"Error hydrating congestion window: {e}", exc_info=True)
+                await asyncio.sleep(self._poll_seconds)
+
+        while True:
+            await asyncio.sleep(self._poll_seconds)
+            try:
+                now = datetime.now(timezone.utc)
+                await self._read(
+                    iter_written_sightings(
+                        self._dynamodb_client,
+                        self._dynamodb_table_name,
+                        tail_from - self._lookback,
+                    )
+                )
+                # Only move on once the read succeeded, a failed poll is read again.
+                tail_from = now
+                self.window.expire(now - self._window)
+            except Exception as e:
+                logger.error(f"Error polling congestion window: {e}", exc_info=True)
+
+    async def _read(self, pages: AsyncIterator[List[DeviceSighting]]) -> None:
+        async for page in pages:
+            self.window.add(page)
+        self._polls += 1
+        self._last_poll_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready.is_set(),
+            "fresh": self.fresh,
+            "entries": self.window.entries(),
+            "polls": self._polls,
+            "seconds_since_poll": (
+                round(time.monotonic() - self._last_poll_at, 1)
+                if self._last_poll_at is not None
+                else None
+            ),
+        }
@@ -0,0 +1,142 @@
+import base64
+from datetime import datetime, timezone
+import json
+import struct
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from app.models import PingPayload
+from app.settings import settings
+
+# Compact binary encoding for pings, for clients and for SQS message bodies.
+#
+# A body is a version byte and a ping count, followed by that many records.
+# Each record is the timestamp and accepted time as epoch millis (0 when not
+# accepted yet), lat and lon as float64, then the UTF-8 device id and its length.
+
+# Doc Ref: https://docs.python.org/3/library/struct.html
+
+CONTENT_TYPE = "application/x-ping"
+# Marks SQS bodies holding base64 binary pings, JSON bodies never start with it.
+SQS_PREFIX = "b1:"
+
+_VERSION = 1
+_HEADER = struct.Struct(">BI")
+_RECORD = struct.Struct(">qqddH")
+
+RawPing = Tuple[str, int, int, float, float]
+
+
+class WireFormatError(ValueError):
+    """The body isn't a well formed binary ping payload"""
+
+
+def _to_millis(ts: datetime) -> int:
+    return round(ts.timestamp() * 1000)
+
+
+def _from_millis(millis: int) -> datetime:
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+
+
+def encode_pings(pings: Sequence[PingPayload]) -> bytes:
+    parts = [_HEADER.pack(_VERSION, len(pings))]
+    for ping in pings:
+        device_id = ping.device_id.encode()
+        accepted_at = _to_millis(ping.accepted_at) if ping.accepted_at else 0
+        parts.append(
+            _RECORD.pack(
+                _to_millis(ping.timestamp),
+                accepted_at,
+                ping.lat,
+                ping.lon,
+                len(device_id),
+            )
+        )
+        parts.append(device_id)
+    return b"".join(parts)
+
+
+# Helper to walk the records of a body without building models
+def iter_raw_pings(data: bytes) -> Iterator[RawPing]:
+    try:
+        version, count = _HEADER.unpack_from(data)
+        if version != _VERSION:
+            raise WireFormatError(f"Unknown wire format version {version}")
+
+        offset = _HEADER.size
+        for _ in range(count):
+            ts, accepted_at, lat, lon, length = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            if offset + length > len(data):
+                raise WireFormatError("Truncated device id")
+            device_id = data[offset : offset + length].decode()
+            offset += length
+            yield device_id, ts, accepted_at, lat, lon
+    except (struct.error, UnicodeDecodeError) as e:
+        raise WireFormatError(f"Invalid binary ping payload: {e}") from e
+
+    if offset != len(data):
+        raise WireFormatError("Trailing bytes after the last ping")
+
+
+# Build a payload without validation, for values already checked
+# Doc Ref: https://docs.pydantic.dev/latest/api/base_model/#pydantic.BaseModel.model_construct
+def _trusted_ping(values: Dict[str, Any]) -> PingPayload:
+    return PingPayload.model_construct(**values)
+
+
+# Build the payload, skipping Pydantic when the values are obviously in range
+def raw_to_ping(raw: RawPing) -> PingPayload:
+    device_id, ts, accepted_at, lat, lon = raw
+    timestamp = _from_millis(ts)
+    accepted = _from_millis(accepted_at) if accepted_at else None
+
+    if (
+        0 < len(device_id) <= settings.max_device_id_length
+        and -90 <= lat <= 90
+        and -180 <= lon <= 180
+    ):
+        return _trusted_ping(
+            {
+                "device_id": device_id,
+                "timestamp": timestamp,
+                "lat": lat,
+                "lon": lon,
+                "accepted_at": accepted,
+            }
+        )
+
+    # Anything else goes through validation so it's rejected the same way as JSON.
+    return PingPayload.model_validate(
+        {
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "lat": lat,
+            "lon": lon,
+            "accepted_at": accepted,
+        }
+    )
+
+
+def decode_pings(data: bytes) -> List[PingPayload]:
+    return [raw_to_ping(raw) for raw in iter_raw_pings(data)]
+
+
+# Helpers for SQS bodies, which have to be text
+def encode_message(pings: Sequence[PingPayload], binary: bool) -> str:
+    if binary:
+        return SQS_PREFIX + base64.b64encode(encode_pings(pings)).decode()
+    if len(pings) == 1:
+        return pings[0].model_dump_json()
+    return json.dumps([ping.model_dump(mode="json") for ping in pings])
+
+
+def decode_message(body: str) -> List[PingPayload]:
+    """Decode a queue message, a binary batch, a JSON ping or a JSON array of them"""
+    if body.startswith(SQS_PREFIX):
+        return decode_pings(base64.b64decode(body[len(SQS_PREFIX) :]))
+
+    data: Any = json.loads(body)
+    if isinstance(data, list):
+        return [PingPayload.model_validate(item) for item in data]
+    return [PingPayload.model_validate(data)]
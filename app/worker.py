@@ -1,18 +1,38 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timezone, timedelta
 import logging
-import json
+import multiprocessing
 
 from types_aiobotocore_dynamodb.client import DynamoDBClient
 from types_aiobotocore_sqs.client import SQSClient
-from typing import List
+from types_aiobotocore_sqs.type_defs import MessageTypeDef
+from typing import List, Tuple
 
+from app.batching import MicroBatcher
+from app.coalescing import WriteCoalescer
 from app.models import PingPayload, PingRecord
 from app.settings import settings
-from app.utils import coords_to_hex
-from app.dynamodb import store_ping_in_dynamodb
+from app.utils import cached_coords_to_hex, coords_to_hexes
+from app.dynamodb import DynamoDBBatchWriter, store_ping_in_dynamodb
+from app.sqs import SQSAcknowledger
+from app.wire import SQS_PREFIX, decode_message, encode_message
 
 logger = logging.getLogger(__name__)
 
+# Doc Ref: https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+
+# Message attribute counting how many times a message's pings have been requeued
+REQUEUE_ATTEMPTS_ATTRIBUTE = "requeue_attempts"
+
+# A PingRecord as plain values, cheap to send back from a worker process
+CompactRecord = Tuple[str, str, datetime, float, float, datetime, datetime]
+
+
+class UnparseableMessage(ValueError):
+    """The message body doesn't hold pings we can decode"""
+
 
 # Make sure the timestamp is inside our bounds
 def is_valid_timestamp(timestamp: datetime) -> tuple[bool, str]:
@@ -53,12 +73,13 @@ def check_ping_dwell(accepted_at: datetime | None) -> None:
 
 
 # Helper to convert the PingPayload to our DDB PingRecord model
-def enrich_ping_record(ping: PingPayload) -> PingRecord:
+def enrich_ping_record(ping: PingPayload, h3_hex: str | None = None) -> PingRecord:
     if ping.accepted_at is None:
         raise ValueError("Accepted at is required")
 
-    # Convert the coordinates to the h3 hex id
-    h3_hex = coords_to_hex(ping.lat, ping.lon)
+    # Convert the coordinates to the h3 hex id, unless it was indexed in bulk
+    if h3_hex is None:
+        h3_hex = cached_coords_to_hex(ping.lat, ping.lon)
 
     return PingRecord(
         h3_hex=h3_hex,
@@ -71,75 +92,362 @@ def enrich_ping_record(ping: PingPayload) -> PingRecord:
     )
 
 
-# The main worker function that moves pings from SQS to DynamoDB
-async def process_ping_from_queue(
+# Helper to delete a handled message, batched when we have an acknowledger
+async def _delete_message(
     sqs_client: SQSClient,
     sqs_queue_url: str,
-    dynamodb_client: DynamoDBClient,
-    dynamodb_table_name: str,
-) -> List[PingRecord]:
-    # Receive messages from the queue
-    response = await sqs_client.receive_message(
-        QueueUrl=sqs_queue_url,
-        MaxNumberOfMessages=settings.max_pings,
-        WaitTimeSeconds=settings.wait_time_seconds,
+    message: MessageTypeDef,
+    sqs_acknowledger: SQSAcknowledger | None,
+) -> None:
+    if sqs_acknowledger is None:
+        await sqs_client.delete_message(
+            QueueUrl=sqs_queue_url,
+            ReceiptHandle=message["ReceiptHandle"],
+        )
+        return
+
+    try:
+        await sqs_acknowledger.ack(message["ReceiptHandle"])
+    except Exception as e:
+        # The write is idempotent, so a redelivery is harmless.
+        logger.error(f"Error deleting message, it will be redelivered: {e}")
+
+
+# Validate one ping, returns False if it should be discarded
+def _check_ping(ping: PingPayload) -> bool:
+    # Check queue health
+    check_ping_dwell(ping.accepted_at)
+
+    # Check timestamp validity
+    is_valid, reason = is_valid_timestamp(ping.timestamp)
+    if not is_valid:
+        logger.warning(
+            f"Invalid timestamp '{ping.timestamp.isoformat()}' found for device '{ping.device_id}'. "
+            f"Reason: {reason}. Discarding ping."
+        )
+        # TODO: Figure if we want to send this to a DLQ rather than ignoring it
+        return False
+
+    return True
+
+
+# Enrich one validated ping, returns None if it should be discarded
+def _enrich_ping(ping: PingPayload, h3_hex: str) -> PingRecord | None:
+    try:
+        # Once we've validated, convert to PingRecord
+        return enrich_ping_record(ping, h3_hex)
+    except Exception as e:
+        # TODO: More DLQ possabilities here also
+        logger.error(f"Error processing ping: {e}")
+        return None
+
+
+def prepare_message(body: str) -> List[PingRecord]:
+    """Decode, validate and enrich a message, the CPU-bound half of handling it"""
+    try:
+        # A message holds one JSON ping, or several as a JSON array or binary batch.
+        pings = decode_message(body)
+    except Exception as e:
+        raise UnparseableMessage(str(e)) from e
+
+    pings = [ping for ping in pings if _check_ping(ping)]
+    # Index the whole message at once, repeated positions are only indexed once.
+    hexes = coords_to_hexes([ping.lat for ping in pings], [ping.lon for ping in pings])
+    records = [_enrich_ping(ping, h3_hex) for ping, h3_hex in zip(pings, hexes)]
+    return [record for record in records if record is not None]
+
+
+def _compact(record: PingRecord) -> CompactRecord:
+    return (
+        record.h3_hex,
+        record.device_id,
+        record.ts,
+        record.lat,
+        record.lon,
+        record.accepted_at,
+        record.processed_at,
     )
 
-    messages = response.get("Messages", [])
-    pings = []
 
-    for message in messages:
+# Rebuild a record that was already validated in a worker process
+def _expand(values: CompactRecord) -> PingRecord:
+    h3_hex, device_id, ts, lat, lon, accepted_at, processed_at = values
+    return PingRecord.model_construct(
+        h3_hex=h3_hex,
+        device_id=device_id,
+        ts=ts,
+        lat=lat,
+        lon=lon,
+        accepted_at=accepted_at,
+        processed_at=processed_at,
+    )
+
+
+def prepare_bodies(bodies: List[str]) -> List[List[CompactRecord] | str]:
+    """
+    Prepare a chunk of message bodies in a worker process.
+
+    Returns compact records per body, or why the body couldn't be parsed, as
+    exceptions from the validation library don't always survive pickling.
+    """
+    results: List[List[CompactRecord] | str] = []
+    for body in bodies:
         try:
-            message_body = message["Body"]
-            ping_data = json.loads(message_body)
-            ping = PingPayload(**ping_data)
-        except Exception as e:
-            # TODO: Implement DLQ for unparsable pings rather than dropping them
-            logger.error(f"Error parsing ping: {e}")
-            await sqs_client.delete_message(
-                QueueUrl=sqs_queue_url,
-                ReceiptHandle=message["ReceiptHandle"],
-            )
-            continue
+            results.append([_compact(record) for record in prepare_message(body)])
+        except UnparseableMessage as e:
+            results.append(str(e))
+    return results
 
-        # Check queue health
-        check_ping_dwell(ping.accepted_at)
 
-        # Check timestamp validity
-        is_valid, reason = is_valid_timestamp(ping.timestamp)
-        if not is_valid:
-            logger.warning(
-                f"Invalid timestamp '{ping.timestamp.isoformat()}' found for device '{ping.device_id}'. "
-                f"Reason: {reason}. Discarding message."
-            )
-            # TODO: Figure if we want to send this to a DLQ rather than ignoring it
-            await sqs_client.delete_message(
-                QueueUrl=sqs_queue_url,
-                ReceiptHandle=message["ReceiptHandle"],
-            )
-            continue
+class EnrichmentPool(MicroBatcher[str, List[PingRecord]]):
+    """
+    Runs `prepare_message` in a pool of worker processes.
+
+    Bodies submitted by concurrent handlers are sent to the pool in chunks of
+    up to `chunk_size`, so one task carries many messages and the event loop
+    only rebuilds the records that come back.
+    """
+
+    def __init__(
+        self,
+        processes: int = settings.worker_enrichment_processes,
+        chunk_size: int = settings.worker_enrichment_chunk_size,
+        max_linger_ms: float = settings.worker_enrichment_linger_ms,
+    ):
+        # Keep every process busy, with the next chunk queued behind the current one.
+        super().__init__(chunk_size, max_linger_ms / 1000, max_in_flight=processes * 2)
+        self._processes = processes
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def start(self) -> None:
+        if self._executor is None:
+            self._executor = self._new_executor()
+        await super().start()
 
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # Spawn, the event loop and AWS client threads aren't safe to fork.
+        return ProcessPoolExecutor(
+            self._processes, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def _send_batch(
+        self, bodies: List[str]
+    ) -> List[List[PingRecord] | BaseException]:
+        loop = asyncio.get_running_loop()
+        executor = self._executor
         try:
-            # Once we've validated, convert to PingRecord
-            happy_ping = enrich_ping_record(ping)
-            await store_ping_in_dynamodb(
-                dynamodb_client, dynamodb_table_name, happy_ping
+            prepared = await loop.run_in_executor(executor, prepare_bodies, bodies)
+        except BrokenProcessPool as e:
+            # A child died, OOM killed say, and took the pool with it. Replace
+            # the pool once for every chunk that was in it, then retry.
+            if self._executor is executor:
+                logger.error(f"Enrichment pool broke, restarting it: {e}")
+                if executor is not None:
+                    executor.shutdown(wait=False)
+                self._executor = self._new_executor()
+            prepared = await loop.run_in_executor(
+                self._executor, prepare_bodies, bodies
             )
+        return [
+            (
+                UnparseableMessage(result)
+                if isinstance(result, str)
+                else [_expand(values) for values in result]
+            )
+            for result in prepared
+        ]
+
 
-            await sqs_client.delete_message(
-                QueueUrl=sqs_queue_url,
-                ReceiptHandle=message["ReceiptHandle"],
+# Store one record, errors propagate so the message can be redelivered
+async def _store_record(
+    record: PingRecord,
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    dynamodb_writer: DynamoDBBatchWriter | None,
+) -> None:
+    if dynamodb_writer is not None:
+        # Returns once the batch holding this ping has been acknowledged.
+        await dynamodb_writer.write(record)
+    else:
+        await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, record)
+
+
+# Helper to turn a record back into the payload it came from, for requeueing
+def _to_payload(record: PingRecord) -> PingPayload:
+    return PingPayload.model_construct(
+        device_id=record.device_id,
+        timestamp=record.ts,
+        lat=record.lat,
+        lon=record.lon,
+        accepted_at=record.accepted_at,
+    )
+
+
+# Handle a single message end to end, returns the records that were stored or coalesced
+async def handle_message(
+    sqs_client: SQSClient,
+    sqs_queue_url: str,
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+    message: MessageTypeDef,
+    dynamodb_writer: DynamoDBBatchWriter | None = None,
+    sqs_acknowledger: SQSAcknowledger | None = None,
+    enrichment_pool: EnrichmentPool | None = None,
+    write_coalescer: WriteCoalescer | None = None,
+) -> List[PingRecord]:
+    try:
+        if enrichment_pool is not None:
+            records = await enrichment_pool.submit(message["Body"])
+        else:
+            records = prepare_message(message["Body"])
+    except UnparseableMessage as e:
+        # TODO: Implement DLQ for unparsable pings rather than dropping them
+        logger.error(f"Error parsing ping: {e}")
+        await _delete_message(sqs_client, sqs_queue_url, message, sqs_acknowledger)
+        return []
+
+    # Pings that add nothing to congestion are handled without a write.
+    coalesced: List[PingRecord] = []
+    if write_coalescer is not None:
+        writes: List[PingRecord] = []
+        for record in records:
+            if write_coalescer.should_write(record):
+                writes.append(record)
+            else:
+                coalesced.append(record)
+        records = writes
+
+    results = await asyncio.gather(
+        *(
+            _store_record(record, dynamodb_client, dynamodb_table_name, dynamodb_writer)
+            for record in records
+        ),
+        return_exceptions=True,
+    )
+    stored = coalesced + [
+        record
+        for record, result in zip(records, results)
+        if not isinstance(result, BaseException)
+    ]
+    failed = [
+        _to_payload(record)
+        for record, result in zip(records, results)
+        if isinstance(result, BaseException)
+    ]
+
+    if failed:
+        if write_coalescer is not None:
+            # The retry has to be written, not coalesced against this attempt.
+            for record, result in zip(records, results):
+                if isinstance(result, BaseException):
+                    write_coalescer.forget(record)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        logger.error(
+            f"Error storing {len(failed)} of {len(records)} pings: {errors[0]}"
+        )
+
+        # Only the failed pings of an envelope go back on the queue, so one bad
+        # ping doesn't make the whole envelope redeliver. A new message starts
+        # the queue's receive count over, so the requeues are counted on top of it.
+        attempts = _requeue_attempts(message) + _receive_count(message)
+        if attempts > settings.worker_max_requeues:
+            # TODO: Send these to a DLQ rather than dropping them
+            logger.error(
+                f"Dropping {len(failed)} pings after {attempts} attempts: "
+                f"{', '.join(ping.device_id for ping in failed)}"
             )
+        elif not stored or not await _requeue(
+            sqs_client, sqs_queue_url, message, failed, attempts
+        ):
+            # Leave the message on the queue, it will be redelivered after the visibility timeout.
+            # Rewriting the pings that did get stored is idempotent.
+            if sqs_acknowledger is not None:
+                sqs_acknowledger.release(message["ReceiptHandle"])
+            return stored
 
-            pings.append(happy_ping)
+    await _delete_message(sqs_client, sqs_queue_url, message, sqs_acknowledger)
+
+    return stored
+
+
+# Helper to send a message's failed pings back to the queue as a new message
+async def _requeue(
+    sqs_client: SQSClient,
+    sqs_queue_url: str,
+    message: MessageTypeDef,
+    pings: List[PingPayload],
+    attempts: int,
+) -> bool:
+    try:
+        # Keep the encoding the producer chose.
+        binary = message["Body"].startswith(SQS_PREFIX)
+        await sqs_client.send_message(
+            QueueUrl=sqs_queue_url,
+            MessageBody=encode_message(pings, binary),
+            MessageAttributes={
+                REQUEUE_ATTEMPTS_ATTRIBUTE: {
+                    "DataType": "Number",
+                    "StringValue": str(attempts),
+                }
+            },
+        )
+    except Exception as e:
+        logger.error(f"Error requeueing failed pings: {e}")
+        return False
 
-        except Exception as e:
-            # TODO: More DLQ possabilities here also
-            logger.error(f"Error processing ping: {e}")
-            await sqs_client.delete_message(
-                QueueUrl=sqs_queue_url,
-                ReceiptHandle=message["ReceiptHandle"],
+    logger.warning(f"Requeued {len(pings)} failed pings, attempt {attempts}")
+    return True
+
+
+# Helper to read how many times a message's pings have been requeued already
+def _requeue_attempts(message: MessageTypeDef) -> int:
+    attribute = message.get("MessageAttributes", {}).get(REQUEUE_ATTEMPTS_ATTRIBUTE)
+    if attribute is None:
+        return 0
+    return int(attribute.get("StringValue", "0"))
+
+
+# Helper to read how many times this message has been received, this time included
+def _receive_count(message: MessageTypeDef) -> int:
+    return int(message.get("Attributes", {}).get("ApproximateReceiveCount", "1"))
+
+
+# Receive one batch from the queue and move it to DynamoDB
+async def process_ping_from_queue(
+    sqs_client: SQSClient,
+    sqs_queue_url: str,
+    dynamodb_client: DynamoDBClient,
+    dynamodb_table_name: str,
+) -> List[PingRecord]:
+    # Receive messages from the queue
+    response = await sqs_client.receive_message(
+        QueueUrl=sqs_queue_url,
+        MaxNumberOfMessages=settings.max_pings,
+        WaitTimeSeconds=settings.wait_time_seconds,
+        MessageSystemAttributeNames=["ApproximateReceiveCount"],
+        MessageAttributeNames=[REQUEUE_ATTEMPTS_ATTRIBUTE],
+    )
+
+    messages = response.get("Messages", [])
+
+    # Handle the messages in the batch concurrently rather than one after another.
+    stored = await asyncio.gather(
+        *(
+            handle_message(
+                sqs_client,
+                sqs_queue_url,
+                dynamodb_client,
+                dynamodb_table_name,
+                message,
             )
-            continue
+            for message in messages
+        )
+    )
 
-    return pings
+    return [ping for records in stored for ping in records]
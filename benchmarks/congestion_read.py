@@ -0,0 +1,124 @@
+"""
+Compare /congestion read latency from raw pings against per-minute aggregates
+as the number of pings in a single hex grows.
+
+Needs the local DynamoDB from docker-compose and the .env.dev settings:
+
+    uv run python -m benchmarks.congestion_read --volumes 1000 10000 50000
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+import random
+import statistics
+import time
+from typing import Awaitable, Callable, List, cast
+
+from pydantic_extra_types.coordinate import Latitude, Longitude
+from types_aiobotocore_dynamodb.client import DynamoDBClient
+
+from app.aggregates import (
+    AggregateWriter,
+    create_aggregate_table_if_not_exists,
+    iter_recent_aggregates,
+)
+from app.aws_clients import AWSClientManager
+from app.congestion import DeviceCongestion
+from app.dynamodb import (
+    DynamoDBBatchWriter,
+    create_table_if_not_exists,
+    iter_recent_pings,
+)
+from app.models import PingRecord
+from app.settings import settings
+
+H3_HEX = "8c2a100d2189bff"
+
+
+def make_pings(count: int, devices: int) -> List[PingRecord]:
+    now = datetime.now(timezone.utc)
+    window = settings.default_congestion_window * 60
+    return [
+        PingRecord(
+            h3_hex=H3_HEX,
+            device_id=f"device-{random.randrange(devices)}",
+            ts=now - timedelta(seconds=random.uniform(0, window)),
+            lat=Latitude(40.743),
+            lon=Longitude(-73.989),
+            accepted_at=now,
+            processed_at=now,
+        )
+        for _ in range(count)
+    ]
+
+
+async def time_reads(read: Callable[[], Awaitable[int]], reads: int) -> str:
+    latencies = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        devices = await read()
+        latencies.append(time.perf_counter() - start)
+
+    p50 = statistics.median(latencies) * 1000
+    p99 = statistics.quantiles(latencies, n=100)[98] * 1000
+    return f"p50 {p50:>7.1f} ms  p99 {p99:>7.1f} ms  ({devices} devices)"
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--volumes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=50)
+    args = parser.parse_args()
+
+    async with AWSClientManager(service_names=["dynamodb"]) as aws_clients:
+        dynamodb_client = cast(DynamoDBClient, aws_clients.clients["dynamodb"])
+
+        for volume in args.volumes:
+            table = f"{settings.dynamodb_table_name}-bench"
+            aggregate_table = f"{settings.dynamodb_aggregate_table_name}-bench"
+            await create_table_if_not_exists(dynamodb_client, table)
+            await create_aggregate_table_if_not_exists(dynamodb_client, aggregate_table)
+
+            pings = make_pings(volume, args.devices)
+            writer = DynamoDBBatchWriter(dynamodb_client, table)
+            aggregate_writer = AggregateWriter(dynamodb_client, aggregate_table)
+            await writer.start()
+            await asyncio.gather(*(writer.write(ping) for ping in pings))
+            await writer.stop()
+            for ping in pings:
+                aggregate_writer.add(ping)
+            await aggregate_writer.flush()
+
+            cutoff = datetime.now(timezone.utc) - timedelta(
+                minutes=settings.default_congestion_window
+            )
+
+            async def read_raw() -> int:
+                congestion = DeviceCongestion()
+                async for page in iter_recent_pings(
+                    dynamodb_client, table, cutoff, h3_hex=H3_HEX
+                ):
+                    congestion.add(page)
+                return congestion.results().get(H3_HEX, 0)
+
+            async def read_aggregates() -> int:
+                congestion = DeviceCongestion()
+                async for aggregates in iter_recent_aggregates(
+                    dynamodb_client, aggregate_table, cutoff, h3_hex=H3_HEX
+                ):
+                    for h3_hex, device_ids in aggregates:
+                        congestion.add_devices(h3_hex, device_ids)
+                return congestion.results().get(H3_HEX, 0)
+
+            print(f"{volume} pings in one hex")
+            print(f"  raw pings   {await time_reads(read_raw, args.reads)}")
+            print(f"  aggregates  {await time_reads(read_aggregates, args.reads)}")
+
+            await dynamodb_client.delete_table(TableName=table)
+            await dynamodb_client.delete_table(TableName=aggregate_table)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Compare preparing queue messages inline on the event loop against the
+EnrichmentPool, reporting throughput and how long the loop was stalled.
+
+Runs in-process, no local services needed:
+
+    uv run python -m benchmarks.enrichment --messages 2000 --processes 4
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Awaitable, Callable, List
+
+from app.wire import encode_message
+from app.worker import EnrichmentPool, prepare_message
+from tests.helpers import get_mock_ping_request
+
+
+def make_bodies(count: int, pings_per_message: int) -> List[str]:
+    bodies = []
+    for i in range(count):
+        pings = [
+            get_mock_ping_request(
+                {"device_id": f"device-{i}-{j}", "lat": 40 + j / 1000}
+            )
+            for j in range(pings_per_message)
+        ]
+        for ping in pings:
+            ping.accepted_at = ping.timestamp
+        bodies.append(encode_message(pings, binary=False))
+    return bodies
+
+
+# Helper to measure the worst gap between ticks of a task that wants to run every 1 ms
+async def _watch_loop(lags: List[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def run(
+    label: str,
+    prepare: Callable[[str], Awaitable[object]],
+    bodies: List[str],
+    pings: int,
+) -> None:
+    lags: List[float] = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(_watch_loop(lags, stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(prepare(body) for body in bodies))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await watcher
+    print(
+        f"{label:<8} {pings / elapsed:>9.0f} pings/s   "
+        f"max loop stall {max(lags, default=0) * 1000:>7.1f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--pings-per-message", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=50)
+    args = parser.parse_args()
+
+    bodies = make_bodies(args.messages, args.pings_per_message)
+    pings = args.messages * args.pings_per_message
+
+    async def inline(body: str) -> object:
+        # Handlers prepare their message and then yield, like the worker does.
+        records = prepare_message(body)
+        await asyncio.sleep(0)
+        return records
+
+    pool = EnrichmentPool(args.processes, chunk_size=args.chunk_size)
+    await pool.start()
+    # Warm the pool up, so process start-up isn't counted.
+    await pool.submit(bodies[0])
+
+    print(f"Preparing {args.messages} messages of {args.pings_per_message} pings")
+    await run("inline", inline, bodies, pings)
+    await run("pool", pool.submit, bodies, pings)
+
+    await pool.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
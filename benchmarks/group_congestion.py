@@ -0,0 +1,89 @@
+"""
+Compare group congestion from PingRecords (one `h3.cell_to_parent` per ping)
+against the columnar numpy path, at a given number of pings.
+
+Runs in-process, no local services needed:
+
+    uv run python -m benchmarks.group_congestion --pings 1000000 --resolution 7
+"""
+
+import argparse
+from datetime import datetime, timezone
+import random
+import time
+from typing import Any, Callable, List
+
+import h3  # type: ignore
+import numpy as np
+
+from app.columnar import group_congestion
+from app.congestion import calculate_group_congestion
+from app.models import PingRecord
+
+# Roughly Manhattan at resolution 6
+AREA_HEX = "862a1072fffffff"
+
+
+def make_pings(count: int, devices: int) -> List[PingRecord]:
+    now = datetime.now(timezone.utc)
+    cells = list(h3.cell_to_children(AREA_HEX, 10))
+    # Skip validation, building a million models is slower than what we measure.
+    return [
+        PingRecord.model_construct(
+            h3_hex=h3.cell_to_center_child(random.choice(cells), 12),
+            device_id=f"device-{random.randrange(devices)}",
+            ts=now,
+            lat=40.743,
+            lon=-73.989,
+            accepted_at=now,
+            processed_at=now,
+        )
+        for _ in range(count)
+    ]
+
+
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pings", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=50_000)
+    parser.add_argument("--resolution", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pings = make_pings(args.pings, args.devices)
+
+    # The columnar path expects pings already decoded into columns.
+    codes: dict[str, int] = {}
+    cells = np.fromiter((int(p.h3_hex, 16) for p in pings), np.uint64, len(pings))
+    devices = np.fromiter(
+        (codes.setdefault(p.device_id, len(codes)) for p in pings),
+        np.int64,
+        len(pings),
+    )
+
+    rows = best_of(
+        lambda: calculate_group_congestion(pings, args.resolution), args.repeat
+    )
+    columns = best_of(
+        lambda: group_congestion(cells, devices, args.resolution), args.repeat
+    )
+    assert calculate_group_congestion(pings, args.resolution) == group_congestion(
+        cells, devices, args.resolution
+    )
+
+    print(f"{args.pings} pings to resolution {args.resolution}")
+    print(f"  rows     {rows * 1000:8.1f} ms")
+    print(f"  columns  {columns * 1000:8.1f} ms  ({rows / columns:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compare indexing pings with one `latlng_to_cell` each against the cached and
+batched paths in app.utils, for a mix of parked and moving devices.
+
+Runs in-process, no local services needed:
+
+    uv run python -m benchmarks.h3_indexing --pings 100000 --parked 0.6
+"""
+
+import argparse
+import random
+import time
+from typing import Callable, List, Tuple
+
+from app import utils
+from app.settings import settings
+
+
+def make_coordinates(
+    count: int, devices: int, parked: float
+) -> Tuple[List[float], List[float]]:
+    random.seed(0)
+    # Every device starts somewhere in a few square km of Manhattan.
+    positions = [
+        (40.70 + random.random() * 0.05, -74.02 + random.random() * 0.05)
+        for _ in range(devices)
+    ]
+    is_parked = [random.random() < parked for _ in range(devices)]
+
+    lats, lons = [], []
+    for i in range(count):
+        device = i % devices
+        lat, lon = positions[device]
+        if is_parked[device]:
+            # GPS noise of a few centimetres around a fixed spot.
+            lat += random.gauss(0, 2e-7)
+            lon += random.gauss(0, 2e-7)
+        else:
+            # Moving at up to ~10 m between pings.
+            lat += random.uniform(-1e-4, 1e-4)
+            lon += random.uniform(-1e-4, 1e-4)
+            positions[device] = (lat, lon)
+        lats.append(lat)
+        lons.append(lon)
+    return lats, lons
+
+
+# Best of a few runs, each starting from an empty cache
+def timed(run: Callable[[], List[str]], repeat: int = 3) -> Tuple[List[str], float]:
+    best = float("inf")
+    for _ in range(repeat):
+        utils._quantized_cell.cache_clear()
+        start = time.perf_counter()
+        cells = run()
+        best = min(best, time.perf_counter() - start)
+    return cells, best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pings", type=int, default=100_000)
+    parser.add_argument("--devices", type=int, default=1_000)
+    parser.add_argument("--parked", type=float, default=0.6)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    settings.h3_cache_enabled = True
+    lats, lons = make_coordinates(args.pings, args.devices, args.parked)
+    pairs = list(zip(lats, lons))
+
+    exact, exact_seconds = timed(
+        lambda: [utils.coords_to_hex(lat, lon) for lat, lon in pairs]
+    )
+
+    _, cached_seconds = timed(
+        lambda: [utils.cached_coords_to_hex(lat, lon) for lat, lon in pairs]
+    )
+    info = utils.h3_cache_info()
+
+    # Batches the size of a packed queue message.
+    batched, batched_seconds = timed(
+        lambda: [
+            cell
+            for start in range(0, args.pings, args.batch_size)
+            for cell in utils.coords_to_hexes(
+                lats[start : start + args.batch_size],
+                lons[start : start + args.batch_size],
+            )
+        ]
+    )
+
+    moved = sum(a != b for a, b in zip(exact, batched))
+    print(
+        f"Indexing {args.pings} pings from {args.devices} devices, "
+        f"{args.parked:.0%} parked"
+    )
+    for label, seconds in (
+        ("latlng_to_cell", exact_seconds),
+        ("cached", cached_seconds),
+        (f"batched x{args.batch_size}", batched_seconds),
+    ):
+        print(
+            f"  {label:<15} {args.pings / seconds:>10.0f} pings/s  "
+            f"({exact_seconds / seconds:.1f}x)"
+        )
+    print(f"  cache hit rate  {info['hit_rate']:.1%} ({info['entries']} entries)")
+    print(f"  cells moved by quantizing  {moved / args.pings:.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compare the cost of decoding DynamoDB items into validated PingRecords against
+the projected DevicePing tuples `/congestion` reads.
+
+Runs in-process, no local services needed:
+
+    uv run python -m benchmarks.ping_decode --items 10000
+"""
+
+import argparse
+import timeit
+from typing import Any, Dict, List
+
+from app.dynamodb import (
+    _ddb_item_to_ping_record,
+    _ping_record_to_ddb_item,
+)
+from app.models import DevicePing
+from tests.helpers import make_ping_record
+
+
+def make_items(count: int) -> List[Dict[str, Any]]:
+    return [
+        _ping_record_to_ddb_item(make_ping_record({"device_id": f"device-{i}"}))
+        for i in range(count)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    # What ProjectionExpression="h3_hex, device_id" returns for the same items.
+    projected = [
+        {"h3_hex": item["h3_hex"], "device_id": item["device_id"]} for item in items
+    ]
+
+    def decode_records() -> None:
+        [_ddb_item_to_ping_record(item) for item in items]
+
+    def decode_devices() -> None:
+        [
+            DevicePing(item["h3_hex"]["S"], item["device_id"]["S"])
+            for item in projected
+        ]
+
+    records = min(timeit.repeat(decode_records, number=1, repeat=args.repeat))
+    devices = min(timeit.repeat(decode_devices, number=1, repeat=args.repeat))
+
+    print(f"Decoding {args.items} items")
+    print(f"  PingRecord  {records * 1000:8.2f} ms")
+    print(f"  DevicePing  {devices * 1000:8.2f} ms  ({records / devices:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
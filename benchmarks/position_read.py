@@ -0,0 +1,161 @@
+"""
+Compare /congestion reads of one hex from raw pings against the latest
+position model, reporting read units and latency. Every device pings once per
+`--interval` seconds for the whole window.
+
+Needs the local DynamoDB from docker-compose and the .env.dev settings:
+
+    uv run python -m benchmarks.position_read --devices 50 200 --interval 5
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, cast
+
+from pydantic_extra_types.coordinate import Latitude, Longitude
+from types_aiobotocore_dynamodb.client import DynamoDBClient
+
+from app.aws_clients import AWSClientManager
+from app.congestion import DeviceCongestion
+from app.dynamodb import (
+    DynamoDBBatchWriter,
+    create_table_if_not_exists,
+    iter_recent_devices,
+)
+from app.models import PingRecord
+from app.positions import (
+    PositionWriter,
+    create_position_table_if_not_exists,
+    iter_recent_positions,
+)
+from app.settings import settings
+
+H3_HEX = "8c2a100d2189bff"
+
+
+def make_pings(devices: int, interval: int) -> List[PingRecord]:
+    now = datetime.now(timezone.utc)
+    window = settings.default_congestion_window * 60
+    return [
+        PingRecord(
+            h3_hex=H3_HEX,
+            device_id=f"device-{device}",
+            # Stagger the devices so they don't all ping on the same second.
+            ts=now - timedelta(seconds=age + device % interval),
+            lat=Latitude(40.743),
+            lon=Longitude(-73.989),
+            accepted_at=now,
+            processed_at=now,
+        )
+        for device in range(devices)
+        for age in range(0, window - interval, interval)
+    ]
+
+
+class CapacityMeter:
+    """Asks every query for its consumed capacity and adds it up."""
+
+    def __init__(self, dynamodb_client: DynamoDBClient):
+        self.units = 0.0
+        query = dynamodb_client.query
+
+        async def _query(**kwargs: Any) -> Dict[str, Any]:
+            response = cast(
+                Dict[str, Any], await query(ReturnConsumedCapacity="TOTAL", **kwargs)
+            )
+            self.units += response.get("ConsumedCapacity", {}).get("CapacityUnits", 0)
+            return response
+
+        self.query = _query
+
+
+async def time_reads(
+    read: Callable[[CapacityMeter], Awaitable[int]],
+    dynamodb_client: DynamoDBClient,
+    reads: int,
+) -> Tuple[str, float]:
+    meter = CapacityMeter(dynamodb_client)
+    latencies = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        devices = await read(meter)
+        latencies.append(time.perf_counter() - start)
+
+    p50 = statistics.median(latencies) * 1000
+    p99 = statistics.quantiles(latencies, n=100)[98] * 1000
+    units = meter.units / reads
+    return (
+        f"{units:>8.1f} RCU/read  p50 {p50:>7.1f} ms  p99 {p99:>7.1f} ms  "
+        f"({devices} devices)",
+        units,
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--interval", type=int, default=5)
+    parser.add_argument("--reads", type=int, default=20)
+    args = parser.parse_args()
+
+    async with AWSClientManager(service_names=["dynamodb"]) as aws_clients:
+        dynamodb_client = cast(DynamoDBClient, aws_clients.clients["dynamodb"])
+
+        for devices in args.devices:
+            table = f"{settings.dynamodb_table_name}-bench"
+            position_table = f"{settings.dynamodb_position_table_name}-bench"
+            await create_table_if_not_exists(dynamodb_client, table)
+            await create_position_table_if_not_exists(dynamodb_client, position_table)
+
+            pings = make_pings(devices, args.interval)
+            writer = DynamoDBBatchWriter(dynamodb_client, table)
+            position_writer = PositionWriter(dynamodb_client, position_table)
+            await writer.start()
+            await asyncio.gather(*(writer.write(ping) for ping in pings))
+            await writer.stop()
+            for ping in pings:
+                position_writer.add(ping)
+            await position_writer.flush()
+
+            cutoff = datetime.now(timezone.utc) - timedelta(
+                minutes=settings.default_congestion_window
+            )
+
+            async def read_raw(meter: CapacityMeter) -> int:
+                congestion = DeviceCongestion()
+                async for page in iter_recent_devices(
+                    cast(DynamoDBClient, meter), table, cutoff, h3_hex=H3_HEX
+                ):
+                    congestion.add(page)
+                return congestion.results().get(H3_HEX, 0)
+
+            async def read_positions(meter: CapacityMeter) -> int:
+                congestion = DeviceCongestion()
+                async for page in iter_recent_positions(
+                    cast(DynamoDBClient, meter), position_table, cutoff, h3_hex=H3_HEX
+                ):
+                    congestion.add(page)
+                return congestion.results().get(H3_HEX, 0)
+
+            raw, raw_units = await time_reads(read_raw, dynamodb_client, args.reads)
+            positions, position_units = await time_reads(
+                read_positions, dynamodb_client, args.reads
+            )
+            print(
+                f"{devices} devices pinging every {args.interval} s, "
+                f"{len(pings)} pings in one hex"
+            )
+            print(f"  raw pings  {raw}")
+            print(f"  positions  {positions}")
+            if position_units:
+                print(f"  {raw_units / position_units:.0f}x fewer read units")
+
+            await dynamodb_client.delete_table(TableName=table)
+            await dynamodb_client.delete_table(TableName=position_table)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Time writing a congestion snapshot and looking hexes up in it the way every API
+worker does: check the file for a swap, then binary search the mapped cells.
+
+Runs in-process against a temporary file, no local services needed:
+
+    uv run python -m benchmarks.snapshot_read --hexes 10000 300000
+"""
+
+import argparse
+from datetime import datetime, timezone
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+import h3  # type: ignore
+
+from app.snapshot import SnapshotReader, write_snapshot
+
+
+def make_counts(hexes: int) -> Dict[str, int]:
+    random.seed(0)
+    area = h3.latlng_to_cell(40.743, -73.989, 5)
+    cells = random.sample(list(h3.cell_to_children(area, 12)), hexes)
+    return {cell: random.randint(1, 50) for cell in cells}
+
+
+def time_lookups(reader: SnapshotReader, cells: List[str]) -> str:
+    latencies = []
+    for cell in cells:
+        start = time.perf_counter()
+        snapshot = reader.current()
+        assert snapshot is not None
+        snapshot.get(cell)
+        latencies.append(time.perf_counter() - start)
+
+    p50 = statistics.median(latencies) * 1e6
+    p99 = statistics.quantiles(latencies, n=100)[98] * 1e6
+    return f"p50 {p50:>6.1f} us  p99 {p99:>6.1f} us"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hexes", type=int, nargs="+", default=[10000, 300000])
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "congestion.snapshot")
+        for hexes in args.hexes:
+            counts = make_counts(hexes)
+            start = time.perf_counter()
+            write_snapshot(path, counts, datetime.now(timezone.utc))
+            write = time.perf_counter() - start
+
+            reader = SnapshotReader(path)
+            start = time.perf_counter()
+            reader.current()
+            mapped = time.perf_counter() - start
+
+            cells = list(counts)
+            hits = random.choices(cells, k=args.lookups)
+            print(
+                f"{hexes} hexes, {os.path.getsize(path) / 1024:.0f} KB, "
+                f"written in {write * 1000:.1f} ms, mapped in {mapped * 1e6:.0f} us"
+            )
+            print(f"  lookup     {time_lookups(reader, hits)}")
+
+            # A global request decodes every cell back into a hex string.
+            snapshot = reader.current()
+            assert snapshot is not None
+            start = time.perf_counter()
+            everything = list(snapshot.items())
+            print(
+                f"  everything {(time.perf_counter() - start) * 1000:>6.1f} ms "
+                f"({len(everything)} hexes)"
+            )
+
+
+if __name__ == "__main__":
+    main()
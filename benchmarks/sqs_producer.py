@@ -0,0 +1,100 @@
+"""
+Compare per-ping SendMessage against the batching SQSBatchProducer and the
+envelope packing SQSEnvelopeProducer.
+
+Needs the local ElasticMQ from docker-compose and the .env.dev settings:
+
+    uv run python -m benchmarks.sqs_producer --pings 5000 --concurrency 500
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import statistics
+import time
+from typing import Awaitable, Callable, List, Set, cast
+
+from pydantic_extra_types.coordinate import Latitude, Longitude
+from types_aiobotocore_sqs.client import SQSClient
+
+from app.aws_clients import AWSClientManager
+from app.models import PingPayload
+from app.sqs import (
+    SQSBatchProducer,
+    SQSEnvelopeProducer,
+    get_or_create_queue,
+    send_ping_to_queue,
+)
+from app.settings import settings
+
+
+def make_ping(i: int) -> PingPayload:
+    return PingPayload(
+        device_id=f"bench-{i}",
+        timestamp=datetime.now(timezone.utc),
+        lat=Latitude(40.743),
+        lon=Longitude(-73.989),
+        accepted_at=datetime.now(timezone.utc),
+    )
+
+
+async def run(
+    name: str,
+    send: Callable[[PingPayload], Awaitable[str]],
+    pings: int,
+    concurrency: int,
+) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    message_ids: Set[str] = set()
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            message_ids.add(await send(make_ping(i)))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(pings)))
+    elapsed = time.perf_counter() - start
+
+    p50 = statistics.median(latencies) * 1000
+    p99 = statistics.quantiles(latencies, n=100)[98] * 1000
+    print(
+        f"{name:<12} {pings / elapsed:>10.0f} pings/s   "
+        f"p50 {p50:>7.1f} ms   p99 {p99:>7.1f} ms   "
+        f"{len(message_ids):>6} messages"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pings", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    args = parser.parse_args()
+
+    async with AWSClientManager(service_names=["sqs"]) as aws_clients:
+        sqs_client = cast(SQSClient, aws_clients.clients["sqs"])
+        queue_url = await get_or_create_queue(
+            sqs_client, f"{settings.sqs_queue_name}-bench"
+        )
+
+        async def single(ping: PingPayload) -> str:
+            return await send_ping_to_queue(sqs_client, queue_url, ping)
+
+        producer = SQSBatchProducer(sqs_client, queue_url)
+        envelopes = SQSEnvelopeProducer(sqs_client, queue_url)
+        await producer.start()
+        await envelopes.start()
+
+        await run("send_message", single, args.pings, args.concurrency)
+        await run("batched", producer.send, args.pings, args.concurrency)
+        await run("envelopes", envelopes.send, args.pings, args.concurrency)
+
+        await producer.stop()
+        await envelopes.stop()
+        await sqs_client.delete_queue(QueueUrl=queue_url)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
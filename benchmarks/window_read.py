@@ -0,0 +1,102 @@
+"""
+Time /congestion reads answered from the in-memory SlidingWindow, for one hex,
+an area and the whole window. The DynamoDB reads these replace take
+milliseconds, so the numbers here are in microseconds.
+
+Runs in-process, no local services needed:
+
+    uv run python -m benchmarks.window_read --devices 10000 --interval 5
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import statistics
+import time
+from typing import Callable, List
+
+import h3  # type: ignore
+
+from app.congestion import DeviceCongestion, GroupCongestion
+from app.models import DeviceSighting
+from app.settings import settings
+from app.window import SlidingWindow
+
+
+def make_sightings(devices: int, interval: int) -> List[DeviceSighting]:
+    now = datetime.now(timezone.utc)
+    area = h3.latlng_to_cell(40.743, -73.989, 8)
+    cells = list(h3.cell_to_children(area, settings.default_h3_resolution))
+    window = settings.default_congestion_window * 60
+    return [
+        DeviceSighting(
+            cells[device % len(cells)],
+            f"device-{device}",
+            now - timedelta(seconds=age + device % interval),
+        )
+        for device in range(devices)
+        for age in range(0, window - interval, interval)
+    ]
+
+
+def time_reads(read: Callable[[], int], reads: int) -> str:
+    latencies = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        devices = read()
+        latencies.append(time.perf_counter() - start)
+
+    p50 = statistics.median(latencies) * 1e6
+    p99 = statistics.quantiles(latencies, n=100)[98] * 1e6
+    return f"p50 {p50:>9.1f} us  p99 {p99:>9.1f} us  ({devices} devices)"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--interval", type=int, default=5)
+    parser.add_argument("--reads", type=int, default=50)
+    args = parser.parse_args()
+
+    sightings = make_sightings(args.devices, args.interval)
+    window = SlidingWindow()
+    start = time.perf_counter()
+    window.add(sightings)
+    hydrate = time.perf_counter() - start
+
+    cutoff = datetime.now(timezone.utc) - timedelta(
+        minutes=settings.default_congestion_window
+    )
+    h3_hex = sightings[0].h3_hex
+    area_hex = h3.cell_to_parent(h3_hex, 10)
+
+    def read_hex() -> int:
+        congestion = DeviceCongestion()
+        window.collect(congestion, cutoff, h3_hex=h3_hex)
+        return congestion.results().get(h3_hex, 0)
+
+    def read_area() -> int:
+        congestion = GroupCongestion(10)
+        window.collect(
+            congestion,
+            cutoff,
+            contains=lambda cell: h3.cell_to_parent(cell, 10) == area_hex,
+        )
+        return sum(group["device_count"] for group in congestion.results().values())
+
+    def read_all() -> int:
+        congestion = DeviceCongestion()
+        window.collect(congestion, cutoff)
+        return sum(congestion.results().values())
+
+    print(
+        f"{args.devices} devices pinging every {args.interval} s, "
+        f"{len(sightings)} pings, {window.entries()} entries, "
+        f"added in {hydrate:.2f} s"
+    )
+    print(f"  one hex    {time_reads(read_hex, args.reads)}")
+    print(f"  area       {time_reads(read_area, args.reads)}")
+    print(f"  everything {time_reads(read_all, args.reads)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare CPU per ping for parsing JSON against the binary wire format, for
+single pings, bulk uploads and queue messages.
+
+Runs in-process, no local services needed:
+
+    uv run python -m benchmarks.wire_format --pings 1000
+"""
+
+import argparse
+import json
+import timeit
+from typing import Callable, List
+
+from app.ingest import parse_ping, validate_ping
+from app.models import PingPayload
+from app.wire import CONTENT_TYPE, decode_message, encode_message, encode_pings
+from tests.helpers import get_mock_ping_request
+
+
+def per_ping_us(fn: Callable[[], object], pings: int, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) / pings * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pings", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pings: List[PingPayload] = [
+        get_mock_ping_request({"device_id": f"device-{i:08d}"})
+        for i in range(args.pings)
+    ]
+    json_bodies = [ping.model_dump_json().encode() for ping in pings]
+    binary_bodies = [encode_pings([ping]) for ping in pings]
+    json_array = json.dumps([ping.model_dump(mode="json") for ping in pings])
+    binary_batch = encode_pings(pings)
+    json_message = encode_message(pings, binary=False)
+    binary_message = encode_message(pings, binary=True)
+
+    def single_json() -> None:
+        for body in json_bodies:
+            parse_ping("application/json", body)
+
+    def single_binary() -> None:
+        for body in binary_bodies:
+            parse_ping(CONTENT_TYPE, body)
+
+    def bulk_json() -> None:
+        # What POST /pings does with a JSON array.
+        for item in json.loads(json_array):
+            validate_ping(item, pings[0].timestamp)
+
+    def bulk_binary() -> None:
+        decode_message(binary_message)
+
+    results = {
+        "single, JSON": per_ping_us(single_json, args.pings, args.repeat),
+        "single, binary": per_ping_us(single_binary, args.pings, args.repeat),
+        "bulk, JSON": per_ping_us(bulk_json, args.pings, args.repeat),
+        "bulk, binary": per_ping_us(bulk_binary, args.pings, args.repeat),
+        "queue message, JSON": per_ping_us(
+            lambda: decode_message(json_message), args.pings, args.repeat
+        ),
+        "queue message, binary": per_ping_us(
+            lambda: decode_message(binary_message), args.pings, args.repeat
+        ),
+    }
+
+    print(f"CPU per ping over {args.pings} pings")
+    for name, micros in results.items():
+        print(f"  {name:24} {micros:6.2f} us")
+    print(
+        f"Sizes: JSON array {len(json_array)} B, binary {len(binary_batch)} B, "
+        f"base64 message {len(binary_message)} B"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Replay a fleet of parked and moving devices through the WriteCoalescer and
+report how many writes it saves, and how far congestion from the written pings
+drifts from congestion over every ping.
+
+Runs in-process, no local services needed:
+
+    uv run python -m benchmarks.write_coalescing --devices 2000 --refresh 60
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import random
+from typing import Dict, List
+
+from pydantic_extra_types.coordinate import Latitude, Longitude
+
+from app.coalescing import WriteCoalescer
+from app.congestion import DeviceCongestion
+from app.models import DevicePing, PingRecord
+from app.settings import settings
+from app.utils import coords_to_hex
+
+
+def make_pings(
+    devices: int, parked: float, interval: int, minutes: int
+) -> List[PingRecord]:
+    random.seed(0)
+    start = datetime.now(timezone.utc) - timedelta(minutes=minutes)
+    pings = []
+    for device in range(devices):
+        lat = 40.70 + random.random() * 0.05
+        lon = -74.02 + random.random() * 0.05
+        is_parked = random.random() < parked
+        for age in range(0, minutes * 60, interval):
+            if not is_parked:
+                # Roughly 10 m/s, a few resolution 12 cells a minute.
+                lat += random.uniform(-1e-4, 1e-4) * interval
+                lon += random.uniform(-1e-4, 1e-4) * interval
+            ts = start + timedelta(seconds=age + device % interval)
+            pings.append(
+                PingRecord(
+                    h3_hex=coords_to_hex(lat, lon),
+                    device_id=f"device-{device}",
+                    ts=ts,
+                    lat=Latitude(lat),
+                    lon=Longitude(lon),
+                    accepted_at=ts,
+                    processed_at=ts,
+                )
+            )
+    # Arrive in time order, like the queue delivers them.
+    pings.sort(key=lambda ping: ping.ts)
+    return pings
+
+
+def congestion(pings: List[PingRecord], cutoff: datetime) -> Dict[str, int]:
+    counts = DeviceCongestion()
+    counts.add(
+        [DevicePing(ping.h3_hex, ping.device_id) for ping in pings if ping.ts >= cutoff]
+    )
+    return counts.results()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--parked", type=float, default=0.7)
+    parser.add_argument("--interval", type=int, default=5)
+    parser.add_argument("--refresh", type=float, default=60)
+    parser.add_argument("--minutes", type=int, default=40)
+    args = parser.parse_args()
+
+    pings = make_pings(args.devices, args.parked, args.interval, args.minutes)
+    coalescer = WriteCoalescer(args.refresh, max_devices=args.devices)
+    written = [ping for ping in pings if coalescer.should_write(ping)]
+
+    cutoff = pings[-1].ts - timedelta(minutes=settings.default_congestion_window)
+    exact = congestion(pings, cutoff)
+    coalesced = congestion(written, cutoff)
+    hexes = set(exact) | set(coalesced)
+    off = sum(exact.get(h) != coalesced.get(h) for h in hexes)
+    missing = sum(exact.get(h, 0) - coalesced.get(h, 0) for h in hexes)
+
+    stats = coalescer.stats
+    print(
+        f"{args.devices} devices, {args.parked:.0%} parked, pinging every "
+        f"{args.interval} s, refresh {args.refresh:.0f} s"
+    )
+    print(
+        f"  writes     {len(written)} of {len(pings)} "
+        f"({stats.suppressed_ratio:.1%} suppressed)"
+    )
+    print(
+        f"  congestion {off} of {len(hexes)} hexes differ, "
+        f"{missing} device counts missing of {sum(exact.values())}"
+    )
+
+
+if __name__ == "__main__":
+    main()
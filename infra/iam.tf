@@ -16,6 +16,7 @@ data "aws_iam_policy_document" "ecs_task_policy" {
       "sqs:SendMessage",
       "sqs:ReceiveMessage",
       "sqs:DeleteMessage",
+      "sqs:ChangeMessageVisibility",
       "sqs:CreateQueue",
     ]
     resources = [aws_sqs_queue.ping_queue.arn]
@@ -25,13 +26,24 @@ data "aws_iam_policy_document" "ecs_task_policy" {
     effect = "Allow"
     actions = [
       "dynamodb:PutItem",
+      "dynamodb:BatchWriteItem",
+      "dynamodb:UpdateItem",
+      "dynamodb:DeleteItem",
       "dynamodb:GetItem",
       "dynamodb:Query",
       "dynamodb:Scan",
       "dynamodb:DescribeTable",
-      "dynamodb:CreateTable"
+      "dynamodb:CreateTable",
+      "dynamodb:UpdateTimeToLive"
     ]
-    resources = [aws_dynamodb_table.congestion_table.arn]
+    resources = concat(
+      [
+        aws_dynamodb_table.congestion_table.arn,
+        "${aws_dynamodb_table.congestion_table.arn}/index/*",
+      ],
+      aws_dynamodb_table.aggregate_table[*].arn,
+      aws_dynamodb_table.position_table[*].arn,
+    )
   }
 }
 
@@ -3,5 +3,17 @@ locals {
   name   = "congestion"
 
   vpc_cidr = "10.0.0.0/16"
+
+  # Adds the ts-bucket-index GSI so global congestion doesn't need a table scan
+  time_index_enabled = false
+
+  # Adds the written-bucket-index GSI the in-memory congestion window tails for new pings
+  write_index_enabled = false
+
+  # Worker maintained per-hex, per-minute device sets that /congestion reads instead of raw pings
+  aggregates_enabled = false
+
+  # Worker maintained latest hex per device that /congestion reads instead of raw pings
+  positions_enabled = false
   azs      = slice(data.aws_availability_zones.available.names, 0, 3)
 }
\ No newline at end of file
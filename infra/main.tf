@@ -19,6 +19,19 @@ resource "aws_sqs_queue" "ping_queue" {
 
   visibility_timeout_seconds = 60
   message_retention_seconds  = 86400
+
+  # The worker drops pings after WORKER_MAX_REQUEUES attempts. Anything still
+  # redelivered past that, like a message that crashes the worker, is moved aside.
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.ping_dlq.arn
+    maxReceiveCount     = 10
+  })
+}
+
+resource "aws_sqs_queue" "ping_dlq" {
+  name = "${local.name}-ping-dlq"
+
+  message_retention_seconds = 1209600 # 14 days, the most SQS keeps
 }
 
 
@@ -37,6 +50,98 @@ resource "aws_dynamodb_table" "congestion_table" {
     name = "ts"
     type = "S"
   }
+
+  dynamic "attribute" {
+    for_each = concat(
+      local.time_index_enabled ? ["ts_bucket"] : [],
+      local.write_index_enabled ? ["written_bucket", "written_at"] : [],
+    )
+    content {
+      name = attribute.value
+      type = "S"
+    }
+  }
+
+  dynamic "global_secondary_index" {
+    for_each = local.time_index_enabled ? ["ts-bucket-index"] : []
+    content {
+      name            = global_secondary_index.value
+      hash_key        = "ts_bucket"
+      range_key       = "ts"
+      projection_type = "ALL"
+    }
+  }
+
+  dynamic "global_secondary_index" {
+    for_each = local.write_index_enabled ? ["written-bucket-index"] : []
+    content {
+      name               = global_secondary_index.value
+      hash_key           = "written_bucket"
+      range_key          = "written_at"
+      projection_type    = "INCLUDE"
+      non_key_attributes = ["device_id"]
+    }
+  }
+}
+
+resource "aws_dynamodb_table" "aggregate_table" {
+  count = local.aggregates_enabled ? 1 : 0
+
+  name         = "${local.name}-congestion-aggregates"
+  billing_mode = "PAY_PER_REQUEST"
+
+  hash_key  = "h3_hex"
+  range_key = "ts_minute"
+
+  attribute {
+    name = "h3_hex"
+    type = "S"
+  }
+  attribute {
+    name = "ts_minute"
+    type = "S"
+  }
+  attribute {
+    name = "minute_shard"
+    type = "S"
+  }
+
+  # Lets global congestion query the window's minutes instead of scanning the table
+  global_secondary_index {
+    name               = "minute-index"
+    hash_key           = "minute_shard"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["device_ids"]
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+resource "aws_dynamodb_table" "position_table" {
+  count = local.positions_enabled ? 1 : 0
+
+  name         = "${local.name}-congestion-positions"
+  billing_mode = "PAY_PER_REQUEST"
+
+  hash_key  = "h3_hex"
+  range_key = "device_id"
+
+  attribute {
+    name = "h3_hex"
+    type = "S"
+  }
+  attribute {
+    name = "device_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
 }
 
 
@@ -168,6 +273,34 @@ module "ecs" {
             {
               name  = "DYNAMODB_TABLE_NAME"
               value = aws_dynamodb_table.congestion_table.name
+            },
+            {
+              name  = "DYNAMODB_TIME_INDEX_ENABLED"
+              value = tostring(local.time_index_enabled)
+            },
+            {
+              name  = "DYNAMODB_WRITE_INDEX_ENABLED"
+              value = tostring(local.write_index_enabled)
+            },
+            {
+              name  = "AGGREGATES_ENABLED"
+              value = tostring(local.aggregates_enabled)
+            },
+            {
+              name  = "DYNAMODB_AGGREGATE_TABLE_NAME"
+              value = "${local.name}-congestion-aggregates"
+            },
+            {
+              name  = "AGGREGATE_MINUTE_INDEX_ENABLED"
+              value = tostring(local.aggregates_enabled)
+            },
+            {
+              name  = "POSITIONS_ENABLED"
+              value = tostring(local.positions_enabled)
+            },
+            {
+              name  = "DYNAMODB_POSITION_TABLE_NAME"
+              value = "${local.name}-congestion-positions"
             }
           ]
 
@@ -221,6 +354,34 @@ module "ecs" {
             {
               name  = "DYNAMODB_TABLE_NAME"
               value = aws_dynamodb_table.congestion_table.name
+            },
+            {
+              name  = "DYNAMODB_TIME_INDEX_ENABLED"
+              value = tostring(local.time_index_enabled)
+            },
+            {
+              name  = "DYNAMODB_WRITE_INDEX_ENABLED"
+              value = tostring(local.write_index_enabled)
+            },
+            {
+              name  = "AGGREGATES_ENABLED"
+              value = tostring(local.aggregates_enabled)
+            },
+            {
+              name  = "DYNAMODB_AGGREGATE_TABLE_NAME"
+              value = "${local.name}-congestion-aggregates"
+            },
+            {
+              name  = "AGGREGATE_MINUTE_INDEX_ENABLED"
+              value = tostring(local.aggregates_enabled)
+            },
+            {
+              name  = "POSITIONS_ENABLED"
+              value = tostring(local.positions_enabled)
+            },
+            {
+              name  = "DYNAMODB_POSITION_TABLE_NAME"
+              value = "${local.name}-congestion-positions"
             }
           ]
 
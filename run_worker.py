@@ -1,22 +1,31 @@
+import argparse
 import asyncio
+import json
 import logging
-from typing import cast
+import os
+import signal
+from typing import List, cast
 
 from botocore.exceptions import ClientError
 from types_aiobotocore_dynamodb.client import DynamoDBClient
 from types_aiobotocore_sqs.client import SQSClient
 
+from app.aggregates import create_aggregate_table_if_not_exists
 from app.aws_clients import AWSClientManager, retry_aws
 from app.dynamodb import create_table_if_not_exists
+from app.engine import WorkerEngine, WorkerStats
+from app.positions import create_position_table_if_not_exists
 from app.settings import settings
 from app.sqs import get_or_create_queue
-from app.worker import process_ping_from_queue
+from app.supervisor import ProcessSummary, Supervisor
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(
+    level=logging.INFO, format="%(processName)s %(levelname)s %(name)s: %(message)s"
+)
 logger = logging.getLogger(__name__)
 
 
-async def main() -> None:
+async def main() -> WorkerStats:
     logger.info("Starting worker")
 
     async with AWSClientManager(service_names=["sqs", "dynamodb"]) as aws_clients:
@@ -35,27 +44,98 @@ async def main() -> None:
 
         await retry_aws(create_table)
 
-        logger.info("Worker ready to process pings")
-        while True:
-            try:
-                pings = await process_ping_from_queue(
-                    sqs_client,
-                    sqs_queue_url,
-                    dynamodb_client,
-                    settings.dynamodb_table_name,
+        if settings.aggregates_enabled:
+
+            async def create_aggregate_table() -> None:
+                return await create_aggregate_table_if_not_exists(
+                    dynamodb_client, settings.dynamodb_aggregate_table_name
+                )
+
+            await retry_aws(create_aggregate_table)
+
+        if settings.positions_enabled:
+
+            async def create_position_table() -> None:
+                return await create_position_table_if_not_exists(
+                    dynamodb_client, settings.dynamodb_position_table_name
                 )
-                if pings:
-                    logger.info(f"Processed {len(pings)} pings")
-                else:
-                    await asyncio.sleep(1)
-            except Exception as e:
-                logger.error(f"Error during ping processing: {e}", exc_info=True)
-                await asyncio.sleep(1)
+
+            await retry_aws(create_position_table)
+
+        engine = WorkerEngine(
+            sqs_client,
+            sqs_queue_url,
+            dynamodb_client,
+            settings.dynamodb_table_name,
+        )
+
+        # Shut down gracefully on SIGTERM (ECS stop) and Ctrl+C.
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, engine.stop)
+
+        logger.info("Worker ready to process pings")
+        await engine.run()
+        return engine.stats
+
+
+# Entry point for each supervised worker process
+def run_process(index: int) -> WorkerStats:
+    return asyncio.run(main())
+
+
+def supervise(processes: int, summary_file: str | None) -> None:
+    supervisor = Supervisor(run_process, processes)
+
+    # Forward SIGTERM (ECS stop) and Ctrl+C to the children through the supervisor.
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: supervisor.stop())
+
+    summaries = supervisor.run()
+    log_summaries(summaries)
+    if summary_file:
+        with open(summary_file, "w") as f:
+            json.dump([summary.to_dict() for summary in summaries], f, indent=2)
+
+
+def log_summaries(summaries: List[ProcessSummary]) -> None:
+    for summary in summaries:
+        logger.info(
+            f"Worker process {summary.index}: stored {summary.stored} "
+            f"of {summary.received} received pings "
+            f"({summary.stored_per_second:.1f}/s), {summary.suppressed} coalesced, "
+            f"{summary.restarts} restarts"
+        )
+    # Processes ran side by side, so the overall rate is the sum of theirs.
+    total_rate = sum(summary.stored_per_second for summary in summaries)
+    logger.info(
+        f"All {len(summaries)} worker processes stored "
+        f"{sum(summary.stored for summary in summaries)} pings ({total_rate:.1f}/s)"
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Move pings from SQS to DynamoDB")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=settings.worker_processes or os.cpu_count() or 1,
+        help="Worker processes to run, 1 runs the engine in this process",
+    )
+    parser.add_argument(
+        "--summary-file",
+        help="Write the per-process throughput summary here as JSON on exit",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(main())
+        if args.processes > 1:
+            supervise(args.processes, args.summary_file)
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Worker interrupted by user")
     except Exception as e:
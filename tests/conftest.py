@@ -10,15 +10,20 @@ from botocore.config import Config
 from types_aiobotocore_sqs.client import SQSClient
 from types_aiobotocore_dynamodb.client import DynamoDBClient
 
+from app.aggregates import create_aggregate_table_if_not_exists
 from app.models import PingRecord
+from app.positions import create_position_table_if_not_exists
 from app.settings import settings
 from app.api import (
     app,
+    congestion_cache,
     get_sqs_client,
     get_sqs_queue_url,
+    get_sqs_producer,
     get_dynamodb_client,
     get_dynamodb_table_name,
 )
+from app.sqs import SQSBatchProducer
 from app.utils import coords_to_hex
 
 
@@ -56,6 +61,18 @@ async def sqs_queue_url(
     await sqs_client.delete_queue(QueueUrl=queue_url)
 
 
+@pytest.fixture
+async def sqs_producer(
+    sqs_client: SQSClient, sqs_queue_url: str
+) -> AsyncGenerator[SQSBatchProducer, None]:
+    producer = SQSBatchProducer(sqs_client, sqs_queue_url)
+    await producer.start()
+
+    yield producer
+
+    await producer.stop()
+
+
 @pytest.fixture
 async def dynamodb_endpoint_url() -> str:
     if settings.dynamodb_endpoint_url is None:
@@ -103,6 +120,30 @@ async def dynamodb_table_name(
     await dynamodb_client.delete_table(TableName=table_name)
 
 
+@pytest.fixture
+async def dynamodb_aggregate_table_name(
+    dynamodb_client: DynamoDBClient, dynamodb_endpoint_url: str
+) -> AsyncGenerator[str, None]:
+    table_name = f"{settings.dynamodb_aggregate_table_name}-test"
+    await create_aggregate_table_if_not_exists(dynamodb_client, table_name)
+
+    yield table_name
+
+    await dynamodb_client.delete_table(TableName=table_name)
+
+
+@pytest.fixture
+async def dynamodb_position_table_name(
+    dynamodb_client: DynamoDBClient, dynamodb_endpoint_url: str
+) -> AsyncGenerator[str, None]:
+    table_name = f"{settings.dynamodb_position_table_name}-test"
+    await create_position_table_if_not_exists(dynamodb_client, table_name)
+
+    yield table_name
+
+    await dynamodb_client.delete_table(TableName=table_name)
+
+
 # Doc Ref: https://docs.pytest.org/en/stable/how-to/fixtures.html#factories-as-fixtures
 @pytest.fixture
 def ping_record_factory() -> Callable[[], PingRecord]:
@@ -135,13 +176,17 @@ def ping_record_factory() -> Callable[[], PingRecord]:
 async def async_client(
     sqs_client: SQSClient,
     sqs_queue_url: str,
+    sqs_producer: SQSBatchProducer,
     dynamodb_client: DynamoDBClient,
     dynamodb_table_name: str,
 ) -> AsyncGenerator[AsyncClient, None]:
     app.dependency_overrides[get_sqs_client] = lambda: sqs_client
     app.dependency_overrides[get_sqs_queue_url] = lambda: sqs_queue_url
+    app.dependency_overrides[get_sqs_producer] = lambda: sqs_producer
     app.dependency_overrides[get_dynamodb_client] = lambda: dynamodb_client
     app.dependency_overrides[get_dynamodb_table_name] = lambda: dynamodb_table_name
+    # Every test starts from an empty table, so don't serve another test's responses.
+    congestion_cache.clear()
 
     async with AsyncClient(
         transport=ASGITransport(app=app), base_url="http://test"
@@ -52,7 +52,7 @@ def make_ping_record(overrides: Optional[Dict[str, Any]] = None) -> PingRecord:
     """
     now = datetime.now(timezone.utc)
     record_data: Dict[str, Any] = {
-        "h3_hex": "8a0106375dfffff",
+        "h3_hex": "8c754e649929dff",  # lat 0, lon 0 at resolution 12
         "device_id": "device_default",
         "ts": now,
         "lat": Latitude(0),
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+import h3  # type: ignore
+from types_aiobotocore_dynamodb.client import DynamoDBClient
+
+from app.aggregates import AggregateWriter, iter_recent_aggregates, iter_recent_areas
+from app.congestion import DeviceCongestion, GroupCongestion, calculate_group_congestion
+from app.models import PingRecord
+
+
+class TestAggregates:
+    async def test_aggregates_match_pings(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_aggregate_table_name: str,
+        ping_record_factory: Callable[..., PingRecord],
+    ) -> None:
+        """Congestion from aggregates should count each device once per hex"""
+        # Three devices in one hex, one of them pinging repeatedly.
+        first = ping_record_factory()
+        pings = [
+            first,
+            ping_record_factory(h3_hex=first.h3_hex, device_id=first.device_id),
+            ping_record_factory(h3_hex=first.h3_hex),
+            ping_record_factory(h3_hex=first.h3_hex),
+            ping_record_factory(),
+        ]
+
+        writer = AggregateWriter(dynamodb_client, dynamodb_aggregate_table_name)
+        for ping in pings:
+            writer.add(ping)
+        await writer.flush()
+        # Flushing the same pings again shouldn't change the counts.
+        for ping in pings:
+            writer.add(ping)
+        await writer.flush()
+
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=30)
+        congestion = DeviceCongestion()
+        async for aggregates in iter_recent_aggregates(
+            dynamodb_client, dynamodb_aggregate_table_name, cutoff, h3_hex=first.h3_hex
+        ):
+            for h3_hex, device_ids in aggregates:
+                congestion.add_devices(h3_hex, device_ids)
+
+        assert congestion.results() == {first.h3_hex: 3}
+
+    async def test_areas_match_pings(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_aggregate_table_name: str,
+        ping_record_factory: Callable[..., PingRecord],
+    ) -> None:
+        """A coarse area read from one key should match grouping its pings"""
+        first = ping_record_factory()
+        area = h3.cell_to_parent(first.h3_hex, 8)
+        children = h3.cell_to_children(area, 12)
+        pings = [first] + [
+            ping_record_factory(h3_hex=children[i * 100], device_id=f"device_{i % 3}")
+            for i in range(6)
+        ]
+
+        writer = AggregateWriter(
+            dynamodb_client, dynamodb_aggregate_table_name, index_resolutions=[8]
+        )
+        for ping in pings:
+            writer.add(ping)
+        await writer.flush()
+
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=30)
+        congestion = GroupCongestion(8)
+        async for areas in iter_recent_areas(
+            dynamodb_client, dynamodb_aggregate_table_name, cutoff, 8, h3_hex=area
+        ):
+            for area_hex, device_ids, child_hexes in areas:
+                congestion.add_area(area_hex, device_ids, child_hexes)
+
+        assert congestion.results() == calculate_group_congestion(pings, 8)
@@ -1,16 +1,26 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
 import random
-from typing import Callable, List
+import time
+from typing import Any, Callable, List
 from unittest.mock import ANY
 
 from fastapi import status
 import h3  # type: ignore
 from httpx import AsyncClient
+import pytest
 from types_aiobotocore_dynamodb.client import DynamoDBClient
 
+from app import api
 from app.dynamodb import store_ping_in_dynamodb
-from app.models import PingRecord
+from app.models import DeviceSighting, PingRecord
+from app.settings import settings
+from app.snapshot import SnapshotReader, write_snapshot
+from app.sqs import SQSBatchProducer
 from app.utils import coords_to_hex
+from app.window import CongestionWindow
+from app import wire
 from tests.helpers import get_mock_ping_request
 
 
@@ -50,6 +60,17 @@ class TestPingEndpoint:
 
         assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
 
+    async def test_binary_ping(self, async_client: AsyncClient) -> None:
+        """Test a ping in the binary wire format"""
+        body = wire.encode_pings([get_mock_ping_request()])
+
+        response = await async_client.post(
+            "/ping", content=body, headers={"Content-Type": wire.CONTENT_TYPE}
+        )
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.json() == {"status": "accepted", "message_id": ANY}
+
     async def test_missing_device_id(self, async_client: AsyncClient) -> None:
         """Test a missing device id"""
         ping_payload = get_mock_ping_request({"device_id": ""}, return_instance=False)
@@ -230,3 +251,395 @@ class TestCongestionEndpoint:
         assert result["device_count"] == len(pings)
         assert result["active_hex_count"] == len(children)
         assert result["total_hex_count"] == len(children)
+
+    async def test_congestion_for_an_area(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+    ) -> None:
+        """A coarse cell should count the pings in all of its descendants"""
+        area_hex = h3.latlng_to_cell(40.743, -73.989, 10)
+        children = h3.cell_to_children(area_hex, 12)
+        pings = [
+            ping_record_factory(h3_hex=children[i * 7], device_id=f"device_{i % 3}")
+            for i in range(5)
+        ]
+        for ping in pings:
+            await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, ping)
+
+        by_hex = await async_client.get(f"/congestion?h3_hex={area_hex}&resolution=10")
+        by_coordinates = await async_client.get(
+            "/congestion?lat=40.743&lon=-73.989&resolution=10"
+        )
+
+        assert by_hex.status_code == status.HTTP_200_OK
+        assert by_hex.json() == by_coordinates.json()
+        assert by_hex.json()["congestion"] == [
+            {
+                "h3_hex": area_hex,
+                "device_count": 3,
+                "active_hex_count": 5,
+                "total_hex_count": len(children),
+            }
+        ]
+
+    async def test_congestion_within_k(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+    ) -> None:
+        """A radius should count the cell and its neighbours, nothing further out"""
+        center = h3.latlng_to_cell(51.5007, -0.1246, 12)
+        neighbour = next(iter(h3.grid_ring(center, 1)))
+        far = next(iter(h3.grid_ring(center, 3)))
+        for h3_hex in (center, center, neighbour, far):
+            await store_ping_in_dynamodb(
+                dynamodb_client,
+                dynamodb_table_name,
+                ping_record_factory(h3_hex=h3_hex),
+            )
+
+        response = await async_client.get(f"/congestion?h3_hex={center}&k=1")
+
+        assert response.status_code == status.HTTP_200_OK
+        counts = {
+            item["h3_hex"]: item["device_count"]
+            for item in response.json()["congestion"]
+        }
+        assert counts == {center: 2, neighbour: 1}
+
+    async def test_congestion_from_the_window(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """A ready window should answer congestion without reading the table"""
+        ping = ping_record_factory()
+        window = CongestionWindow(dynamodb_client, dynamodb_table_name)
+        window.window.add(
+            [
+                DeviceSighting(ping.h3_hex, ping.device_id, ping.ts),
+                DeviceSighting(ping.h3_hex, "device_in_memory", ping.ts),
+            ]
+        )
+        window.ready.set()
+        monkeypatch.setattr(window, "_last_poll_at", time.monotonic())
+        monkeypatch.setattr(api, "congestion_window", window)
+
+        # Only in the table, the window hasn't polled it yet.
+        await store_ping_in_dynamodb(
+            dynamodb_client,
+            dynamodb_table_name,
+            ping_record_factory(h3_hex=ping.h3_hex),
+        )
+        response = await async_client.get(f"/congestion?h3_hex={ping.h3_hex}")
+        stats = (await async_client.get("/stats")).json()
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["congestion"] == [
+            {"h3_hex": ping.h3_hex, "device_count": 2}
+        ]
+        assert stats["congestion_window"]["entries"] == 2
+
+    async def test_stale_window_falls_back_to_the_table(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """A window that hasn't polled successfully in too long shouldn't answer"""
+        ping = ping_record_factory()
+        await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, ping)
+        window = CongestionWindow(dynamodb_client, dynamodb_table_name)
+        window.ready.set()
+        last_poll_at = time.monotonic() - settings.window_max_staleness_seconds - 1
+        monkeypatch.setattr(window, "_last_poll_at", last_poll_at)
+        monkeypatch.setattr(api, "congestion_window", window)
+
+        response = await async_client.get(f"/congestion?h3_hex={ping.h3_hex}")
+
+        assert response.json()["congestion"] == [
+            {"h3_hex": ping.h3_hex, "device_count": 1}
+        ]
+
+    async def test_congestion_from_the_snapshot(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ) -> None:
+        """A fresh snapshot should answer hexes, with how stale it is"""
+        ping = ping_record_factory()
+        await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, ping)
+        path = str(tmp_path / "congestion.snapshot")
+        write_snapshot(path, {ping.h3_hex: 7}, datetime.now(timezone.utc))
+        monkeypatch.setattr(api, "snapshot_reader", SnapshotReader(path))
+
+        by_hex = (await async_client.get(f"/congestion?h3_hex={ping.h3_hex}")).json()
+        everything = (await async_client.get("/congestion")).json()
+        around = (
+            await async_client.get(f"/congestion/around?h3_hex={ping.h3_hex}&k=1")
+        ).json()
+
+        assert by_hex["congestion"] == [{"h3_hex": ping.h3_hex, "device_count": 7}]
+        assert 0 <= by_hex["stale_seconds"] < 5
+        assert everything["congestion"] == by_hex["congestion"]
+        assert around["congestion"][ping.h3_hex] == 7
+        assert "as_of" in around
+
+    async def test_stale_snapshots_are_not_served(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ) -> None:
+        """A snapshot past its max age should fall back to reading the table"""
+        ping = ping_record_factory()
+        await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, ping)
+        path = str(tmp_path / "congestion.snapshot")
+        built_at = datetime.now(timezone.utc) - timedelta(
+            seconds=settings.snapshot_max_age_seconds + 1
+        )
+        write_snapshot(path, {ping.h3_hex: 7}, built_at)
+        monkeypatch.setattr(api, "snapshot_reader", SnapshotReader(path))
+
+        response = (await async_client.get(f"/congestion?h3_hex={ping.h3_hex}")).json()
+
+        assert response == {"congestion": [{"h3_hex": ping.h3_hex, "device_count": 1}]}
+
+    async def test_k_needs_a_cell(self, async_client: AsyncClient) -> None:
+        response = await async_client.get("/congestion?k=1")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    async def test_invalid_h3_hex(self, async_client: AsyncClient) -> None:
+        response = await async_client.get("/congestion?h3_hex=not_a_hex")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    async def test_large_areas_need_an_index(self, async_client: AsyncClient) -> None:
+        """An area too big to query by partition shouldn't fall back to a scan"""
+        area_hex = h3.latlng_to_cell(40.743, -73.989, 8)
+
+        response = await async_client.get(f"/congestion?h3_hex={area_hex}")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    async def test_congestion_is_cached(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+    ) -> None:
+        """Repeat requests within the TTL should be served from the cache"""
+        ping = ping_record_factory()
+        await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, ping)
+
+        before = (await async_client.get("/stats")).json()["congestion_cache"]
+        first = await async_client.get(f"/congestion?h3_hex={ping.h3_hex}")
+
+        # A ping stored after the first read isn't visible until the entry expires.
+        await store_ping_in_dynamodb(
+            dynamodb_client,
+            dynamodb_table_name,
+            ping_record_factory(h3_hex=ping.h3_hex),
+        )
+        second = await async_client.get(f"/congestion?h3_hex={ping.h3_hex}")
+        after = (await async_client.get("/stats")).json()["congestion_cache"]
+
+        assert first.json() == second.json()
+        assert second.json()["congestion"][0]["device_count"] == 1
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 1
+
+    async def test_congestion_around(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+    ) -> None:
+        """Every cell within k should be in the map, empty ones at zero"""
+        center = h3.latlng_to_cell(51.5007, -0.1246, 12)
+        neighbour = next(iter(h3.grid_ring(center, 2)))
+        far = next(iter(h3.grid_ring(center, 3)))
+        for h3_hex in (center, center, neighbour, far):
+            await store_ping_in_dynamodb(
+                dynamodb_client,
+                dynamodb_table_name,
+                ping_record_factory(h3_hex=h3_hex),
+            )
+
+        lat, lon = h3.cell_to_latlng(center)
+        response = await async_client.get(f"/congestion/around?lat={lat}&lon={lon}&k=2")
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["h3_hex"] == center
+        assert data["k"] == 2
+        assert set(data["congestion"]) == set(h3.grid_disk(center, 2))
+        assert data["congestion"][center] == 2
+        assert data["congestion"][neighbour] == 1
+        assert sum(data["congestion"].values()) == 3
+
+    async def test_congestion_around_shares_the_cache(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+    ) -> None:
+        """The disk should be one read, cached like the matching /congestion request"""
+        ping = ping_record_factory()
+        await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, ping)
+        await async_client.get(f"/congestion?h3_hex={ping.h3_hex}&resolution=12&k=1")
+
+        before = (await async_client.get("/stats")).json()["congestion_cache"]
+        response = await async_client.get(
+            f"/congestion/around?h3_hex={ping.h3_hex}&k=1"
+        )
+        after = (await async_client.get("/stats")).json()["congestion_cache"]
+
+        assert response.json()["congestion"][ping.h3_hex] == 1
+        assert after["hits"] - before["hits"] == 1
+        assert after["misses"] - before["misses"] == 0
+
+    async def test_congestion_around_a_coarse_cell(
+        self,
+        async_client: AsyncClient,
+        ping_record_factory: Callable[..., PingRecord],
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+    ) -> None:
+        """Coarse cells should count the devices in each of their children"""
+        ping = ping_record_factory()
+        await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, ping)
+        parent = h3.cell_to_parent(ping.h3_hex, 10)
+
+        response = await async_client.get(f"/congestion/around?h3_hex={parent}&k=1")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["congestion"][parent] == 1
+        assert len(response.json()["congestion"]) == 7
+
+    async def test_congestion_around_large_areas_need_an_index(
+        self, async_client: AsyncClient
+    ) -> None:
+        """The partition cap should apply to the whole disk, not each cell"""
+        center = h3.latlng_to_cell(40.743, -73.989, 10)
+
+        response = await async_client.get(f"/congestion/around?h3_hex={center}&k=3")
+
+        # 37 cells of 49 partitions each, well past AREA_MAX_PARTITIONS.
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    async def test_congestion_around_needs_a_cell(
+        self, async_client: AsyncClient
+    ) -> None:
+        response = await async_client.get("/congestion/around?k=1")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestBulkPingEndpoint:
+
+    async def test_json_array(self, async_client: AsyncClient) -> None:
+        """Valid pings should be accepted and invalid ones rejected by index"""
+        pings = [
+            get_mock_ping_request({"device_id": f"device_{i}"}, return_instance=False)
+            for i in range(25)
+        ]
+        pings[3]["lat"] = 91
+
+        response = await async_client.post("/pings", json=pings)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        data = response.json()
+        assert data["accepted"] == 24
+        assert data["rejected"] == 1
+        assert data["results"][3]["status"] == "rejected"
+        assert data["results"][4] == {
+            "index": 4,
+            "status": "accepted",
+            "message_id": ANY,
+        }
+
+    async def test_ndjson(self, async_client: AsyncClient) -> None:
+        """Newline delimited pings should be accepted too"""
+        body = "\n".join(
+            json.dumps(get_mock_ping_request(return_instance=False)) for _ in range(5)
+        )
+
+        response = await async_client.post(
+            "/pings",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.json()["accepted"] == 5
+
+    async def test_not_an_array(self, async_client: AsyncClient) -> None:
+        """A single object isn't a bulk upload"""
+        ping_payload = get_mock_ping_request(return_instance=False)
+
+        response = await async_client.post("/pings", json=ping_payload)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    async def test_binary_batch(self, async_client: AsyncClient) -> None:
+        """Binary uploads should be accepted, one message per ping by default"""
+        pings = [get_mock_ping_request({"device_id": f"d{i}"}) for i in range(3)]
+
+        response = await async_client.post(
+            "/pings",
+            content=wire.encode_pings(pings),
+            headers={"Content-Type": wire.CONTENT_TYPE},
+        )
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        results = response.json()["results"]
+        assert len({result["message_id"] for result in results}) == len(pings)
+
+    async def test_too_many_pings_queues_nothing(
+        self,
+        async_client: AsyncClient,
+        sqs_producer: SQSBatchProducer,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """An upload refused part way through shouldn't have queued any of it"""
+        monkeypatch.setattr(settings, "sqs_pings_per_message", 1)
+        line = json.dumps(get_mock_ping_request(return_instance=False))
+        body = "\n".join(line for _ in range(settings.max_pings_per_request + 1))
+        send_many: List[List[Any]] = []
+
+        async def _send_many(pings: List[Any]) -> List[str]:
+            send_many.append(pings)
+            return [str(i) for i in range(len(pings))]
+
+        monkeypatch.setattr(sqs_producer, "send_many", _send_many)
+
+        response = await async_client.post(
+            "/pings",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+        assert response.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+        assert send_many == []
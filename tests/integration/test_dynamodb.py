@@ -1,9 +1,16 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
+from typing import Callable, Set
 
+import pytest
 from types_aiobotocore_dynamodb.client import DynamoDBClient
 
 from app.dynamodb import (
+    DynamoDBBatchWriter,
+    create_table_if_not_exists,
     get_ping_from_dynamodb,
+    iter_recent_pings,
+    iter_written_sightings,
     query_pings_by_hex,
     query_recent_pings,
     store_ping_in_dynamodb,
@@ -122,3 +129,157 @@ class TestDynamoDB:
         assert pings[0].lat == new_record.lat
         assert pings[0].lon == new_record.lon
         assert pings[0].processed_at == new_record.processed_at
+
+    async def test_batch_writer(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        ping_record_factory: Callable[[], PingRecord],
+    ) -> None:
+        """Every record written through the batch writer should be readable"""
+        records = [ping_record_factory() for _ in range(60)]
+
+        writer = DynamoDBBatchWriter(dynamodb_client, dynamodb_table_name)
+        await writer.start()
+        await asyncio.gather(*(writer.write(record) for record in records))
+        await writer.stop()
+
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=5)
+        pings = await query_recent_pings(dynamodb_client, dynamodb_table_name, cutoff)
+
+        assert {p.device_id for p in pings} == {r.device_id for r in records}
+
+    async def test_paginated_parallel_scan(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        ping_record_factory: Callable[[], PingRecord],
+    ) -> None:
+        """A scan spread over small pages and segments should return everything"""
+        records = [ping_record_factory() for _ in range(30)]
+        for record in records:
+            await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, record)
+
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=5)
+        device_ids: Set[str] = set()
+        async for page in iter_recent_pings(
+            dynamodb_client, dynamodb_table_name, cutoff, segments=3, page_size=4
+        ):
+            device_ids.update(ping.device_id for ping in page)
+
+        assert device_ids == {record.device_id for record in records}
+
+    async def test_time_index_query(
+        self,
+        dynamodb_client: DynamoDBClient,
+        ping_record_factory: Callable[..., PingRecord],
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """Recent pings should come back from the time bucket index"""
+        monkeypatch.setattr(settings, "dynamodb_time_index_enabled", True)
+        table_name = f"{settings.dynamodb_table_name}-time-index-test"
+        await create_table_if_not_exists(dynamodb_client, table_name)
+
+        try:
+            now = datetime.now(timezone.utc)
+            recent = [ping_record_factory() for _ in range(10)]
+            old = ping_record_factory(ts=now - timedelta(minutes=40))
+            for record in [*recent, old]:
+                await store_ping_in_dynamodb(dynamodb_client, table_name, record)
+
+            cutoff = now - timedelta(minutes=settings.default_congestion_window)
+            pings = await query_recent_pings(dynamodb_client, table_name, cutoff)
+
+            assert {p.device_id for p in pings} == {r.device_id for r in recent}
+        finally:
+            await dynamodb_client.delete_table(TableName=table_name)
+
+    async def test_write_index_query(
+        self,
+        dynamodb_client: DynamoDBClient,
+        ping_record_factory: Callable[..., PingRecord],
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """Pings written since a point should come back, however old their ts"""
+        monkeypatch.setattr(settings, "dynamodb_write_index_enabled", True)
+        table_name = f"{settings.dynamodb_table_name}-write-index-test"
+        await create_table_if_not_exists(dynamodb_client, table_name)
+
+        try:
+            now = datetime.now(timezone.utc)
+            late = ping_record_factory(ts=now - timedelta(minutes=10))
+            await store_ping_in_dynamodb(dynamodb_client, table_name, late)
+
+            device_ids: Set[str] = set()
+            async for page in iter_written_sightings(
+                dynamodb_client, table_name, now - timedelta(seconds=5)
+            ):
+                device_ids.update(sighting.device_id for sighting in page)
+
+            assert device_ids == {late.device_id}
+        finally:
+            await dynamodb_client.delete_table(TableName=table_name)
+
+    async def test_same_second_pings_are_kept(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        ping_record_factory: Callable[..., PingRecord],
+    ) -> None:
+        """Devices pinging one hex in the same second shouldn't overwrite each other"""
+        first = ping_record_factory()
+        second = ping_record_factory(h3_hex=first.h3_hex, ts=first.ts)
+        for record in (first, second, first):
+            await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, record)
+
+        records = await query_pings_by_hex(
+            dynamodb_client, dynamodb_table_name, first.h3_hex
+        )
+
+        assert sorted(r.device_id for r in records) == sorted(
+            [first.device_id, second.device_id]
+        )
+        retrieved = await get_ping_from_dynamodb(
+            dynamodb_client,
+            dynamodb_table_name,
+            first.h3_hex,
+            first.ts,
+            second.device_id,
+        )
+        assert retrieved is not None
+        assert retrieved.device_id == second.device_id
+
+    async def test_sharded_and_legacy_reads(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+        ping_record_factory: Callable[..., PingRecord],
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """Reads should cover every shard and the items written before sharding"""
+        legacy = ping_record_factory()
+        monkeypatch.setattr(settings, "dynamodb_key_version", 1)
+        await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, legacy)
+
+        monkeypatch.setattr(settings, "dynamodb_key_version", 2)
+        monkeypatch.setattr(settings, "dynamodb_hex_shards", 4)
+        sharded = [ping_record_factory(h3_hex=legacy.h3_hex) for _ in range(20)]
+        for record in sharded:
+            await store_ping_in_dynamodb(dynamodb_client, dynamodb_table_name, record)
+
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=5)
+        pings = await query_recent_pings(
+            dynamodb_client, dynamodb_table_name, cutoff, h3_hex=legacy.h3_hex
+        )
+
+        assert {p.device_id for p in pings} == {r.device_id for r in [legacy, *sharded]}
+        assert {p.h3_hex for p in pings} == {legacy.h3_hex}
+        retrieved = await get_ping_from_dynamodb(
+            dynamodb_client,
+            dynamodb_table_name,
+            legacy.h3_hex,
+            legacy.ts,
+            legacy.device_id,
+        )
+        assert retrieved is not None
+        assert retrieved.device_id == legacy.device_id
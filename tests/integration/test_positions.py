@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from types_aiobotocore_dynamodb.client import DynamoDBClient
+
+from app.congestion import DeviceCongestion
+from app.models import PingRecord
+from app.positions import PositionWriter, get_device_position, iter_recent_positions
+
+
+class TestPositions:
+    async def test_devices_count_where_they_were_last_seen(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_position_table_name: str,
+        ping_record_factory: Callable[..., PingRecord],
+    ) -> None:
+        """Each device should be counted once, in its latest hex"""
+        now = datetime.now(timezone.utc)
+        first = ping_record_factory(ts=now - timedelta(seconds=20))
+        moved = ping_record_factory(device_id=first.device_id, ts=now)
+        other = ping_record_factory(h3_hex=first.h3_hex, ts=now)
+
+        writer = PositionWriter(dynamodb_client, dynamodb_position_table_name)
+        for ping in (first, other):
+            writer.add(ping)
+        await writer.flush()
+        writer.add(moved)
+        await writer.flush()
+        # A redelivered old ping shouldn't move the device back.
+        writer.add(first)
+        await writer.flush()
+
+        cutoff = now - timedelta(minutes=30)
+        congestion = DeviceCongestion()
+        async for page in iter_recent_positions(
+            dynamodb_client, dynamodb_position_table_name, cutoff
+        ):
+            congestion.add(page)
+
+        assert congestion.results() == {first.h3_hex: 1, moved.h3_hex: 1}
+        assert (
+            await get_device_position(
+                dynamodb_client, dynamodb_position_table_name, first.device_id
+            )
+            == moved.h3_hex
+        )
+
+    async def test_quiet_devices_leave_the_window(
+        self,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_position_table_name: str,
+        ping_record_factory: Callable[..., PingRecord],
+    ) -> None:
+        """Devices last seen before the cutoff shouldn't be counted"""
+        now = datetime.now(timezone.utc)
+        recent = ping_record_factory(ts=now)
+        quiet = ping_record_factory(h3_hex=recent.h3_hex, ts=now - timedelta(hours=1))
+
+        writer = PositionWriter(dynamodb_client, dynamodb_position_table_name)
+        writer.add(recent)
+        writer.add(quiet)
+        await writer.flush()
+
+        cutoff = now - timedelta(minutes=30)
+        devices = [
+            device
+            async for page in iter_recent_positions(
+                dynamodb_client,
+                dynamodb_position_table_name,
+                cutoff,
+                h3_hex=recent.h3_hex,
+            )
+            for device in page
+        ]
+
+        assert [device.device_id for device in devices] == [recent.device_id]
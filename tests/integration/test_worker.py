@@ -1,8 +1,10 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
 
 from types_aiobotocore_dynamodb.client import DynamoDBClient
 from types_aiobotocore_sqs.client import SQSClient
 
+from app.engine import WorkerEngine
 from app.sqs import send_ping_to_queue
 from app.worker import process_ping_from_queue
 from tests.helpers import get_mock_ping_request
@@ -59,3 +61,32 @@ class TestWorker:
         )
 
         assert len(processed) == 0
+
+    async def test_engine_drains_queue(
+        self,
+        sqs_client: SQSClient,
+        sqs_queue_url: str,
+        dynamodb_client: DynamoDBClient,
+        dynamodb_table_name: str,
+    ) -> None:
+        """Test the engine stores every queued ping and stops cleanly"""
+        for i in range(5):
+            ping = get_mock_ping_request({"device_id": f"device_{i}"})
+            ping.accepted_at = datetime.now(timezone.utc)
+            await send_ping_to_queue(sqs_client, sqs_queue_url, ping)
+
+        engine = WorkerEngine(
+            sqs_client, sqs_queue_url, dynamodb_client, dynamodb_table_name
+        )
+        run_task = asyncio.create_task(engine.run())
+
+        # Wait for the engine to catch up, then shut it down.
+        async def _wait_for_stored() -> None:
+            while engine.stats.stored < 5:
+                await asyncio.sleep(0.1)
+
+        await asyncio.wait_for(_wait_for_stored(), timeout=30)
+        engine.stop()
+        await asyncio.wait_for(run_task, timeout=30)
+
+        assert engine.stats.stored == 5
@@ -0,0 +1,225 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+from botocore.exceptions import ClientError
+import h3  # type: ignore
+from pytest_mock import MockerFixture
+
+from app.aggregates import (
+    AggregateWriter,
+    iter_recent_aggregates,
+    minute_bucket,
+    minute_shard_key,
+    minute_shard_keys,
+)
+from app.settings import settings
+from tests.helpers import make_ping_record
+
+
+class ConditionalCheckFailed(ClientError):
+    def __init__(self) -> None:
+        super().__init__(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+        )
+
+
+class TestAggregateWriter:
+    async def test_one_update_per_hex_and_minute(self, mocker: MockerFixture) -> None:
+        """Pings in the same hex and minute should be flushed as one update"""
+        dynamodb_client = mocker.AsyncMock()
+        writer = AggregateWriter(dynamodb_client, "aggregates")
+
+        ts = datetime.now(timezone.utc).replace(second=10)
+        for device_id in ("device_1", "device_2", "device_1"):
+            writer.add(make_ping_record({"device_id": device_id, "ts": ts}))
+        writer.add(
+            make_ping_record({"device_id": "device_3", "ts": ts + timedelta(minutes=1)})
+        )
+
+        await writer.flush()
+
+        updates = {
+            call.kwargs["Key"]["ts_minute"]["S"]: call.kwargs[
+                "ExpressionAttributeValues"
+            ][":devices"]["SS"]
+            for call in dynamodb_client.update_item.await_args_list
+        }
+        assert updates == {
+            minute_bucket(ts): ["device_1", "device_2"],
+            minute_bucket(ts + timedelta(minutes=1)): ["device_3"],
+        }
+
+    async def test_failed_flush_is_retried(self, mocker: MockerFixture) -> None:
+        """Updates that fail should be kept for the next flush"""
+        calls = 0
+
+        async def _fail_once(**kwargs: Any) -> Dict[str, Any]:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RuntimeError("throttled")
+            return {}
+
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.update_item.side_effect = _fail_once
+        writer = AggregateWriter(dynamodb_client, "aggregates", index_resolutions=[])
+
+        writer.add(make_ping_record())
+        await writer.flush()
+        await writer.flush()
+
+        assert calls == 2
+
+    async def test_failing_keys_are_dropped(self, mocker: MockerFixture) -> None:
+        """A key that keeps failing should be dropped after max_attempts flushes"""
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.update_item.side_effect = RuntimeError("throttled")
+        writer = AggregateWriter(
+            dynamodb_client, "aggregates", index_resolutions=[], max_attempts=3
+        )
+
+        writer.add(make_ping_record())
+        for _ in range(5):
+            await writer.flush()
+
+        assert dynamodb_client.update_item.await_count == 3
+        assert writer.dropped == 1
+
+    async def test_buffer_is_bounded(self, mocker: MockerFixture) -> None:
+        """Past max_pending keys, pings for new keys should be dropped"""
+        dynamodb_client = mocker.AsyncMock()
+        writer = AggregateWriter(
+            dynamodb_client, "aggregates", index_resolutions=[], max_pending=2
+        )
+
+        cells = [h3.latlng_to_cell(40.743, -73.989 + i * 5e-4, 12) for i in range(3)]
+        for cell in (*cells, cells[0]):
+            writer.add(make_ping_record({"h3_hex": cell}))
+        await writer.flush()
+
+        written = {
+            call.kwargs["Key"]["h3_hex"]["S"]
+            for call in dynamodb_client.update_item.await_args_list
+        }
+        assert written == set(cells[:2])
+        assert writer.dropped == 1
+
+    async def test_pings_fan_out_to_areas(self, mocker: MockerFixture) -> None:
+        """Each ping should also count in its parent at every index resolution"""
+        dynamodb_client = mocker.AsyncMock()
+        writer = AggregateWriter(
+            dynamodb_client, "aggregates", index_resolutions=[8, 6, 12]
+        )
+
+        cells = [h3.latlng_to_cell(40.743, -73.989 + i * 5e-4, 12) for i in range(2)]
+        for i, cell in enumerate(cells):
+            writer.add(make_ping_record({"h3_hex": cell, "device_id": f"device_{i}"}))
+        await writer.flush()
+
+        updates = {
+            call.kwargs["Key"]["h3_hex"]["S"]: call.kwargs["ExpressionAttributeValues"]
+            for call in dynamodb_client.update_item.await_args_list
+        }
+        # Two hexes and one area at each coarser resolution, nothing at 12 twice.
+        assert len(updates) == 4
+        for resolution in (6, 8):
+            area = updates[h3.cell_to_parent(cells[0], resolution)]
+            assert area[":devices"]["SS"] == ["device_0", "device_1"]
+            assert area[":children"]["SS"] == sorted(cells)
+            assert area[":h3_res"]["N"] == str(resolution)
+        assert ":children" not in updates[cells[0]]
+
+    async def test_busy_areas_spill_into_more_items(
+        self, mocker: MockerFixture
+    ) -> None:
+        """An area item that's full should send its devices on to the next one"""
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.exceptions.ConditionalCheckFailedException = (
+            ConditionalCheckFailed
+        )
+        sizes: Dict[str, int] = {}
+
+        # Like DynamoDB, reject an add once the item holds the most devices.
+        async def _update_item(**kwargs: Any) -> None:
+            values = kwargs["ExpressionAttributeValues"]
+            if ":max_devices" not in values:
+                return
+            ts_minute = kwargs["Key"]["ts_minute"]["S"]
+            if sizes.get(ts_minute, 0) >= int(values[":max_devices"]["N"]):
+                raise ConditionalCheckFailed()
+            sizes[ts_minute] = sizes.get(ts_minute, 0) + len(values[":devices"]["SS"])
+
+        dynamodb_client.update_item.side_effect = _update_item
+        writer = AggregateWriter(dynamodb_client, "aggregates", max_area_devices=2)
+
+        ts = datetime.now(timezone.utc)
+        for i in range(5):
+            writer.add(make_ping_record({"device_id": f"device_{i}", "ts": ts}))
+        await writer.flush()
+
+        minute = minute_bucket(ts)
+        assert sizes == {minute: 2, f"{minute}#1": 2, f"{minute}#2": 1}
+
+        # The next flush starts from the item being filled.
+        writer.add(make_ping_record({"device_id": "device_5", "ts": ts}))
+        dynamodb_client.update_item.reset_mock()
+        await writer.flush()
+        assert sizes[f"{minute}#2"] == 2
+        area_calls = [
+            call
+            for call in dynamodb_client.update_item.await_args_list
+            if ":max_devices" in call.kwargs["ExpressionAttributeValues"]
+        ]
+        assert len(area_calls) == 1
+
+
+class TestMinuteIndex:
+    async def test_only_hex_items_are_indexed(self, mocker: MockerFixture) -> None:
+        """Hex items should carry their minute key, area items shouldn't"""
+        mocker.patch.object(settings, "aggregate_minute_index_enabled", True)
+        dynamodb_client = mocker.AsyncMock()
+        writer = AggregateWriter(dynamodb_client, "aggregates", index_resolutions=[8])
+
+        record = make_ping_record()
+        writer.add(record)
+        await writer.flush()
+
+        updates = {
+            call.kwargs["Key"]["h3_hex"]["S"]: call.kwargs["ExpressionAttributeValues"]
+            for call in dynamodb_client.update_item.await_args_list
+        }
+        minute = minute_bucket(record.ts)
+        assert updates[record.h3_hex][":minute_shard"]["S"] == minute_shard_key(
+            minute, record.h3_hex
+        )
+        area = h3.cell_to_parent(record.h3_hex, 8)
+        assert ":minute_shard" not in updates[area]
+
+    async def test_global_read_queries_the_window(self, mocker: MockerFixture) -> None:
+        """The global read should query each minute of the window, not scan"""
+        mocker.patch.object(settings, "aggregate_minute_index_enabled", True)
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.query.return_value = {
+            "Items": [{"h3_hex": {"S": "hex_1"}, "device_ids": {"SS": ["d1"]}}]
+        }
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=30)
+
+        pages = [
+            page
+            async for page in iter_recent_aggregates(
+                dynamodb_client, "aggregates", cutoff
+            )
+        ]
+
+        keys = minute_shard_keys(cutoff)
+        assert dynamodb_client.scan.await_count == 0
+        assert dynamodb_client.query.await_count == len(keys)
+        assert len(pages) == len(keys)
+        queried = {
+            call.kwargs["ExpressionAttributeValues"][":minute_shard"]["S"]
+            for call in dynamodb_client.query.await_args_list
+        }
+        assert queried == set(keys)
+        # The window's minutes and the skew allowance, not the table's two hours.
+        minutes = 30 + 1 + settings.max_clock_skew_seconds // 60
+        assert len(keys) <= (minutes + 1) * settings.aggregate_minute_shards
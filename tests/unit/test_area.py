@@ -0,0 +1,41 @@
+import h3  # type: ignore
+
+from app.area import area_cells, child_partitions, contains, is_area
+
+
+def test_area_cells() -> None:
+    cell = h3.latlng_to_cell(40.743, -73.989, 12)
+
+    assert area_cells(cell) == [cell]
+    assert len(area_cells(cell, 2)) == 19
+    assert cell in area_cells(cell, 2)
+
+
+def test_is_area() -> None:
+    cell = h3.latlng_to_cell(40.743, -73.989, 12)
+
+    assert not is_area(cell)
+    assert is_area(cell, 1)
+    assert is_area(h3.cell_to_parent(cell, 9))
+
+
+def test_child_partitions() -> None:
+    parent = h3.latlng_to_cell(40.743, -73.989, 10)
+
+    children = child_partitions([parent], 12, max_partitions=49)
+    assert children is not None
+    assert sorted(children) == sorted(h3.cell_to_children(parent, 12))
+    # Past the limit the caller reads the window instead.
+    assert child_partitions([parent], 12, max_partitions=48) is None
+    # Cells at the source resolution are their own partition.
+    assert child_partitions(children[:2], 12) == children[:2]
+
+
+def test_contains() -> None:
+    parent = h3.latlng_to_cell(40.743, -73.989, 10)
+    outside = h3.latlng_to_cell(51.5007, -0.1246, 12)
+    in_area = contains([parent])
+
+    assert in_area(h3.cell_to_children(parent, 12)[0])
+    assert not in_area(outside)
+    assert not in_area(h3.cell_to_parent(parent, 8))
@@ -0,0 +1,65 @@
+import asyncio
+from typing import Any, Dict
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.cache import TTLCache
+
+
+async def test_concurrent_misses_share_a_load() -> None:
+    """A burst of identical misses should only run the loader once"""
+    loads = 0
+
+    async def _slow_load() -> Dict[str, Any]:
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.01)
+        return {"congestion": []}
+
+    cache: TTLCache[str, Dict[str, Any]] = TTLCache(ttl_seconds=60, max_entries=10)
+    results = await asyncio.gather(
+        *(cache.get_or_load("hex", _slow_load) for _ in range(20))
+    )
+    # A later request is served from the cache.
+    results.append(await cache.get_or_load("hex", _slow_load))
+
+    assert loads == 1
+    assert all(result == {"congestion": []} for result in results)
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "coalesced": 19}
+
+
+async def test_entries_expire(mocker: MockerFixture) -> None:
+    """An entry older than the TTL should be loaded again"""
+    loader = mocker.AsyncMock(side_effect=[1, 2])
+    cache: TTLCache[str, int] = TTLCache(ttl_seconds=60, max_entries=10)
+
+    monotonic = mocker.patch("app.cache.time.monotonic", return_value=0)
+    assert await cache.get_or_load("hex", loader) == 1
+    monotonic.return_value = 61
+    assert await cache.get_or_load("hex", loader) == 2
+
+
+async def test_least_recently_used_is_evicted(mocker: MockerFixture) -> None:
+    """The cache should stay bounded, dropping the least recently used entry"""
+    cache: TTLCache[str, str] = TTLCache(ttl_seconds=60, max_entries=2)
+
+    for key in ("a", "b", "a", "c"):
+        await cache.get_or_load(key, mocker.AsyncMock(return_value=key))
+
+    assert cache.stats()["entries"] == 2
+    assert cache.hits == 1
+    # "b" was used least recently, so it was evicted and has to load again.
+    loader = mocker.AsyncMock(return_value="b")
+    await cache.get_or_load("b", loader)
+    assert loader.await_count == 1
+
+
+async def test_failures_are_not_cached(mocker: MockerFixture) -> None:
+    """A failed load should raise for every waiter and not be cached"""
+    loader = mocker.AsyncMock(side_effect=[RuntimeError("boom"), "ok"])
+    cache: TTLCache[str, str] = TTLCache(ttl_seconds=60, max_entries=10)
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("hex", loader)
+    assert await cache.get_or_load("hex", loader) == "ok"
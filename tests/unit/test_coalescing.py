@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+
+from app.coalescing import WriteCoalescer
+from app.models import PingRecord
+from tests.helpers import make_ping_record
+
+
+def _ping(device_id: str, h3_hex: str, seconds: float) -> PingRecord:
+    ts = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=seconds)
+    return make_ping_record({"device_id": device_id, "h3_hex": h3_hex, "ts": ts})
+
+
+class TestWriteCoalescer:
+    def test_same_cell_is_written_once_per_refresh(self) -> None:
+        """A parked device should only be written once every refresh interval"""
+        coalescer = WriteCoalescer(refresh_seconds=60, max_devices=10)
+
+        writes = [
+            coalescer.should_write(_ping("d1", "hex_1", seconds))
+            for seconds in range(0, 150, 10)
+        ]
+
+        # Written at 0, 60 and 120 seconds.
+        assert writes.count(True) == 3
+        assert [i * 10 for i, write in enumerate(writes) if write] == [0, 60, 120]
+        assert coalescer.stats.suppressed == 12
+        assert coalescer.stats.pings == 15
+
+    def test_moving_is_always_written(self) -> None:
+        """A device in a new cell should be written straight away"""
+        coalescer = WriteCoalescer(refresh_seconds=60, max_devices=10)
+
+        assert coalescer.should_write(_ping("d1", "hex_1", 0))
+        assert coalescer.should_write(_ping("d1", "hex_2", 1))
+        assert coalescer.should_write(_ping("d1", "hex_1", 2))
+        assert coalescer.stats.suppressed == 0
+
+    def test_least_recent_devices_are_evicted(self) -> None:
+        """Past `max_devices` the oldest device is forgotten and written again"""
+        coalescer = WriteCoalescer(refresh_seconds=60, max_devices=2)
+
+        for device_id in ("d1", "d2", "d3"):
+            coalescer.should_write(_ping(device_id, "hex_1", 0))
+
+        assert len(coalescer) == 2
+        assert coalescer.stats.evicted == 1
+        assert coalescer.should_write(_ping("d1", "hex_1", 1))
+        assert not coalescer.should_write(_ping("d3", "hex_1", 1))
+
+    def test_failed_writes_are_forgotten(self) -> None:
+        """A ping whose write failed shouldn't suppress its retry"""
+        coalescer = WriteCoalescer(refresh_seconds=60, max_devices=10)
+        ping = _ping("d1", "hex_1", 0)
+
+        assert coalescer.should_write(ping)
+        coalescer.forget(ping)
+
+        assert coalescer.should_write(ping)
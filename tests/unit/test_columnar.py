@@ -0,0 +1,81 @@
+import random
+
+import h3  # type: ignore
+import pytest
+
+from app.congestion import calculate_group_congestion
+from tests.helpers import make_ping_record
+
+np = pytest.importorskip("numpy")
+
+from app.columnar import (  # noqa: E402
+    ColumnarGroupCongestion,
+    cells_to_parents,
+    group_congestion,
+)
+
+
+@pytest.mark.parametrize("resolution", [0, 5, 9, 11, 12])
+def test_parents_match_h3(resolution: int) -> None:
+    """Vectorized parents should match h3.cell_to_parent"""
+    cells = [
+        h3.latlng_to_cell(random.uniform(-80, 80), random.uniform(-180, 180), 12)
+        for _ in range(200)
+    ]
+    # Pentagons have their own digit layout, make sure one is covered.
+    cells.append(h3.cell_to_center_child(h3.get_pentagons(0)[0], 12))
+
+    parents = cells_to_parents(
+        np.array([h3.str_to_int(c) for c in cells], dtype=np.uint64), resolution
+    )
+
+    assert [h3.int_to_str(p) for p in parents.tolist()] == [
+        h3.cell_to_parent(c, resolution) for c in cells
+    ]
+
+
+@pytest.mark.parametrize("resolution", [7, 10, 11])
+def test_matches_row_congestion(resolution: int) -> None:
+    """Columnar aggregation should give the same output as the row path"""
+    top_hex = "872a1072bffffff"
+    children = list(h3.cell_to_children(top_hex, 12))
+    pings = [
+        make_ping_record(
+            {
+                "device_id": f"device{random.randrange(300)}",
+                "h3_hex": random.choice(children),
+            }
+        )
+        for _ in range(2_000)
+    ]
+
+    congestion = ColumnarGroupCongestion(resolution)
+    for start in range(0, len(pings), 500):
+        congestion.add(pings[start : start + 500])
+
+    assert congestion.results() == calculate_group_congestion(pings, resolution)
+
+
+def test_wide_device_codes() -> None:
+    """Codes too wide to pack with the parent should still count correctly"""
+    children = list(h3.cell_to_children("8b2a1072d0d5fff", 12))
+    pings = [
+        make_ping_record({"device_id": f"device{i % 3}", "h3_hex": children[i % 7]})
+        for i in range(30)
+    ]
+    cells = np.array([int(p.h3_hex, 16) for p in pings], dtype=np.uint64)
+    devices = np.array([2**40 + int(p.device_id[-1]) for p in pings], dtype=np.int64)
+
+    assert group_congestion(cells, devices, 11) == calculate_group_congestion(
+        pings, 11
+    )
+
+
+def test_empty_and_too_fine() -> None:
+    """No pings gives no groups, and parents can't be finer than the pings"""
+    cells = np.array([h3.str_to_int("8b2a1072d0d5fff")], dtype=np.uint64)
+    devices = np.zeros(1, dtype=np.int64)
+
+    assert group_congestion(cells[:0], devices[:0], 5) == {}
+    with pytest.raises(ValueError):
+        group_congestion(cells, devices, 12)
@@ -2,7 +2,12 @@ from datetime import datetime, timezone
 
 import h3  # type: ignore
 
-from app.congestion import calculate_device_congestion, calculate_group_congestion
+from app.congestion import (
+    DeviceCongestion,
+    GroupCongestion,
+    calculate_device_congestion,
+    calculate_group_congestion,
+)
 from tests.helpers import make_ping_record
 
 
@@ -53,3 +58,53 @@ def test_calculate_parent_grid_congestion() -> None:
     assert result["device_count"] == 3
     assert result["active_hex_count"] == 2
     assert result["total_hex_count"] == 7
+
+
+def test_incremental_congestion_matches() -> None:
+    """Adding pings a page at a time should match adding them all at once."""
+    children = h3.cell_to_children("8b2a1072d0d5fff", 12)
+    pings = [
+        make_ping_record({"device_id": f"device{i % 5}", "h3_hex": children[i % 7]})
+        for i in range(20)
+    ]
+
+    device_congestion = DeviceCongestion()
+    group_congestion = GroupCongestion(resolution=11)
+    for start in range(0, len(pings), 6):
+        device_congestion.add(pings[start : start + 6])
+        group_congestion.add(pings[start : start + 6])
+
+    assert device_congestion.results() == calculate_device_congestion(pings)
+    assert group_congestion.results() == calculate_group_congestion(pings, 11)
+
+
+def test_approximate_group_congestion() -> None:
+    """Approximate mode should estimate devices but keep exact hex counts."""
+    children = h3.cell_to_children("8b2a1072d0d5fff", 12)
+    pings = [
+        make_ping_record({"device_id": f"device{i}", "h3_hex": children[i % 7]})
+        for i in range(2_000)
+    ]
+
+    result = calculate_group_congestion(pings, 11, approx=True)["8b2a1072d0d5fff"]
+
+    assert abs(result["device_count"] - 2_000) <= 100
+    assert result["active_hex_count"] == 7
+    assert result["total_hex_count"] == 7
+
+
+def test_group_congestion_from_areas() -> None:
+    """Area items should group the same as the pings they were built from"""
+    area = h3.latlng_to_cell(40.743, -73.989, 8)
+    children = h3.cell_to_children(area, 12)
+    pings = [
+        make_ping_record({"h3_hex": children[i * 50], "device_id": f"device_{i % 4}"})
+        for i in range(10)
+    ]
+
+    congestion = GroupCongestion(7)
+    congestion.add_area(
+        area, {ping.device_id for ping in pings}, {ping.h3_hex for ping in pings}
+    )
+
+    assert congestion.results() == calculate_group_congestion(pings, 7)
@@ -0,0 +1,365 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Set
+
+from botocore.exceptions import ClientError
+import pytest
+from pytest_mock import MockerFixture
+
+from app.dynamodb import (
+    DynamoDBBatchWriter,
+    get_ping_from_dynamodb,
+    iter_recent_devices,
+    iter_recent_pings,
+    ping_partition_key,
+    ping_partition_keys,
+    time_bucket_key,
+    time_bucket_keys,
+    _ddb_item_to_ping_record,
+    _item_key,
+    _ping_record_to_ddb_item,
+)
+from app.models import DevicePing
+from app.settings import settings
+from tests.helpers import make_ping_record
+
+
+class TestDynamoDBBatchWriter:
+    async def test_records_share_a_batch(self, mocker: MockerFixture) -> None:
+        """Concurrent writes should go out in one BatchWriteItem call"""
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.return_value = {}
+
+        writer = DynamoDBBatchWriter(dynamodb_client, "table", max_linger_ms=50)
+        await writer.start()
+
+        records = [make_ping_record({"h3_hex": f"hex_{i}"}) for i in range(25)]
+        await asyncio.gather(*(writer.write(r) for r in records))
+
+        await writer.stop()
+
+        assert dynamodb_client.batch_write_item.await_count == 1
+
+    async def test_duplicate_keys_are_merged(self, mocker: MockerFixture) -> None:
+        """Records with the same key should only be sent once per batch"""
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.return_value = {}
+
+        writer = DynamoDBBatchWriter(dynamodb_client, "table", max_linger_ms=50)
+        await writer.start()
+
+        record = make_ping_record()
+        await asyncio.gather(writer.write(record), writer.write(record))
+
+        await writer.stop()
+
+        requests = dynamodb_client.batch_write_item.await_args.kwargs["RequestItems"]
+        assert len(requests["table"]) == 1
+
+    async def test_unprocessed_items_are_retried(self, mocker: MockerFixture) -> None:
+        """Unprocessed items should be retried until they are written"""
+        calls = 0
+
+        async def _throttle_once(**kwargs: Any) -> Dict[str, Any]:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                return {"UnprocessedItems": kwargs["RequestItems"]}
+            return {}
+
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.side_effect = _throttle_once
+        mocker.patch("app.dynamodb._backoff_seconds", return_value=0)
+
+        writer = DynamoDBBatchWriter(dynamodb_client, "table", max_linger_ms=1)
+        await writer.start()
+        await writer.write(make_ping_record())
+        await writer.stop()
+
+        assert calls == 2
+
+    async def test_gives_up_after_retries(self, mocker: MockerFixture) -> None:
+        """Items that are never processed should raise instead of reporting success"""
+
+        async def _always_throttle(**kwargs: Any) -> Dict[str, Any]:
+            return {"UnprocessedItems": kwargs["RequestItems"]}
+
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.side_effect = _always_throttle
+        mocker.patch("app.dynamodb._backoff_seconds", return_value=0)
+
+        writer = DynamoDBBatchWriter(
+            dynamodb_client, "table", max_linger_ms=1, max_retries=2
+        )
+        await writer.start()
+
+        with pytest.raises(RuntimeError):
+            await writer.write(make_ping_record())
+
+        await writer.stop()
+
+        assert dynamodb_client.batch_write_item.await_count == 3
+
+    async def test_rejected_batches_are_put_one_by_one(
+        self, mocker: MockerFixture
+    ) -> None:
+        """One invalid item should only fail its own write, not the whole batch"""
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.side_effect = ClientError(
+            {"Error": {"Code": "ValidationException"}}, "BatchWriteItem"
+        )
+
+        async def _put_item(**kwargs: Any) -> Dict[str, Any]:
+            if kwargs["Item"]["device_id"]["S"] == "bad":
+                raise ClientError({"Error": {"Code": "ValidationException"}}, "PutItem")
+            return {}
+
+        dynamodb_client.put_item.side_effect = _put_item
+
+        writer = DynamoDBBatchWriter(dynamodb_client, "table", max_linger_ms=50)
+        await writer.start()
+        results = await asyncio.gather(
+            *(
+                writer.write(make_ping_record({"device_id": device_id}))
+                for device_id in ("good_1", "bad", "good_2")
+            ),
+            return_exceptions=True,
+        )
+        await writer.stop()
+
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], ClientError)
+        assert dynamodb_client.put_item.await_count == 3
+
+    async def test_throttled_batches_fail_whole(self, mocker: MockerFixture) -> None:
+        """Throttling isn't down to one item, the batch should fail and be retried"""
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.side_effect = ClientError(
+            {"Error": {"Code": "ThrottlingException"}}, "BatchWriteItem"
+        )
+
+        writer = DynamoDBBatchWriter(dynamodb_client, "table", max_linger_ms=50)
+        await writer.start()
+        results = await asyncio.gather(
+            writer.write(make_ping_record({"device_id": "device_1"})),
+            writer.write(make_ping_record({"device_id": "device_2"})),
+            return_exceptions=True,
+        )
+        await writer.stop()
+
+        assert all(isinstance(result, ClientError) for result in results)
+        dynamodb_client.put_item.assert_not_awaited()
+
+
+class TestIterRecentPings:
+    async def test_scan_follows_pages_and_segments(self, mocker: MockerFixture) -> None:
+        """Every page of every segment should be returned"""
+
+        async def _scan(**kwargs: Any) -> Dict[str, Any]:
+            # Each segment has two pages, the first one points at the second.
+            segment = kwargs["Segment"]
+            page = 1 if "ExclusiveStartKey" in kwargs else 0
+            record = make_ping_record({"device_id": f"device_{segment}_{page}"})
+            response: Dict[str, Any] = {"Items": [_ping_record_to_ddb_item(record)]}
+            if page == 0:
+                response["LastEvaluatedKey"] = {"h3_hex": {"S": "next"}}
+            return response
+
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.scan.side_effect = _scan
+
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=30)
+        device_ids: Set[str] = set()
+        async for page in iter_recent_pings(
+            dynamodb_client, "table", cutoff, segments=3
+        ):
+            device_ids.update(ping.device_id for ping in page)
+
+        assert device_ids == {f"device_{s}_{p}" for s in range(3) for p in range(2)}
+        assert dynamodb_client.scan.await_count == 6
+
+    async def test_devices_only_project_what_they_need(
+        self, mocker: MockerFixture
+    ) -> None:
+        """The device read should project two attributes and skip validation"""
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.query.return_value = {
+            "Items": [{"h3_hex": {"S": "8c2a100d2189bff"}, "device_id": {"S": "d1"}}]
+        }
+
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=30)
+        pages = [
+            page
+            async for page in iter_recent_devices(
+                dynamodb_client, "table", cutoff, h3_hex="8c2a100d2189bff"
+            )
+        ]
+
+        assert pages == [[DevicePing("8c2a100d2189bff", "d1")]]
+        query = dynamodb_client.query.await_args.kwargs
+        assert query["ProjectionExpression"] == "h3_hex, device_id"
+
+
+class TestTimeBuckets:
+    def test_window_covers_recent_pings(self) -> None:
+        """Every ping newer than the cutoff should land in a queried bucket"""
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(minutes=30)
+        keys = set(time_bucket_keys(cutoff))
+
+        for minutes_ago in range(0, 30):
+            ts = now - timedelta(minutes=minutes_ago)
+            for device_id in ("device_1", "device_2", "device_3"):
+                assert time_bucket_key(ts, device_id) in keys
+
+    def test_window_size_not_table_size(self) -> None:
+        """The number of buckets only depends on the window"""
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=30)
+        buckets = len(time_bucket_keys(cutoff)) // settings.time_bucket_shards
+
+        window = 30 * 60 + settings.max_clock_skew_seconds
+        assert buckets <= window // settings.time_bucket_seconds + 2
+
+    def test_bucket_written_when_enabled(self, mocker: MockerFixture) -> None:
+        """Items should only carry the bucket attribute when the index is on"""
+        record = make_ping_record()
+        assert "ts_bucket" not in _ping_record_to_ddb_item(record)
+
+        mocker.patch.object(settings, "dynamodb_time_index_enabled", True)
+        assert "ts_bucket" in _ping_record_to_ddb_item(record)
+
+    def test_written_bucket_follows_write_time(self, mocker: MockerFixture) -> None:
+        """A ping stored late should be bucketed by when it was written"""
+        mocker.patch.object(settings, "dynamodb_write_index_enabled", True)
+        now = datetime.now(timezone.utc)
+        record = make_ping_record({"ts": now - timedelta(minutes=10)})
+
+        item = _ping_record_to_ddb_item(record)
+
+        assert datetime.fromisoformat(item["written_at"]["S"]) >= now
+        assert item["written_bucket"]["S"] in time_bucket_keys(now, skew_seconds=0)
+
+
+class TestPingKeys:
+    def test_same_second_pings_dont_collide(self) -> None:
+        """Devices pinging the same hex in the same second should get their own items"""
+        ts = datetime.now(timezone.utc)
+        first = _ping_record_to_ddb_item(
+            make_ping_record({"device_id": "d1", "ts": ts})
+        )
+        second = _ping_record_to_ddb_item(
+            make_ping_record({"device_id": "d2", "ts": ts})
+        )
+        redelivered = _ping_record_to_ddb_item(
+            make_ping_record({"device_id": "d1", "ts": ts})
+        )
+
+        assert _item_key(first) != _item_key(second)
+        assert _item_key(first) == _item_key(redelivered)
+
+    def test_sharded_items_read_back_as_the_hex(self, mocker: MockerFixture) -> None:
+        """Shard suffixes should only live in the key, never in the decoded ping"""
+        mocker.patch.object(settings, "dynamodb_hex_shards", 4)
+        record = make_ping_record()
+        item = _ping_record_to_ddb_item(record)
+
+        assert item["h3_hex"]["S"] in ping_partition_keys(record.h3_hex)
+        assert item["h3_hex"]["S"] != record.h3_hex
+        decoded = _ddb_item_to_ping_record(item)
+        assert decoded.h3_hex == record.h3_hex
+        assert decoded.ts == record.ts.replace(microsecond=0)
+
+    def test_shards_spread_devices(self, mocker: MockerFixture) -> None:
+        """A hex's devices should be spread over its shards, each always in one"""
+        mocker.patch.object(settings, "dynamodb_hex_shards", 4)
+        h3_hex = "8c2a100d2189bff"
+        partitions = {ping_partition_key(h3_hex, f"device_{i}") for i in range(100)}
+
+        assert len(partitions) == 4
+        assert ping_partition_key(h3_hex, "device_1") == ping_partition_key(
+            h3_hex, "device_1"
+        )
+
+    def test_legacy_partition_is_read(self, mocker: MockerFixture) -> None:
+        """Sharded reads should also cover the bare hex legacy items live under"""
+        mocker.patch.object(settings, "dynamodb_hex_shards", 2)
+        h3_hex = "8c2a100d2189bff"
+
+        assert ping_partition_keys(h3_hex) == [f"{h3_hex}#0", f"{h3_hex}#1", h3_hex]
+        mocker.patch.object(settings, "dynamodb_legacy_reads", False)
+        assert ping_partition_keys(h3_hex) == [f"{h3_hex}#0", f"{h3_hex}#1"]
+
+    def test_legacy_items_decode(self, mocker: MockerFixture) -> None:
+        """Items written with the version 1 key should still decode"""
+        mocker.patch.object(settings, "dynamodb_key_version", 1)
+        record = make_ping_record()
+        item = _ping_record_to_ddb_item(record)
+
+        assert "#" not in item["ts"]["S"]
+        assert _ddb_item_to_ping_record(item).ts == record.ts.replace(microsecond=0)
+
+    async def test_hex_query_reads_every_shard(self, mocker: MockerFixture) -> None:
+        """Reading a hex should query each of its shards"""
+        mocker.patch.object(settings, "dynamodb_hex_shards", 3)
+        h3_hex = "8c2a100d2189bff"
+        dynamodb_client = mocker.AsyncMock()
+
+        async def _query(**kwargs: Any) -> Dict[str, Any]:
+            partition = kwargs["ExpressionAttributeValues"][":h3_hex"]["S"]
+            return {
+                "Items": [{"h3_hex": {"S": partition}, "device_id": {"S": partition}}]
+            }
+
+        dynamodb_client.query.side_effect = _query
+
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=30)
+        devices = [
+            device
+            async for page in iter_recent_devices(
+                dynamodb_client, "table", cutoff, h3_hex=h3_hex
+            )
+            for device in page
+        ]
+
+        assert dynamodb_client.query.await_count == 4
+        assert {device.h3_hex for device in devices} == {h3_hex}
+        assert {device.device_id for device in devices} == set(
+            ping_partition_keys(h3_hex)
+        )
+
+    async def test_get_ping_by_device_uses_the_key(self, mocker: MockerFixture) -> None:
+        """With a device id, a ping should be fetched by its exact key"""
+        record = make_ping_record()
+        item = _ping_record_to_ddb_item(record)
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.get_item.return_value = {"Item": item}
+
+        ping = await get_ping_from_dynamodb(
+            dynamodb_client, "table", record.h3_hex, record.ts, record.device_id
+        )
+
+        assert ping is not None and ping.device_id == record.device_id
+        key = dynamodb_client.get_item.await_args.kwargs["Key"]
+        assert key == {"h3_hex": item["h3_hex"], "ts": item["ts"]}
+        dynamodb_client.query.assert_not_awaited()
+
+    async def test_get_ping_falls_back_to_legacy_keys(
+        self, mocker: MockerFixture
+    ) -> None:
+        """A ping missing under the new key should be looked up by its second"""
+        mocker.patch.object(settings, "dynamodb_key_version", 1)
+        record = make_ping_record()
+        legacy_item = _ping_record_to_ddb_item(record)
+        mocker.patch.object(settings, "dynamodb_key_version", 2)
+
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.get_item.return_value = {}
+        dynamodb_client.query.return_value = {"Items": [legacy_item]}
+
+        ping = await get_ping_from_dynamodb(
+            dynamodb_client, "table", record.h3_hex, record.ts, record.device_id
+        )
+
+        assert ping is not None and ping.device_id == record.device_id
+        query = dynamodb_client.query.await_args.kwargs
+        assert "begins_with(ts, :ts)" in query["KeyConditionExpression"]
@@ -0,0 +1,129 @@
+import asyncio
+from typing import Any, Dict, List
+
+from pytest_mock import MockerFixture
+
+from app.engine import WorkerEngine
+from app.models import PingPayload
+from app.wire import encode_message
+from tests.helpers import get_mock_ping_request
+
+
+def _make_pings(count: int) -> List[PingPayload]:
+    pings = []
+    for i in range(count):
+        # Spread the pings over different hexes so their table keys differ.
+        ping = get_mock_ping_request({"device_id": f"device_{i}", "lat": 40 + i})
+        ping.accepted_at = ping.timestamp
+        pings.append(ping)
+    return pings
+
+
+def _make_sqs_client(
+    mocker: MockerFixture, message_count: int, bodies: List[str] | None = None
+) -> Any:
+    """SQS mock that hands out `message_count` messages once, then long-polls forever."""
+    if bodies is None:
+        bodies = [ping.model_dump_json() for ping in _make_pings(message_count)]
+    messages = [
+        {"Body": body, "ReceiptHandle": f"rh-{i}"} for i, body in enumerate(bodies)
+    ]
+
+    delivered = False
+
+    async def _receive_message(**kwargs: Any) -> Dict[str, Any]:
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {"Messages": messages}
+        await asyncio.sleep(3600)
+        return {}
+
+    sqs_client = mocker.AsyncMock()
+    sqs_client.receive_message.side_effect = _receive_message
+    sqs_client.delete_message_batch.return_value = {}
+    return sqs_client
+
+
+def _deleted_count(sqs_client: Any) -> int:
+    return sum(
+        len(call.kwargs["Entries"])
+        for call in sqs_client.delete_message_batch.await_args_list
+    )
+
+
+class TestWorkerEngine:
+    async def test_processes_all_messages(self, mocker: MockerFixture) -> None:
+        """Every received message should be stored and deleted"""
+        sqs_client = _make_sqs_client(mocker, 5)
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.return_value = {}
+
+        engine = WorkerEngine(
+            sqs_client, "queue-url", dynamodb_client, "table", receivers=2
+        )
+        run_task = asyncio.create_task(engine.run())
+
+        async def _wait_for_stored() -> None:
+            while engine.stats.stored < 5:
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(_wait_for_stored(), timeout=5)
+        engine.stop()
+        await asyncio.wait_for(run_task, timeout=5)
+
+        written = sum(
+            len(call.kwargs["RequestItems"]["table"])
+            for call in dynamodb_client.batch_write_item.await_args_list
+        )
+        assert written == 5
+        assert _deleted_count(sqs_client) == 5
+
+    async def test_stop_finishes_in_flight(self, mocker: MockerFixture) -> None:
+        """Stopping should wait for messages already received"""
+        sqs_client = _make_sqs_client(mocker, 5)
+
+        async def _slow_batch_write_item(**kwargs: Any) -> Dict[str, Any]:
+            await asyncio.sleep(0.05)
+            return {}
+
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.side_effect = _slow_batch_write_item
+
+        engine = WorkerEngine(sqs_client, "queue-url", dynamodb_client, "table")
+        run_task = asyncio.create_task(engine.run())
+
+        async def _wait_for_received() -> None:
+            while engine.stats.received < 5:
+                await asyncio.sleep(0.001)
+
+        await asyncio.wait_for(_wait_for_received(), timeout=5)
+
+        engine.stop()
+        await asyncio.wait_for(run_task, timeout=5)
+
+        assert engine.stats.stored == 5
+        assert _deleted_count(sqs_client) == 5
+
+    async def test_messages_with_several_pings(self, mocker: MockerFixture) -> None:
+        """Every ping in a packed message should be stored, then the message deleted"""
+        body = encode_message(_make_pings(4), binary=True)
+        sqs_client = _make_sqs_client(mocker, 1, bodies=[body])
+        dynamodb_client = mocker.AsyncMock()
+        dynamodb_client.batch_write_item.return_value = {}
+
+        engine = WorkerEngine(
+            sqs_client, "queue-url", dynamodb_client, "table", receivers=1
+        )
+        run_task = asyncio.create_task(engine.run())
+
+        async def _wait_for_stored() -> None:
+            while engine.stats.stored < 4:
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(_wait_for_stored(), timeout=5)
+        engine.stop()
+        await asyncio.wait_for(run_task, timeout=5)
+
+        assert engine.stats.received == 1
+        assert _deleted_count(sqs_client) == 1
@@ -1,4 +1,13 @@
-from app.utils import coords_to_hex
+import pytest
+from pytest_mock import MockerFixture
+
+from app.settings import settings
+from app.utils import (
+    cached_coords_to_hex,
+    coords_to_hex,
+    coords_to_hexes,
+    h3_cache_info,
+)
 
 
 class TestH3:
@@ -25,3 +34,39 @@ class TestH3:
         hex2 = coords_to_hex(lat=370, lon=10)
 
         assert hex1 == hex2
+
+    @pytest.fixture
+    def h3_cache(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(settings, "h3_cache_enabled", True)
+
+    def test_cached_matches_exact(self, h3_cache: None) -> None:
+        assert cached_coords_to_hex(lat=40.743, lon=-73.989) == "8c2a100d2189bff"
+
+    def test_cached_repeats_skip_h3(self, h3_cache: None) -> None:
+        before = h3_cache_info()
+        # A parked device, jittering well under the cache quantum.
+        for jitter in (0, 1e-8, -2e-8, 3e-8):
+            cached_coords_to_hex(lat=51.5007 + jitter, lon=-0.1246 - jitter)
+        after = h3_cache_info()
+
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 3
+
+    def test_fine_resolutions_are_exact(self, h3_cache: None) -> None:
+        lat, lon = 40.7430004, -73.9890004
+        assert cached_coords_to_hex(lat, lon, 15) == coords_to_hex(lat, lon, 15)
+
+    def test_batch_matches_single(self, h3_cache: None) -> None:
+        # Enough coordinates for the vectorized path, with plenty of repeats.
+        lats = [40.743 + (i % 10) * 1e-4 for i in range(200)]
+        lons = [-73.989 - (i % 7) * 1e-4 for i in range(200)]
+
+        expected = [cached_coords_to_hex(lat, lon) for lat, lon in zip(lats, lons)]
+        assert coords_to_hexes(lats, lons) == expected
+
+    def test_batch_wraps_like_single(self, h3_cache: None) -> None:
+        lats = [10.0] * 100 + [370.0]
+        lons = [10.0] * 101
+
+        hexes = coords_to_hexes(lats, lons)
+        assert len(set(hexes)) == 1
@@ -0,0 +1,52 @@
+import pytest
+
+from app.hll import HyperLogLog, precision_for_error
+
+
+def test_precision_for_error() -> None:
+    """Tighter error bounds should need more registers, within the limits."""
+    assert precision_for_error(0.02) == 12
+    assert precision_for_error(0.01) == 14
+    assert precision_for_error(0.5) == 4
+    assert precision_for_error(0.0001) == 16
+
+
+@pytest.mark.parametrize("cardinality", [10, 1_000, 50_000])
+def test_count_is_within_error(cardinality: int) -> None:
+    """Estimates should be within a few standard errors of the true count."""
+    sketch = HyperLogLog(precision=12)
+    sketch.update(f"device_{i}" for i in range(cardinality))
+    # Duplicates don't count.
+    sketch.update(f"device_{i}" for i in range(cardinality // 2))
+
+    assert abs(sketch.count() - cardinality) <= max(1, 0.05 * cardinality)
+
+
+def test_merge_matches_union() -> None:
+    """Merging sketches should give the same registers as one sketch of the union."""
+    left, right, union = HyperLogLog(10), HyperLogLog(10), HyperLogLog(10)
+    left.update(f"device_{i}" for i in range(0, 600))
+    right.update(f"device_{i}" for i in range(400, 1000))
+    union.update(f"device_{i}" for i in range(0, 1000))
+
+    left.merge(right)
+
+    assert left.to_bytes() == union.to_bytes()
+    with pytest.raises(ValueError):
+        left.merge(HyperLogLog(11))
+
+
+@pytest.mark.parametrize("cardinality", [3, 20_000])
+def test_serialization_round_trip(cardinality: int) -> None:
+    """Sparse and dense sketches should both survive a round trip."""
+    sketch = HyperLogLog(precision=12)
+    sketch.update(f"device_{i}" for i in range(cardinality))
+
+    data = sketch.to_bytes()
+    restored = HyperLogLog.from_bytes(data)
+
+    assert restored.precision == sketch.precision
+    assert restored.count() == sketch.count()
+    # A handful of devices should store far less than the full register array.
+    if cardinality < 100:
+        assert len(data) < 32
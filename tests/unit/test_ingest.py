@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+import json
+import struct
+from typing import Any, AsyncIterator, List
+
+import pytest
+
+from app.ingest import BodyTooLarge, TooManyPings, iter_lines, read_pings
+from app.models import PingPayload
+from app.wire import CONTENT_TYPE, encode_pings
+from tests.helpers import get_mock_ping_request
+
+
+async def _chunks(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def _read(content_type: str, *chunks: bytes, **kwargs: Any) -> List[Any]:
+    accepted_at = datetime.now(timezone.utc)
+    return [
+        item
+        async for item in read_pings(
+            content_type, _chunks(*chunks), accepted_at, **kwargs
+        )
+    ]
+
+
+async def test_lines_split_across_chunks() -> None:
+    """Lines should be reassembled however the body is chunked"""
+    lines = [line async for line in iter_lines(_chunks(b'{"a"', b": 1}\n\n{", b"}"))]
+
+    assert lines == [b'{"a": 1}', b"{}"]
+
+
+async def test_json_array_reports_each_item() -> None:
+    """Valid items should be stamped and invalid ones rejected in place"""
+    body = json.dumps(
+        [
+            get_mock_ping_request(return_instance=False),
+            get_mock_ping_request({"lat": 91}, return_instance=False),
+        ]
+    ).encode()
+
+    valid, invalid = await _read("application/json", body)
+
+    assert isinstance(valid, PingPayload)
+    assert valid.accepted_at is not None
+    assert invalid["status"] == "rejected"
+    assert invalid["errors"][0]["loc"][0] == "lat"
+
+
+async def test_ndjson_shares_accepted_at() -> None:
+    """Every ping in an upload should get the same accepted_at"""
+    line = json.dumps(get_mock_ping_request(return_instance=False)).encode()
+
+    items = await _read("application/x-ndjson", line + b"\n" + line + b"\nnot json")
+
+    assert items[0].accepted_at == items[1].accepted_at
+    assert items[2]["errors"][0]["type"] == "json_invalid"
+
+
+async def test_bad_bodies() -> None:
+    """Bodies that aren't an array, or are too long, should be refused outright"""
+    with pytest.raises(ValueError):
+        await _read("application/json", b'{"device_id": "abc123"}')
+
+    with pytest.raises(TooManyPings):
+        await _read("application/x-ndjson", b"{}\n{}\n{}", max_pings=2)
+
+    # Over the byte cap, however few pings it holds.
+    with pytest.raises(BodyTooLarge):
+        await _read("application/json", b"[", b" " * 10, b"]", max_bytes=8)
+
+
+async def test_binary_batch() -> None:
+    """Binary uploads should be validated per ping like JSON ones"""
+    pings = [get_mock_ping_request(), get_mock_ping_request({"device_id": "d2"})]
+    body = encode_pings(pings)
+
+    items = await _read(CONTENT_TYPE, body[:-2] + b"d3")
+
+    assert [item.device_id for item in items] == ["abc123", "d3"]
+    assert items[0].accepted_at == items[1].accepted_at
+
+    with pytest.raises(ValueError):
+        await _read(CONTENT_TYPE, body[:-1])
+
+
+async def test_binary_times_out_of_range() -> None:
+    """A timestamp no datetime can hold should only reject its own ping"""
+    pings = [get_mock_ping_request(), get_mock_ping_request({"device_id": "d2"})]
+    body = bytearray(encode_pings(pings))
+    # The first record's timestamp follows the version and count header.
+    struct.pack_into(">q", body, 5, 2**63 - 1)
+
+    invalid, valid = await _read(CONTENT_TYPE, bytes(body))
+
+    assert invalid["status"] == "rejected"
+    assert invalid["errors"][0]["loc"] == ("timestamp",)
+    assert isinstance(valid, PingPayload)
+    assert valid.device_id == "d2"
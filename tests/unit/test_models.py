@@ -28,6 +28,11 @@ class TestPingPayload:
         with pytest.raises(ValidationError):
             get_mock_ping_request({"device_id": ""})
 
+    def test_long_device_id(self) -> None:
+        """Test a device id too long to fit in a sort key"""
+        with pytest.raises(ValidationError):
+            get_mock_ping_request({"device_id": "d" * 1100})
+
     def test_missing_timestamp(self) -> None:
         """Test a missing timestamp"""
         with pytest.raises(ValidationError):
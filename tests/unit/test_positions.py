@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+from botocore.exceptions import ClientError
+from pytest_mock import MockerFixture
+
+from app.positions import PositionWriter
+from tests.helpers import make_ping_record
+
+
+class ConditionalCheckFailed(ClientError):
+    def __init__(self) -> None:
+        super().__init__(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+        )
+
+
+# Helper to mock a client whose device items remember the last hex, like DynamoDB
+def _mock_client(mocker: MockerFixture, previous_hex: str | None = None) -> Any:
+    dynamodb_client = mocker.AsyncMock()
+    dynamodb_client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailed
+    attributes = {"current_hex": {"S": previous_hex}} if previous_hex else {}
+    dynamodb_client.update_item.return_value = {"Attributes": attributes}
+    return dynamodb_client
+
+
+class TestPositionWriter:
+    async def test_only_the_latest_ping_is_written(self, mocker: MockerFixture) -> None:
+        """A device pinging many times between flushes should be written once"""
+        dynamodb_client = _mock_client(mocker)
+        writer = PositionWriter(dynamodb_client, "positions")
+
+        ts = datetime.now(timezone.utc)
+        latest = make_ping_record({"h3_hex": "hex_2", "ts": ts})
+        writer.add(
+            make_ping_record({"h3_hex": "hex_1", "ts": ts - timedelta(seconds=2)})
+        )
+        writer.add(latest)
+        # Arriving late shouldn't move the device back.
+        writer.add(
+            make_ping_record({"h3_hex": "hex_0", "ts": ts - timedelta(seconds=1)})
+        )
+        await writer.flush()
+
+        device, membership = dynamodb_client.update_item.await_args_list
+        assert device.kwargs["ExpressionAttributeValues"][":h3_hex"]["S"] == "hex_2"
+        assert membership.kwargs["Key"]["h3_hex"]["S"] == "hex_2"
+        dynamodb_client.delete_item.assert_not_awaited()
+
+    async def test_moving_leaves_the_old_hex(self, mocker: MockerFixture) -> None:
+        """A device seen in a new hex should join it and leave the previous one"""
+        dynamodb_client = _mock_client(mocker, previous_hex="hex_1")
+        writer = PositionWriter(dynamodb_client, "positions")
+
+        record = make_ping_record({"h3_hex": "hex_2"})
+        writer.add(record)
+        await writer.flush()
+
+        delete = dynamodb_client.delete_item.await_args.kwargs
+        assert delete["Key"] == {
+            "h3_hex": {"S": "hex_1"},
+            "device_id": {"S": record.device_id},
+        }
+        assert delete["ConditionExpression"] == "ts < :ts"
+
+    async def test_retried_moves_still_leave_the_old_hex(
+        self, mocker: MockerFixture
+    ) -> None:
+        """A move whose leave failed should leave on retry, though the device moved"""
+        dynamodb_client = _mock_client(mocker, previous_hex="hex_1")
+        dynamodb_client.delete_item.side_effect = [RuntimeError("throttled"), {}]
+        writer = PositionWriter(dynamodb_client, "positions")
+
+        record = make_ping_record({"h3_hex": "hex_2"})
+        writer.add(record)
+        await writer.flush()
+        # The device item was updated, so it reports the new hex from now on.
+        dynamodb_client.update_item.return_value = {
+            "Attributes": {"current_hex": {"S": "hex_2"}}
+        }
+        await writer.flush()
+
+        assert dynamodb_client.delete_item.await_count == 2
+        assert dynamodb_client.delete_item.await_args.kwargs["Key"] == {
+            "h3_hex": {"S": "hex_1"},
+            "device_id": {"S": record.device_id},
+        }
+        assert not writer._leaving
+
+    async def test_stale_pings_are_skipped(self, mocker: MockerFixture) -> None:
+        """A device already moved on by a newer ping shouldn't touch memberships"""
+        dynamodb_client = _mock_client(mocker)
+        dynamodb_client.update_item.side_effect = ConditionalCheckFailed()
+        writer = PositionWriter(dynamodb_client, "positions")
+
+        writer.add(make_ping_record())
+        await writer.flush()
+
+        assert dynamodb_client.update_item.await_count == 1
+        dynamodb_client.delete_item.assert_not_awaited()
+
+    async def test_failed_flush_is_retried(self, mocker: MockerFixture) -> None:
+        """Positions that fail to write should be kept for the next flush"""
+        calls = 0
+
+        async def _fail_once(**kwargs: Any) -> Dict[str, Any]:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RuntimeError("throttled")
+            return {}
+
+        dynamodb_client = _mock_client(mocker)
+        dynamodb_client.update_item.side_effect = _fail_once
+        writer = PositionWriter(dynamodb_client, "positions")
+
+        writer.add(make_ping_record())
+        await writer.flush()
+        await writer.flush()
+
+        # The failed device update, then the device and membership updates.
+        assert calls == 3
+
+    async def test_failing_devices_are_dropped(self, mocker: MockerFixture) -> None:
+        """A device that keeps failing should be dropped after max_attempts flushes"""
+        dynamodb_client = _mock_client(mocker)
+        dynamodb_client.update_item.side_effect = RuntimeError("throttled")
+        writer = PositionWriter(dynamodb_client, "positions", max_attempts=3)
+
+        writer.add(make_ping_record())
+        for _ in range(5):
+            await writer.flush()
+
+        assert dynamodb_client.update_item.await_count == 3
+        assert writer.dropped == 1
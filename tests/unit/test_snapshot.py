@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timezone
+import os
+from pathlib import Path
+from typing import Dict
+
+import h3  # type: ignore
+
+from app.snapshot import Snapshot, SnapshotProducer, SnapshotReader, write_snapshot
+
+CELLS = list(h3.cell_to_children(h3.latlng_to_cell(40.743, -73.989, 10), 12))
+
+
+class TestSnapshot:
+    def test_round_trip(self, tmp_path: Path) -> None:
+        """Counts written to a snapshot should be found by binary search"""
+        path = str(tmp_path / "congestion.snapshot")
+        counts = {cell: i + 1 for i, cell in enumerate(CELLS[::3])}
+        built_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        write_snapshot(path, counts, built_at)
+
+        snapshot = Snapshot(path)
+
+        assert len(snapshot) == len(counts)
+        assert snapshot.built_at == built_at
+        assert all(snapshot.get(cell) == count for cell, count in counts.items())
+        assert snapshot.get(CELLS[1]) == 0
+        assert dict(snapshot.items()) == counts
+
+    def test_empty(self, tmp_path: Path) -> None:
+        """A snapshot with no active hexes should still map"""
+        path = str(tmp_path / "congestion.snapshot")
+        write_snapshot(path, {}, datetime.now(timezone.utc))
+
+        snapshot = Snapshot(path)
+
+        assert len(snapshot) == 0
+        assert snapshot.get(CELLS[0]) == 0
+
+    def test_reader_follows_swaps(self, tmp_path: Path) -> None:
+        """A reader should keep its mapping until a new snapshot replaces it"""
+        path = str(tmp_path / "congestion.snapshot")
+        reader = SnapshotReader(path)
+        assert reader.current() is None
+
+        write_snapshot(path, {CELLS[0]: 1}, datetime.now(timezone.utc))
+        first = reader.current()
+        assert first is not None
+        assert reader.current() is first
+
+        write_snapshot(path, {CELLS[0]: 2}, datetime.now(timezone.utc))
+        second = reader.current()
+        assert second is not None and second is not first
+        assert second.get(CELLS[0]) == 2
+        # The replaced file is still mapped for anyone holding it.
+        assert first.get(CELLS[0]) == 1
+
+    def test_reader_keeps_the_last_good_snapshot(self, tmp_path: Path) -> None:
+        """A file that isn't a snapshot shouldn't replace a good one"""
+        path = str(tmp_path / "congestion.snapshot")
+        reader = SnapshotReader(path)
+        write_snapshot(path, {CELLS[0]: 1}, datetime.now(timezone.utc))
+        good = reader.current()
+
+        bad = tmp_path / "bad"
+        bad.write_bytes(b"not a snapshot" * 4)
+        os.replace(bad, path)
+
+        assert reader.current() is good
+
+
+class TestSnapshotProducer:
+    async def test_one_producer_at_a_time(self, tmp_path: Path) -> None:
+        """Only the producer holding the lock should write, until it stops"""
+        path = str(tmp_path / "congestion.snapshot")
+        loads: Dict[str, int] = {"first": 0, "second": 0}
+
+        def producer(name: str, count: int) -> SnapshotProducer:
+            async def _load() -> Dict[str, int]:
+                loads[name] += 1
+                return {CELLS[0]: count}
+
+            return SnapshotProducer(_load, path, interval_seconds=0.01)
+
+        first, second = producer("first", 1), producer("second", 2)
+        await first.start()
+        while not first.snapshots:
+            await asyncio.sleep(0.01)
+        await second.start()
+        await asyncio.sleep(0.05)
+
+        assert first.producing and not second.producing
+        assert loads["second"] == 0
+
+        # The lock is released on stop, and the other producer takes over.
+        await first.stop()
+        while not second.snapshots:
+            await asyncio.sleep(0.01)
+        await second.stop()
+
+        snapshot = Snapshot(path)
+        assert snapshot.get(CELLS[0]) == 2
+        assert snapshot.age_seconds < 5
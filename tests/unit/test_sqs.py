@@ -0,0 +1,254 @@
+import asyncio
+from typing import Any, Dict
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.sqs import SQSAcknowledger, SQSBatchProducer, SQSEnvelopeProducer
+from app.wire import decode_message
+from tests.helpers import get_mock_ping_request
+
+
+def _batch_response(**kwargs: Any) -> Dict[str, Any]:
+    """Echo every entry back as successful unless listed in `failed_ids`."""
+    failed_ids = kwargs.pop("failed_ids", set())
+    entries = kwargs["Entries"]
+    return {
+        "Successful": [
+            {"Id": entry["Id"], "MessageId": f"msg-{entry['Id']}"}
+            for entry in entries
+            if entry["Id"] not in failed_ids
+        ],
+        "Failed": [
+            {"Id": entry["Id"], "Code": "InternalError", "SenderFault": False}
+            for entry in entries
+            if entry["Id"] in failed_ids
+        ],
+    }
+
+
+class TestSQSBatchProducer:
+    async def test_concurrent_pings_share_a_batch(self, mocker: MockerFixture) -> None:
+        """Concurrent sends should go out in one SendMessageBatch call"""
+        sqs_client = mocker.AsyncMock()
+        sqs_client.send_message_batch.side_effect = _batch_response
+
+        producer = SQSBatchProducer(sqs_client, "queue-url", max_linger_ms=50)
+        await producer.start()
+
+        pings = [get_mock_ping_request({"device_id": f"d{i}"}) for i in range(10)]
+        message_ids = await asyncio.gather(*(producer.send(p) for p in pings))
+
+        await producer.stop()
+
+        assert sqs_client.send_message_batch.await_count == 1
+        assert message_ids == [f"msg-{i}" for i in range(10)]
+
+    async def test_batches_are_capped_at_ten(self, mocker: MockerFixture) -> None:
+        """More than 10 pings should be split into multiple batches"""
+        sqs_client = mocker.AsyncMock()
+        sqs_client.send_message_batch.side_effect = _batch_response
+
+        producer = SQSBatchProducer(sqs_client, "queue-url", max_linger_ms=50)
+        await producer.start()
+
+        pings = [get_mock_ping_request() for _ in range(25)]
+        await asyncio.gather(*(producer.send(p) for p in pings))
+
+        await producer.stop()
+
+        batch_sizes = [
+            len(call.kwargs["Entries"])
+            for call in sqs_client.send_message_batch.await_args_list
+        ]
+        assert sum(batch_sizes) == 25
+        assert max(batch_sizes) <= 10
+
+    async def test_partial_failure(self, mocker: MockerFixture) -> None:
+        """Only the failed entry should raise"""
+
+        async def _fail_second(**kwargs: Any) -> Dict[str, Any]:
+            return _batch_response(failed_ids={"1"}, **kwargs)
+
+        sqs_client = mocker.AsyncMock()
+        sqs_client.send_message_batch.side_effect = _fail_second
+
+        producer = SQSBatchProducer(sqs_client, "queue-url", max_linger_ms=50)
+        await producer.start()
+
+        pings = [get_mock_ping_request() for _ in range(3)]
+        results = await asyncio.gather(
+            *(producer.send(p) for p in pings), return_exceptions=True
+        )
+
+        await producer.stop()
+
+        assert results[0] == "msg-0"
+        assert isinstance(results[1], RuntimeError)
+        assert results[2] == "msg-2"
+
+    async def test_send_many(self, mocker: MockerFixture) -> None:
+        """Bulk pings should share a message only once multi-ping is enabled"""
+        sqs_client = mocker.AsyncMock()
+        sqs_client.send_message_batch.side_effect = _batch_response
+        pings = [get_mock_ping_request({"device_id": f"d{i}"}) for i in range(3)]
+
+        single = SQSBatchProducer(sqs_client, "queue-url", max_linger_ms=50)
+        multi = SQSBatchProducer(
+            sqs_client, "queue-url", max_linger_ms=50, multi_ping=True
+        )
+        await single.start()
+        await multi.start()
+        single_ids = await single.send_many(pings)
+        multi_ids = await multi.send_many(pings)
+        await single.stop()
+        await multi.stop()
+
+        first, second = sqs_client.send_message_batch.await_args_list
+        # One message per ping, each a plain JSON ping older workers can read.
+        assert len(set(single_ids)) == 3
+        assert [
+            decode_message(entry["MessageBody"])[0].device_id
+            for entry in first.kwargs["Entries"]
+        ] == ["d0", "d1", "d2"]
+        assert len(set(multi_ids)) == 1
+        assert len(decode_message(second.kwargs["Entries"][0]["MessageBody"])) == 3
+
+    async def test_batches_respect_size_limit(self, mocker: MockerFixture) -> None:
+        """A batch over the size limit should be split, an oversized entry sent alone"""
+        sqs_client = mocker.AsyncMock()
+        sqs_client.send_message_batch.side_effect = _batch_response
+
+        producer = SQSBatchProducer(
+            sqs_client, "queue-url", max_linger_ms=50, max_message_bytes=300
+        )
+        await producer.start()
+
+        pings = [get_mock_ping_request({"device_id": f"d{i}"}) for i in range(6)]
+        pings[2] = get_mock_ping_request({"device_id": "d" * 200})
+        message_ids = await asyncio.gather(*(producer.send(p) for p in pings))
+
+        await producer.stop()
+
+        calls = [
+            [entry["MessageBody"] for entry in call.kwargs["Entries"]]
+            for call in sqs_client.send_message_batch.await_args_list
+        ]
+        assert sum(len(bodies) for bodies in calls) == 6
+        assert len(message_ids) == 6
+        for bodies in calls:
+            size = sum(len(body.encode()) for body in bodies)
+            assert size <= 300 or len(bodies) == 1
+        assert ["d" * 200] in [
+            [decode_message(body)[0].device_id for body in bodies] for bodies in calls
+        ]
+
+    async def test_send_requires_start(self, mocker: MockerFixture) -> None:
+        """Sending before start should fail fast"""
+        producer = SQSBatchProducer(mocker.AsyncMock(), "queue-url")
+
+        with pytest.raises(RuntimeError):
+            await producer.send(get_mock_ping_request())
+
+
+class TestSQSEnvelopeProducer:
+    async def test_pings_share_an_envelope(self, mocker: MockerFixture) -> None:
+        """Concurrent pings should be packed into a single message"""
+        sqs_client = mocker.AsyncMock()
+        sqs_client.send_message_batch.side_effect = _batch_response
+
+        producer = SQSEnvelopeProducer(sqs_client, "queue-url", max_linger_ms=50)
+        await producer.start()
+        pings = [get_mock_ping_request({"device_id": f"d{i}"}) for i in range(500)]
+        message_ids = await asyncio.gather(*(producer.send(p) for p in pings))
+        await producer.stop()
+
+        assert set(message_ids) == {"msg-0"}
+        entries = sqs_client.send_message_batch.await_args.kwargs["Entries"]
+        assert len(decode_message(entries[0]["MessageBody"])) == 500
+
+    async def test_envelopes_respect_size_limit(self, mocker: MockerFixture) -> None:
+        """Envelopes and batch calls should stay under the size limit"""
+        sqs_client = mocker.AsyncMock()
+        sqs_client.send_message_batch.side_effect = _batch_response
+
+        producer = SQSEnvelopeProducer(
+            sqs_client, "queue-url", max_linger_ms=50, max_message_bytes=2048
+        )
+        await producer.start()
+        pings = [get_mock_ping_request({"device_id": f"d{i}"}) for i in range(300)]
+        await asyncio.gather(*(producer.send(p) for p in pings))
+        await producer.stop()
+
+        delivered = 0
+        for call in sqs_client.send_message_batch.await_args_list:
+            bodies = [entry["MessageBody"] for entry in call.kwargs["Entries"]]
+            assert len(bodies) <= 10
+            assert sum(len(body.encode()) for body in bodies) <= 2048
+            delivered += sum(len(decode_message(body)) for body in bodies)
+        assert delivered == 300
+
+    async def test_failed_envelope(self, mocker: MockerFixture) -> None:
+        """Only the pings in a failed envelope should raise"""
+
+        calls = 0
+
+        async def _fail_first_call(**kwargs: Any) -> Dict[str, Any]:
+            nonlocal calls
+            calls += 1
+            return _batch_response(failed_ids={"0"} if calls == 1 else set(), **kwargs)
+
+        sqs_client = mocker.AsyncMock()
+        sqs_client.send_message_batch.side_effect = _fail_first_call
+
+        producer = SQSEnvelopeProducer(
+            sqs_client, "queue-url", max_linger_ms=50, max_message_bytes=2048
+        )
+        await producer.start()
+        pings = [get_mock_ping_request() for _ in range(40)]
+        results = await asyncio.gather(
+            *(producer.send(p) for p in pings), return_exceptions=True
+        )
+        await producer.stop()
+
+        failed = [r for r in results if isinstance(r, RuntimeError)]
+        assert 0 < len(failed) < len(pings)
+
+
+class TestSQSAcknowledger:
+    async def test_acks_share_a_batch(self, mocker: MockerFixture) -> None:
+        """Concurrent acks should go out in one DeleteMessageBatch call"""
+        sqs_client = mocker.AsyncMock()
+        sqs_client.delete_message_batch.return_value = {}
+
+        acknowledger = SQSAcknowledger(sqs_client, "queue-url", max_linger_ms=50)
+        await acknowledger.start()
+        await asyncio.gather(*(acknowledger.ack(f"rh-{i}") for i in range(10)))
+        await acknowledger.stop()
+
+        assert sqs_client.delete_message_batch.await_count == 1
+
+    async def test_heartbeat_extends_tracked(self, mocker: MockerFixture) -> None:
+        """Tracked messages should have their visibility extended until acked"""
+        sqs_client = mocker.AsyncMock()
+        sqs_client.delete_message_batch.return_value = {}
+        sqs_client.change_message_visibility_batch.return_value = {}
+
+        acknowledger = SQSAcknowledger(
+            sqs_client, "queue-url", max_linger_ms=1, heartbeat_seconds=0.01
+        )
+        await acknowledger.start()
+
+        acknowledger.track("rh-slow")
+        acknowledger.track("rh-fast")
+        await acknowledger.ack("rh-fast")
+        await asyncio.sleep(0.05)
+
+        await acknowledger.stop()
+
+        extended = {
+            entry["ReceiptHandle"]
+            for call in sqs_client.change_message_visibility_batch.await_args_list
+            for entry in call.kwargs["Entries"]
+        }
+        assert extended == {"rh-slow"}
@@ -0,0 +1,96 @@
+import os
+from pathlib import Path
+import signal
+import threading
+import time
+from typing import Callable, List
+
+import pytest
+
+from app.engine import WorkerStats
+from app.supervisor import ProcessSummary, Supervisor, restart_delay
+
+# Children can't share fixtures with the test, so they coordinate through files.
+_STATE_DIR = "SUPERVISOR_TEST_DIR"
+
+
+def _record_start(index: int) -> int:
+    path = Path(os.environ[_STATE_DIR]) / f"starts-{index}"
+    starts = int(path.read_text()) + 1 if path.exists() else 1
+    # Replace rather than rewrite, so the test never reads a half written count.
+    temp = path.with_suffix(".tmp")
+    temp.write_text(str(starts))
+    os.replace(temp, path)
+    return starts
+
+
+# Crashes on its first start, then runs until told to stop
+def _flaky_worker(index: int) -> WorkerStats:
+    # Handle SIGTERM before recording the start, so the test never stops us early.
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    if _record_start(index) == 1:
+        raise RuntimeError("boom")
+    while not stopped.wait(0.05):
+        pass
+    return WorkerStats(received=10, stored=index)
+
+
+def _starts(directory: Path, index: int) -> int:
+    path = directory / f"starts-{index}"
+    return int(path.read_text()) if path.exists() else 0
+
+
+def _wait_until(condition: Callable[[], bool], timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.05)
+    raise AssertionError("Timed out")
+
+
+def test_restart_delay_doubles_up_to_the_max() -> None:
+    assert [restart_delay(failures, 1, 10) for failures in range(6)] == [
+        1,
+        2,
+        4,
+        8,
+        10,
+        10,
+    ]
+
+
+def test_needs_a_process() -> None:
+    with pytest.raises(ValueError):
+        Supervisor(_flaky_worker, 0)
+
+
+def test_restarts_crashed_children_and_summarizes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv(_STATE_DIR, str(tmp_path))
+    supervisor = Supervisor(
+        _flaky_worker,
+        2,
+        backoff_base_seconds=0.05,
+        backoff_max_seconds=1,
+        shutdown_timeout_seconds=5,
+    )
+    summaries: List[ProcessSummary] = []
+    runner = threading.Thread(target=lambda: summaries.extend(supervisor.run()))
+    runner.start()
+
+    try:
+        # Both slots crash once and come back.
+        _wait_until(lambda: all(_starts(tmp_path, i) == 2 for i in range(2)))
+    finally:
+        supervisor.stop()
+        runner.join(10)
+
+    assert not runner.is_alive()
+    assert [summary.restarts for summary in summaries] == [1, 1]
+    assert all(len(summary.pids) == 2 for summary in summaries)
+    # Only the restarted children got to report, after SIGTERM.
+    assert [summary.received for summary in summaries] == [10, 10]
+    assert [summary.stored for summary in summaries] == [0, 1]
@@ -0,0 +1,193 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, List
+
+from pytest_mock import MockerFixture
+
+from app.congestion import DeviceCongestion, GroupCongestion
+from app.models import DeviceSighting
+from app.window import CongestionWindow, SlidingWindow
+
+NOW = datetime(2025, 1, 1, 12, 0, 30, tzinfo=timezone.utc)
+
+
+def _seen(h3_hex: str, device_id: str, minutes_ago: float) -> DeviceSighting:
+    return DeviceSighting(h3_hex, device_id, NOW - timedelta(minutes=minutes_ago))
+
+
+class TestSlidingWindow:
+    def test_collects_distinct_devices(self) -> None:
+        """Re-reading or repeating a device should only count it once per hex"""
+        window = SlidingWindow(window_minutes=5, skew_seconds=0)
+        sightings = [
+            _seen("hex_1", "d1", 0),
+            _seen("hex_1", "d1", 1),
+            _seen("hex_1", "d2", 2),
+            _seen("hex_2", "d1", 3),
+        ]
+        window.add(sightings)
+        window.add(sightings)
+
+        congestion = DeviceCongestion()
+        window.collect(congestion, NOW - timedelta(minutes=5))
+
+        assert congestion.results() == {"hex_1": 2, "hex_2": 1}
+
+    def test_single_hex_and_area(self) -> None:
+        """A hex or an area filter should only feed the matching hexes"""
+        window = SlidingWindow(window_minutes=5, skew_seconds=0)
+        window.add(
+            [_seen("hex_1", "d1", 0), _seen("hex_2", "d2", 0), _seen("hex_3", "d3", 1)]
+        )
+        cutoff = NOW - timedelta(minutes=5)
+
+        single = DeviceCongestion()
+        window.collect(single, cutoff, h3_hex="hex_2")
+        area = DeviceCongestion()
+        window.collect(area, cutoff, contains=lambda h3_hex: h3_hex != "hex_2")
+
+        assert single.results() == {"hex_2": 1}
+        assert area.results() == {"hex_1": 1, "hex_3": 1}
+
+    def test_old_minutes_are_not_counted(self) -> None:
+        """Minutes before the cutoff, or overwritten by the ring, should drop out"""
+        window = SlidingWindow(window_minutes=5, skew_seconds=0)
+        window.add([_seen("hex_1", "d1", 8), _seen("hex_1", "d2", 4)])
+        # Six slots, so this lands on the slot the 8 minute old sighting used.
+        window.add([_seen("hex_1", "d3", 2)])
+        # And a sighting for a minute the ring has already moved past is dropped.
+        window.add([_seen("hex_1", "d4", 8)])
+
+        congestion = DeviceCongestion()
+        window.collect(congestion, NOW - timedelta(minutes=10))
+        assert congestion.results() == {"hex_1": 2}
+
+        window.expire(NOW - timedelta(minutes=3))
+        assert window.entries() == 1
+
+    def test_groups(self) -> None:
+        """Grouped aggregators should get each hex's devices"""
+        window = SlidingWindow(window_minutes=5, skew_seconds=0)
+        window.add(
+            [
+                _seen("8c2a100d2189bff", "d1", 0),
+                _seen("8c2a100d2189dff", "d2", 1),
+                _seen("8c2a100d2189dff", "d1", 2),
+            ]
+        )
+
+        congestion = GroupCongestion(resolution=9)
+        window.collect(congestion, NOW - timedelta(minutes=5))
+
+        group = congestion.results()["892a100d21bffff"]
+        assert group["device_count"] == 2
+        assert group["active_hex_count"] == 2
+
+
+class TestCongestionWindow:
+    async def test_hydrates_then_polls(self, mocker: MockerFixture) -> None:
+        """The window should read the whole window once, then tail new writes"""
+        cutoffs: List[datetime] = []
+        since: List[datetime] = []
+
+        async def iter_recent_sightings(
+            client: Any, table: str, cutoff: datetime
+        ) -> AsyncIterator[List[DeviceSighting]]:
+            cutoffs.append(cutoff)
+            yield [DeviceSighting("hex_1", "d1", datetime.now(timezone.utc))]
+
+        async def iter_written_sightings(
+            client: Any, table: str, written_since: datetime
+        ) -> AsyncIterator[List[DeviceSighting]]:
+            since.append(written_since)
+            # Written just now, but sat in the queue for a few minutes.
+            late = datetime.now(timezone.utc) - timedelta(minutes=3)
+            yield [DeviceSighting("hex_2", "d2", late)]
+
+        mocker.patch("app.window.iter_recent_sightings", iter_recent_sightings)
+        mocker.patch("app.window.iter_written_sightings", iter_written_sightings)
+        window = CongestionWindow(
+            mocker.AsyncMock(),
+            "pings",
+            window_minutes=5,
+            poll_seconds=0.01,
+            lookback_seconds=20,
+        )
+
+        await window.start()
+        await asyncio.wait_for(window.ready.wait(), timeout=1)
+        while len(since) < 3:
+            await asyncio.sleep(0.01)
+        await window.stop()
+
+        assert len(cutoffs) == 1
+        assert datetime.now(timezone.utc) - cutoffs[0] >= timedelta(minutes=5)
+        # Each poll tails from where the last read started, less the lookback.
+        assert all(
+            timedelta(seconds=20)
+            <= datetime.now(timezone.utc) - written_since
+            < timedelta(seconds=21)
+            for written_since in since
+        )
+        assert since == sorted(since)
+        assert window.stats()["ready"]
+        assert window.stats()["entries"] == 2
+
+    async def test_hydration_retries(self, mocker: MockerFixture) -> None:
+        """A failed startup read shouldn't leave the window half ready"""
+        calls = 0
+
+        async def iter_recent_sightings(
+            client: Any, table: str, cutoff: datetime
+        ) -> AsyncIterator[List[DeviceSighting]]:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RuntimeError("throttled")
+            yield []
+
+        mocker.patch("app.window.iter_recent_sightings", iter_recent_sightings)
+        mocker.patch("app.window.iter_written_sightings", _no_writes)
+        window = CongestionWindow(mocker.AsyncMock(), "pings", poll_seconds=0.01)
+
+        await window.start()
+        await asyncio.wait_for(window.ready.wait(), timeout=1)
+        await window.stop()
+
+        assert calls >= 2
+
+    async def test_goes_stale_when_polls_fail(self, mocker: MockerFixture) -> None:
+        """A window whose polls keep failing should stop answering"""
+        since: List[datetime] = []
+
+        async def iter_written_sightings(
+            client: Any, table: str, written_since: datetime
+        ) -> AsyncIterator[List[DeviceSighting]]:
+            since.append(written_since)
+            raise RuntimeError("throttled")
+            yield []
+
+        mocker.patch("app.window.iter_recent_sightings", _no_writes)
+        mocker.patch("app.window.iter_written_sightings", iter_written_sightings)
+        window = CongestionWindow(
+            mocker.AsyncMock(), "pings", poll_seconds=0.01, max_staleness_seconds=0.05
+        )
+
+        await window.start()
+        await asyncio.wait_for(window.ready.wait(), timeout=1)
+        assert window.fresh
+        await asyncio.sleep(0.1)
+        await window.stop()
+
+        assert len(since) > 1
+        # Failed polls are read again from the same point, nothing is skipped.
+        assert len(set(since)) == 1
+        assert window.ready.is_set()
+        assert not window.fresh
+        assert not window.stats()["fresh"]
+
+
+async def _no_writes(
+    client: Any, table: str, cutoff: datetime
+) -> AsyncIterator[List[DeviceSighting]]:
+    yield []
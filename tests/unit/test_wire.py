@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+import pytest
+from pydantic import ValidationError
+
+from app.wire import (
+    WireFormatError,
+    decode_message,
+    decode_pings,
+    encode_message,
+    encode_pings,
+    iter_raw_pings,
+    raw_to_ping,
+)
+from tests.helpers import get_mock_ping_request
+
+
+def test_round_trip() -> None:
+    """Pings should survive encoding, to the millisecond"""
+    pings = [
+        get_mock_ping_request({"device_id": f"dévice-{i}", "lat": -i, "lon": i})
+        for i in range(3)
+    ]
+    pings[0].accepted_at = datetime.now(timezone.utc)
+
+    decoded = decode_pings(encode_pings(pings))
+
+    assert [p.device_id for p in decoded] == [p.device_id for p in pings]
+    assert [(p.lat, p.lon) for p in decoded] == [(p.lat, p.lon) for p in pings]
+    for original, ping in zip(pings, decoded):
+        delta = abs((ping.timestamp - original.timestamp).total_seconds())
+        assert delta < 0.001
+    assert decoded[0].accepted_at is not None
+    assert decoded[1].accepted_at is None
+
+
+def test_out_of_range_values_are_validated() -> None:
+    """Values the fast path can't vouch for should fail like JSON would"""
+    raw = next(iter_raw_pings(encode_pings([get_mock_ping_request()])))
+
+    with pytest.raises(ValidationError):
+        raw_to_ping((raw[0], raw[1], raw[2], 91.0, raw[4]))
+    with pytest.raises(ValidationError):
+        raw_to_ping(("", raw[1], raw[2], raw[3], raw[4]))
+    with pytest.raises(ValidationError):
+        raw_to_ping(("d" * 1100, raw[1], raw[2], raw[3], raw[4]))
+
+
+@pytest.mark.parametrize("cut", [1, 10, -1])
+def test_malformed_bodies(cut: int) -> None:
+    """Truncated bodies should be refused rather than half decoded"""
+    body = encode_pings([get_mock_ping_request(), get_mock_ping_request()])
+
+    with pytest.raises(WireFormatError):
+        decode_pings(body[:cut])
+    with pytest.raises(WireFormatError):
+        decode_pings(body + b"\x00")
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_messages_carry_several_pings(binary: bool) -> None:
+    """Queue messages should decode back to every ping they carry"""
+    pings = [get_mock_ping_request({"device_id": f"d{i}"}) for i in range(5)]
+
+    decoded = decode_message(encode_message(pings, binary=binary))
+
+    assert [p.device_id for p in decoded] == [f"d{i}" for i in range(5)]
+
+
+def test_single_json_messages_still_decode() -> None:
+    """Messages already on the queue are one JSON ping each"""
+    ping = get_mock_ping_request()
+
+    assert decode_message(ping.model_dump_json()) == [ping]
@@ -0,0 +1,217 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import os
+from typing import Any
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.coalescing import WriteCoalescer
+from app.wire import decode_message, encode_message
+from app.utils import coords_to_hex
+from app.settings import settings
+from app.worker import (
+    REQUEUE_ATTEMPTS_ATTRIBUTE,
+    EnrichmentPool,
+    handle_message,
+    prepare_bodies,
+)
+from tests.helpers import get_mock_ping_request
+
+
+async def _handle(
+    mocker: MockerFixture,
+    body: str,
+    failing: str,
+    requeues: int = 0,
+    receives: int = 1,
+) -> Any:
+    """Handle one message with a table that fails writes for one device"""
+
+    async def _put_item(**kwargs: Any) -> None:
+        if kwargs["Item"]["device_id"]["S"] == failing:
+            raise RuntimeError("Throttled")
+
+    sqs_client = mocker.AsyncMock()
+    dynamodb_client = mocker.AsyncMock()
+    dynamodb_client.put_item.side_effect = _put_item
+
+    stored = await handle_message(
+        sqs_client,
+        "queue-url",
+        dynamodb_client,
+        "table",
+        {
+            "Body": body,
+            "ReceiptHandle": "rh",
+            "Attributes": {"ApproximateReceiveCount": str(receives)},
+            "MessageAttributes": {
+                REQUEUE_ATTEMPTS_ATTRIBUTE: {
+                    "DataType": "Number",
+                    "StringValue": str(requeues),
+                }
+            },
+        },
+    )
+    return stored, sqs_client
+
+
+def _envelope(count: int, binary: bool) -> str:
+    pings = [get_mock_ping_request({"device_id": f"d{i}"}) for i in range(count)]
+    for ping in pings:
+        ping.accepted_at = ping.timestamp
+    return encode_message(pings, binary)
+
+
+async def test_only_failed_pings_are_requeued(mocker: MockerFixture) -> None:
+    """A failed ping should be requeued alone and the envelope deleted"""
+    stored, sqs_client = await _handle(mocker, _envelope(5, binary=True), "d3")
+
+    assert len(stored) == 4
+    requeued = sqs_client.send_message.await_args.kwargs
+    assert [ping.device_id for ping in decode_message(requeued["MessageBody"])] == [
+        "d3"
+    ]
+    attempts = requeued["MessageAttributes"][REQUEUE_ATTEMPTS_ATTRIBUTE]
+    assert attempts["StringValue"] == "1"
+    sqs_client.delete_message.assert_awaited_once()
+
+
+async def test_requeues_are_capped(mocker: MockerFixture) -> None:
+    """A ping that keeps failing should be dropped, not requeued forever"""
+    stored, sqs_client = await _handle(
+        mocker,
+        _envelope(5, binary=True),
+        "d3",
+        requeues=settings.worker_max_requeues,
+    )
+
+    assert len(stored) == 4
+    sqs_client.send_message.assert_not_awaited()
+    sqs_client.delete_message.assert_awaited_once()
+
+
+async def test_single_ping_is_redelivered(mocker: MockerFixture) -> None:
+    """With nothing stored the message itself should be left for redelivery"""
+    stored, sqs_client = await _handle(mocker, _envelope(1, binary=False), "d0")
+
+    assert stored == []
+    sqs_client.send_message.assert_not_awaited()
+    sqs_client.delete_message.assert_not_awaited()
+
+
+async def test_requeued_ping_that_fails_again_is_dropped(
+    mocker: MockerFixture,
+) -> None:
+    """A requeued ping failing on its own should count towards the cap too"""
+    requeued, sqs_client = await _handle(
+        mocker,
+        _envelope(1, binary=True),
+        "d0",
+        requeues=settings.worker_max_requeues - 1,
+    )
+
+    # Below the cap it's left on the queue, and each redelivery counts.
+    assert requeued == []
+    sqs_client.delete_message.assert_not_awaited()
+
+    dropped, sqs_client = await _handle(
+        mocker,
+        _envelope(1, binary=True),
+        "d0",
+        requeues=settings.worker_max_requeues - 1,
+        receives=2,
+    )
+
+    assert dropped == []
+    sqs_client.send_message.assert_not_awaited()
+    sqs_client.delete_message.assert_awaited_once()
+
+
+def test_prepare_bodies_returns_compact_records() -> None:
+    """Each body should come back as plain record values, or why it failed"""
+    prepared = prepare_bodies([_envelope(2, binary=True), "not a ping"])
+
+    records, error = prepared
+    assert isinstance(records, list)
+    assert [values[1] for values in records] == ["d0", "d1"]
+    assert isinstance(error, str)
+
+
+async def test_enrichment_pool_prepares_in_processes(mocker: MockerFixture) -> None:
+    """Messages prepared in the pool should be stored, and bad bodies dropped"""
+    sqs_client = mocker.AsyncMock()
+    dynamodb_client = mocker.AsyncMock()
+
+    pool = EnrichmentPool(processes=1, chunk_size=10)
+    await pool.start()
+    try:
+        stored, dropped = await asyncio.gather(
+            *(
+                handle_message(
+                    sqs_client,
+                    "queue-url",
+                    dynamodb_client,
+                    "table",
+                    {"Body": body, "ReceiptHandle": f"rh-{i}"},
+                    enrichment_pool=pool,
+                )
+                for i, body in enumerate([_envelope(3, binary=False), "{}"])
+            )
+        )
+    finally:
+        await pool.stop()
+
+    assert [record.device_id for record in stored] == ["d0", "d1", "d2"]
+    assert stored[0].h3_hex == coords_to_hex(stored[0].lat, stored[0].lon)
+    assert dropped == []
+    assert dynamodb_client.put_item.await_count == 3
+    assert sqs_client.delete_message.await_count == 2
+
+
+async def test_enrichment_pool_recovers(mocker: MockerFixture) -> None:
+    """A pool whose child died should be replaced and the chunk retried"""
+    pool = EnrichmentPool(processes=1, chunk_size=10)
+    await pool.start()
+    try:
+        # Kill the only child, like the OOM killer would.
+        assert pool._executor is not None
+        with pytest.raises(BrokenProcessPool):
+            pool._executor.submit(os._exit, 1).result()
+
+        stored = await handle_message(
+            mocker.AsyncMock(),
+            "queue-url",
+            mocker.AsyncMock(),
+            "table",
+            {"Body": _envelope(2, binary=False), "ReceiptHandle": "rh"},
+            enrichment_pool=pool,
+        )
+    finally:
+        await pool.stop()
+
+    assert [record.device_id for record in stored] == ["d0", "d1"]
+
+
+async def test_coalesced_pings_skip_the_write(mocker: MockerFixture) -> None:
+    """Repeat pings from the same cell should be handled without writing them"""
+    pings = [get_mock_ping_request({"device_id": "d0"}) for _ in range(3)]
+    for ping in pings:
+        ping.accepted_at = ping.timestamp
+    sqs_client = mocker.AsyncMock()
+    dynamodb_client = mocker.AsyncMock()
+    coalescer = WriteCoalescer(refresh_seconds=60)
+
+    stored = await handle_message(
+        sqs_client,
+        "queue-url",
+        dynamodb_client,
+        "table",
+        {"Body": encode_message(pings, binary=True), "ReceiptHandle": "rh"},
+        write_coalescer=coalescer,
+    )
+
+    assert len(stored) == 3
+    dynamodb_client.put_item.assert_awaited_once()
+    assert coalescer.stats.suppressed == 2
+    sqs_client.delete_message.assert_awaited_once()